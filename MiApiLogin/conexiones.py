@@ -0,0 +1,305 @@
+"""
+Pool de conexiones para las Azure Functions de MiApiLogin.
+
+El pool vive a nivel de módulo, así que las invocaciones "en caliente" de la
+misma instancia reutilizan las conexiones en vez de abrir una por request
+(en el cambio de turno eso es lo que domina la latencia y agota
+max_connections de Postgres). Es independiente de db.py porque esta app se
+despliega sola y no tiene Flask.
+
+Configuración por variables de entorno (local.settings.json / App Settings):
+  PG_POOL_MAX          máximo de conexiones por instancia (default 5)
+  PG_POOL_TIMEOUT      segundos que se espera por una conexión libre (default 10)
+  PG_POOL_CHECK        segundos de inactividad tras los cuales se hace un
+                       "SELECT 1" antes de entregar la conexión (default 30, 0 = siempre)
+  PG_POOL_VIDA_MAX     segundos tras los cuales una conexión se recicla (default 1800)
+  PG_CONNECT_TIMEOUT   timeout de conexión a Postgres en segundos (default 5)
+  PG_POOL_LENTO        se registra un warning si obtener conexión tarda más (default 0.5)
+
+Antes de entregar una conexión ociosa se mira si su socket tiene algo que
+leer (sin ida y vuelta al servidor): si Postgres la cerró (reinicio,
+failover) se verifica con "SELECT 1" y se reemplaza por una nueva. Si una
+conexión se cae durante un request, se descarta y todas las ociosas se
+verifican antes de volver a entregarse.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+import instrumentacion
+
+
+def _int_env(nombre, default):
+    try:
+        return int(os.getenv(nombre, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _float_env(nombre, default):
+    try:
+        return float(os.getenv(nombre, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _connect():
+    return psycopg2.connect(
+        host=os.environ["PGHOST"],
+        database=os.environ["PGDATABASE"],
+        user=os.environ["PGUSER"],
+        password=os.environ["PGPASSWORD"],
+        port=os.environ["PGPORT"],
+        connect_timeout=_int_env("PG_CONNECT_TIMEOUT", 5),
+        application_name="MiApiLogin",
+        # Detecta conexiones muertas (failover, NAT de Azure) sin esperar al TCP
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3,
+        # Cada sentencia queda medida por función (ver instrumentacion.py)
+        connection_factory=instrumentacion.ConexionMedida,
+    )
+
+
+# Límites (segundos) del histograma de espera al obtener conexión
+BUCKETS_ESPERA = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No se liberó ninguna conexión dentro de PG_POOL_TIMEOUT."""
+
+
+class Pool:
+    """
+    Pool thread-safe y acotado de conexiones psycopg2, con verificación de
+    salud al entregar, reciclaje por antigüedad y métricas de espera.
+    """
+
+    def __init__(self, maxconn=5, timeout=10.0, check_idle=30.0, vida_max=1800.0, lento=0.5,
+                 connect=_connect):
+        if maxconn < 1:
+            raise ValueError("Tamaño de pool inválido: max=%s" % maxconn)
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.vida_max = vida_max
+        self.lento = lento
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = deque()   # (conn, creada, devuelta)
+        self._creada = {}      # id(conn) -> instante de creación
+        self._abiertas = 0
+        self._en_uso = 0
+        self._ultimo_fallo = 0.0
+        # Métricas acumuladas
+        self._checkouts = 0
+        self._nuevas = 0
+        self._reutilizadas = 0
+        self._descartadas = 0
+        self._timeouts = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._buckets = [0] * len(BUCKETS_ESPERA)
+
+    def getconn(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, creada, devuelta = self._idle.pop()
+                    break
+                if self._abiertas < self.maxconn:
+                    # Reservamos el cupo antes de conectar fuera del lock
+                    self._abiertas += 1
+                    conn = creada = devuelta = None
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout("No hay conexiones libres en el pool (max=%s)" % self.maxconn)
+                self._cond.wait(restante)
+
+        if conn is not None and self.vida_max > 0 and time.monotonic() - creada > self.vida_max:
+            # Reciclaje por antigüedad; el cupo pasa a la conexión nueva
+            self._descartar(conn, fallo=False, liberar_cupo=False)
+            conn = None
+        elif conn is not None and not self._sana(conn, devuelta):
+            self._descartar(conn, liberar_cupo=False)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._abiertas -= 1
+                    self._cond.notify()
+                raise
+            nueva = True
+        else:
+            nueva = False
+
+        espera = time.monotonic() - inicio
+        with self._cond:
+            if nueva:
+                self._nuevas += 1
+                self._creada[id(conn)] = time.monotonic()
+            else:
+                self._reutilizadas += 1
+            self._en_uso += 1
+            self._checkouts += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+            for i, limite_bucket in enumerate(BUCKETS_ESPERA):
+                if espera <= limite_bucket:
+                    self._buckets[i] += 1
+        if espera > self.lento:
+            logging.warning("Obtener conexión tardó %.3fs (nueva=%s, en uso=%s/%s)",
+                            espera, nueva, self._en_uso, self.maxconn)
+        return conn
+
+    def _sana(self, conn, devuelta):
+        if conn.closed:
+            return False
+        # Una conexión ociosa no debería tener nada que leer: si el socket está
+        # legible, el servidor la cerró (reinicio, failover) o mandó un aviso.
+        try:
+            legible = bool(select.select([conn], [], [], 0)[0])
+        except (OSError, ValueError):
+            return False
+        # Tras una caída se verifican todas las que estaban ociosas desde antes
+        if (not legible and devuelta > self._ultimo_fallo
+                and self.check_idle > 0 and time.monotonic() - devuelta < self.check_idle):
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _descartar(self, conn, fallo=True, liberar_cupo=True):
+        with self._cond:
+            if liberar_cupo:
+                self._abiertas -= 1
+                self._cond.notify()
+            self._descartadas += 1
+            self._creada.pop(id(conn), None)
+            if fallo:
+                self._ultimo_fallo = time.monotonic()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def putconn(self, conn):
+        """Devuelve la conexión al pool dejando la transacción limpia."""
+        with self._cond:
+            self._en_uso -= 1
+        if not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                self._descartar(conn)
+                return
+        if conn.closed:
+            # Se cayó durante el request (failover, red): no vuelve al pool
+            self._descartar(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, self._creada.get(id(conn), 0.0), time.monotonic()))
+            self._cond.notify()
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "max": self.maxconn,
+                "abiertas": self._abiertas,
+                "en_uso": self._en_uso,
+                "libres": len(self._idle),
+                "checkouts_total": self._checkouts,
+                "nuevas_total": self._nuevas,
+                "reutilizadas_total": self._reutilizadas,
+                "descartadas_total": self._descartadas,
+                "timeouts_total": self._timeouts,
+                "espera_segundos_total": round(self._espera_total, 6),
+                "espera_segundos_max": round(self._espera_max, 6),
+                "espera_histograma": {str(b): n for b, n in zip(BUCKETS_ESPERA, self._buckets)},
+            }
+
+
+class ConexionPrestada:
+    """
+    Envoltorio sobre la conexión prestada por el pool: se usa como una
+    conexión psycopg2 normal, pero `close()` la devuelve al pool (una sola
+    vez, aunque se llame de nuevo) en vez de cerrar el socket.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, nombre):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise psycopg2.InterfaceError("La conexión ya fue devuelta al pool")
+        return getattr(conn, nombre)
+
+    def __setattr__(self, nombre, valor):
+        if nombre.startswith("_"):
+            object.__setattr__(self, nombre, valor)
+        else:
+            setattr(self._conn, nombre, valor)
+
+    @property
+    def closed(self):
+        conn = self.__dict__.get("_conn")
+        return 1 if conn is None else conn.closed
+
+    def close(self):
+        conn = self.__dict__.get("_conn")
+        if conn is not None:
+            self._conn = None
+            self._pool.putconn(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = Pool(
+                    maxconn=_int_env("PG_POOL_MAX", 5),
+                    timeout=_float_env("PG_POOL_TIMEOUT", 10.0),
+                    check_idle=_float_env("PG_POOL_CHECK", 30.0),
+                    vida_max=_float_env("PG_POOL_VIDA_MAX", 1800.0),
+                    lento=_float_env("PG_POOL_LENTO", 0.5),
+                )
+    return _pool
+
+
+def get_conn():
+    """Conexión del pool; `close()` la devuelve para la siguiente invocación."""
+    pool = get_pool()
+    return ConexionPrestada(pool, pool.getconn())
+
+
+def estadisticas():
+    """Métricas del pool de esta instancia, o None si todavía no se creó."""
+    return _pool.estadisticas() if _pool is not None else None
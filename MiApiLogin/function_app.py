@@ -1,8 +1,9 @@
 import azure.functions as func
 from azure.functions import FunctionApp
-import psycopg2
-import os
 import json
+import os
+import base64
+import hashlib
 import pytz
 from datetime import date, time, datetime
 
@@ -14,14 +15,13 @@ app = FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 # =========================
 # Helpers de conexión
 # =========================
-def get_conn():
-    return psycopg2.connect(
-        host=os.environ["PGHOST"],
-        database=os.environ["PGDATABASE"],
-        user=os.environ["PGUSER"],
-        password=os.environ["PGPASSWORD"],
-        port=os.environ["PGPORT"]
-    )
+# get_conn() entrega una conexión del pool de la instancia (ver conexiones.py);
+# conn.close() la devuelve al pool en vez de cerrarla.
+from conexiones import get_conn, estadisticas as pool_estadisticas
+import instrumentacion
+import marcaje
+import serializacion
+import sincronizacion
 
 # =========================
 # Helpers de Formato
@@ -75,7 +75,9 @@ def serialize_registro_min(row):
 # =========================
 @app.function_name(name="login")
 @app.route(route="login", methods=["POST"])
+@instrumentacion.medido
 def login(req: func.HttpRequest) -> func.HttpResponse:
+    conn = None
     try:
         data = req.get_json()
         email = data.get("email")
@@ -123,12 +125,16 @@ def login(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
             status_code=500
         )
+    finally:
+        # Devuelve la conexión al pool (no hace nada si ya se devolvió)
+        if conn: conn.close()
 
 # =========================
 # /api/asistencia/mensaje (actualiza última asistencia con mensaje)
 # =========================
 @app.function_name(name="asistencia_mensaje_upsert_ultima")
 @app.route(route="asistencia/mensaje", methods=["POST"])
+@instrumentacion.medido
 def asistencia_mensaje_upsert_ultima(req: func.HttpRequest) -> func.HttpResponse:
     conn = None
     try:
@@ -264,13 +270,121 @@ def asistencia_mensaje_upsert_ultima(req: func.HttpRequest) -> func.HttpResponse
             mimetype="application/json",
             status_code=500
         )
+    finally:
+        # Devuelve la conexión al pool (no hace nada si ya se devolvió)
+        if conn: conn.close()
 
 # =========================
 # /api/asistencia/listar
 # =========================
+# Sin parámetros extra devuelve el historial completo, como siempre. Con
+# `since` (el "cursor" de una respuesta anterior), `limit` o `page` devuelve
+# solo las filas escritas desde ese cursor, ordenadas por cambio y paginadas:
+# si quedan más, la respuesta trae "siguiente" (se pasa como `page`); si no,
+# trae "cursor" para el próximo `since`. Una fila puede repetirse entre
+# sincronizaciones (el cliente la reemplaza por id), pero nunca se salta.
+# Todas las respuestas llevan ETag: con If-None-Match y sin cambios → 304.
+# "borrados" cuenta las asistencias del trabajador que se borraron; si cambia
+# respecto de la respuesta anterior, conviene pedir el historial completo.
+# "total" (cantidad de asistencias) solo viene en el historial completo.
+LISTAR_LIMITE = int(os.getenv("LISTAR_LIMITE", "200"))
+LISTAR_LIMITE_MAX = int(os.getenv("LISTAR_LIMITE_MAX", "1000"))
+# Sobre LISTAR_STREAM_MIN filas el historial completo se lee y se codifica
+# por lotes de LISTAR_LOTE (ver serializacion.py)
+LISTAR_STREAM_MIN = int(os.getenv("LISTAR_STREAM_MIN", "2000"))
+LISTAR_LOTE = int(os.getenv("LISTAR_LOTE", "2000"))
+
+_COLS_ASISTENCIA = [
+    "id","fecha","hora_entrada","hora_salida","geolocalizacion",
+    "trabajador_id","numero_asistencia","is_asistencia","justificado",
+    "procesado_ia","mensaje","categoria","fecha_inicio_inasistencia",
+    "fecha_fin_inasistencia","duracion_dias"
+]
+
+# Trabajador, última escritura de su historial desde `since` (una lectura
+# hacia atrás en asistencia_trabajador_txid_idx, no crece con el historial),
+# cuántas de sus asistencias se borraron (asistencia_borrados, lo mantienen
+# triggers) y el xmin del snapshot: toda transacción con id menor ya terminó,
+# así que es el cursor seguro para la próxima vez. Una transacción con id
+# >= xmin puede confirmar después de otra más nueva sin mover el máximo; por
+# eso también se cuentan y suman las marcas de esa ventana (pocas filas, del
+# mismo índice).
+_SQL_LISTAR_ESTADO = """
+    SELECT t.id,
+           (SELECT a.txid_cambio FROM asistencia a
+             WHERE a.trabajador_id = t.id AND a.txid_cambio >= %(since)s
+             ORDER BY a.txid_cambio DESC
+             LIMIT 1),
+           COALESCE((SELECT b.borrados FROM asistencia_borrados b WHERE b.trabajador_id = t.id), 0),
+           s.xmin, v.filas, v.suma
+      FROM trabajador t
+     CROSS JOIN (SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin) s
+     CROSS JOIN LATERAL (
+            SELECT COUNT(*) AS filas, SUM(a.txid_cambio) AS suma
+              FROM asistencia a
+             WHERE a.trabajador_id = t.id AND a.txid_cambio >= s.xmin
+           ) v
+     WHERE t.email = %(email)s
+     ORDER BY t.id
+     LIMIT 1
+"""
+
+# Solo para el historial completo, que de todos modos lee todas las filas
+_SQL_LISTAR_TOTAL = "SELECT COUNT(*) FROM asistencia WHERE trabajador_id = %s"
+
+_SQL_LISTAR_COMPLETO = """
+    SELECT """ + ", ".join(_COLS_ASISTENCIA) + """
+      FROM asistencia
+     WHERE trabajador_id = %s
+     ORDER BY fecha DESC, numero_asistencia DESC NULLS LAST, id DESC
+"""
+
+_SQL_LISTAR_CAMBIOS = """
+    SELECT """ + ", ".join(_COLS_ASISTENCIA) + """, txid_cambio
+      FROM asistencia
+     WHERE trabajador_id = %(trabajador_id)s
+       AND txid_cambio >= %(since)s
+       AND (txid_cambio, id) > (%(ultimo_txid)s, %(ultimo_id)s)
+     ORDER BY txid_cambio, id
+     LIMIT %(limite)s
+"""
+
+
+def _token(valores):
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip("=")
+
+
+def _leer_token(token):
+    """page = [since, cursor final, último txid, último id]."""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if isinstance(valores, list) and len(valores) == 4 and all(isinstance(v, int) for v in valores):
+            return valores
+    except (ValueError, TypeError):
+        pass
+    raise ValueError("Parámetro 'page' inválido.")
+
+
+def _entero(valor, nombre):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Parámetro '{nombre}' inválido.")
+
+
+def _etag_coincide(req, etag):
+    cabecera = req.headers.get("If-None-Match")
+    if not cabecera:
+        return False
+    etiquetas = [e.strip() for e in cabecera.split(",")]
+    return "*" in etiquetas or etag in etiquetas or ("W/" + etag) in etiquetas
+
+
 @app.function_name(name="asistencia_listar")
 @app.route(route="asistencia/listar", methods=["GET"])
+@instrumentacion.medido
 def listar_asistencia(req: func.HttpRequest) -> func.HttpResponse:
+    conn = None
     try:
         email = req.params.get("email")
         if not email:
@@ -279,11 +393,26 @@ def listar_asistencia(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json", status_code=400
             )
 
+        since, page, limit = req.params.get("since"), req.params.get("page"), req.params.get("limit")
+        incremental = any(v is not None for v in (since, page, limit))
+        try:
+            limite = min(max(_entero(limit, "limit"), 1), LISTAR_LIMITE_MAX) if limit is not None else LISTAR_LIMITE
+            if page is not None:
+                desde, cursor_final, ultimo_txid, ultimo_id = _leer_token(page)
+            else:
+                desde = _entero(since, "since") if since is not None else 0
+                cursor_final, ultimo_txid, ultimo_id = None, -1, 0
+        except ValueError as e:
+            return func.HttpResponse(
+                json.dumps({"message": str(e)}),
+                mimetype="application/json", status_code=400
+            )
+
         conn = get_conn()
         cur = conn.cursor()
 
-        # Trabajador por email
-        cur.execute("SELECT id FROM trabajador WHERE email=%s", (email,))
+        # Trabajador por email, con el estado de su historial
+        cur.execute(_SQL_LISTAR_ESTADO, {"email": email, "since": desde})
         trow = cur.fetchone()
         if not trow:
             cur.close(); conn.close()
@@ -291,46 +420,88 @@ def listar_asistencia(req: func.HttpRequest) -> func.HttpResponse:
                 json.dumps({"message":"Trabajador no encontrado para ese email","registros":[]}),
                 mimetype="application/json", status_code=404
             )
-        trabajador_id = trow[0]
-
-        # Lista de asistencias
-        cur.execute("""
-            SELECT
-                id, fecha, hora_entrada, hora_salida, geolocalizacion,
-                trabajador_id, numero_asistencia, is_asistencia, justificado,
-                procesado_ia, mensaje, categoria, fecha_inicio_inasistencia,
-                fecha_fin_inasistencia, duracion_dias
-            FROM asistencia
-            WHERE trabajador_id = %s
-            ORDER BY fecha DESC, numero_asistencia DESC NULLS LAST, id DESC
-        """, (trabajador_id,))
-        rows = cur.fetchall()
-        cols = [
-            "id","fecha","hora_entrada","hora_salida","geolocalizacion",
-            "trabajador_id","numero_asistencia","is_asistencia","justificado",
-            "procesado_ia","mensaje","categoria","fecha_inicio_inasistencia",
-            "fecha_fin_inasistencia","duracion_dias"
-        ]
-        registros = [serialize_row_with_cols(r, cols) for r in rows]
-
+        trabajador_id, ultimo_cambio, borrados, xmin, en_vuelo, suma_en_vuelo = trow
+
+        # Mismo historial y misma consulta → misma respuesta (salvo el cursor,
+        # y el cursor anterior sigue siendo válido). Si hay marcas desde xmin,
+        # aún pueden confirmar transacciones más antiguas que el máximo: la
+        # clave lleva esa ventana, que cambia con cada confirmación.
+        clave = f"{trabajador_id}:{ultimo_cambio}:{borrados}:{since}:{page}:{limit}"
+        if en_vuelo:
+            clave += f":{xmin}:{en_vuelo}:{suma_en_vuelo}"
+        etag = '"' + hashlib.sha1(clave.encode()).hexdigest()[:24] + '"'
+        cabeceras = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if _etag_coincide(req, etag):
+            cur.close(); conn.close()
+            return func.HttpResponse(status_code=304, headers=cabeceras)
+
+        if cursor_final is None:
+            cursor_final = xmin
+        body = {"message": "OK", "borrados": borrados}
+
+        if not incremental:
+            cur.execute(_SQL_LISTAR_TOTAL, (trabajador_id,))
+            total = cur.fetchone()[0]
+            body["total"] = total
+            body["cursor"] = str(cursor_final)
+            if total > LISTAR_STREAM_MIN:
+                # Historial largo: cursor del lado del servidor, así en memoria
+                # solo hay un lote de filas a la vez
+                cur.close()
+                cur = conn.cursor(name="listar_asistencia")
+            cur.execute(_SQL_LISTAR_COMPLETO, (trabajador_id,))
+            respuesta = serializacion.cuerpo_json(body, "registros", cur, tamano=LISTAR_LOTE)
+        else:
+            cur.execute(_SQL_LISTAR_CAMBIOS, {
+                "trabajador_id": trabajador_id, "since": desde,
+                "ultimo_txid": ultimo_txid, "ultimo_id": ultimo_id, "limite": limite + 1,
+            })
+            rows = cur.fetchall()
+            if len(rows) > limite:
+                rows = rows[:limite]
+                ultima = rows[-1]
+                body["siguiente"] = _token([desde, cursor_final, ultima[-1], ultima[0]])
+            else:
+                body["cursor"] = str(cursor_final)
+            # txid_cambio (última columna) no va en la respuesta
+            respuesta = serializacion.cuerpo_json(
+                body, "registros", cur, columnas=len(_COLS_ASISTENCIA), filas=rows)
         cur.close(); conn.close()
 
         return func.HttpResponse(
-            json.dumps({"message":"OK","registros":registros}, ensure_ascii=False),
-            mimetype="application/json", status_code=200
+            respuesta,
+            mimetype="application/json", status_code=200, headers=cabeceras
         )
     except Exception as e:
         return func.HttpResponse(
             json.dumps({"message": f"Error: {str(e)}"}),
             mimetype="application/json", status_code=500
         )
+    finally:
+        # Devuelve la conexión al pool (no hace nada si ya se devolvió)
+        if conn: conn.close()
 
 # =========================
 # /api/asistencia/ingreso
 # =========================
-@app.function_name(name="asistencia_marcar_ingreso")
-@app.route(route="asistencia/ingreso", methods=["POST"])
-def asistencia_marcar_ingreso(req: func.HttpRequest) -> func.HttpResponse:
+# Ingreso y salida se resuelven en una sola sentencia (ver marcaje.py).
+_RESPUESTAS_INGRESO = {
+    "actualizada":    (200, "Ingreso marcado"),
+    "creada":         (201, "Ingreso marcado (nuevo registro)"),
+    "con_entrada":    (409, "La asistencia de hoy ya tiene hora de entrada."),
+    "sin_trabajador": (404, "Trabajador no encontrado."),
+}
+
+_RESPUESTAS_SALIDA = {
+    "marcada":        (200, "Salida marcada"),
+    "sin_asistencia": (404, "No existe asistencia de hoy para marcar salida."),
+    "sin_entrada":    (409, "La asistencia de hoy no tiene hora de entrada."),
+    "con_salida":     (409, "La asistencia de hoy ya tiene hora de salida."),
+    "sin_trabajador": (404, "Trabajador no encontrado."),
+}
+
+
+def _marcar(req, sql, respuestas):
     conn = None
     try:
         data = req.get_json()
@@ -346,80 +517,20 @@ def asistencia_marcar_ingreso(req: func.HttpRequest) -> func.HttpResponse:
 
         # Fecha/hora en Chile
         now_cl = datetime.now(CHILE_TZ)
-        fecha_cl = now_cl.date()
-        hora_cl = now_cl.time()
+        params = marcaje.parametros(trabajador_id, email, rut, now_cl.date(), now_cl.time())
 
         conn = get_conn()
-        conn.autocommit = False
         cur = conn.cursor()
-
-        # Resolver trabajador
-        trabajador_id = resolve_trabajador_id(cur, trabajador_id, email, rut)
-        if not trabajador_id:
-            cur.close(); conn.close()
-            return func.HttpResponse(
-                json.dumps({"message": "Trabajador no encontrado."}),
-                mimetype="application/json", status_code=404
-            )
-
-        # Última asistencia con bloqueo
-        cur.execute("""
-            SELECT id, fecha, hora_entrada, hora_salida
-              FROM asistencia
-             WHERE trabajador_id = %s
-             ORDER BY fecha DESC NULLS LAST, id DESC
-             LIMIT 1
-             FOR UPDATE
-        """, (trabajador_id,))
-        last = cur.fetchone()
-
-        # Si existe y NO tiene entrada -> actualizar
-        if last:
-            a_id, a_fecha, a_hin, a_hout = last
-            if a_hin is None:
-                cur.execute("""
-                    UPDATE asistencia
-                       SET fecha = %s,
-                           hora_entrada = %s,
-                           is_asistencia = TRUE
-                     WHERE id = %s
-                 RETURNING id, fecha, hora_entrada, hora_salida, trabajador_id, is_asistencia
-                """, (fecha_cl, hora_cl, a_id))
-                updated = cur.fetchone()
-                conn.commit(); cur.close(); conn.close()
-                return func.HttpResponse(
-                    json.dumps({"message": "Ingreso marcado", "registro": serialize_registro_min(updated)}, ensure_ascii=False),
-                    mimetype="application/json", status_code=200
-                )
-            # ya tenía entrada y no tiene salida y es hoy → 409
-            if a_hout is None and a_fecha == fecha_cl:
-                conn.rollback(); cur.close(); conn.close()
-                return func.HttpResponse(
-                    json.dumps({"message": "La asistencia de hoy ya tiene hora de entrada."}),
-                    mimetype="application/json", status_code=409
-                )
-
-        # Crear nuevo registro para HOY
-        cur.execute("""
-            INSERT INTO asistencia (
-                fecha, hora_entrada, hora_salida, geolocalizacion,
-                trabajador_id, numero_asistencia, is_asistencia, justificado,
-                procesado_ia, mensaje, categoria, fecha_inicio_inasistencia,
-                fecha_fin_inasistencia, duracion_dias
-            )
-            VALUES (
-                %s, %s, NULL, NULL,
-                %s, NULL, TRUE, FALSE,
-                FALSE, NULL, NULL, NULL,
-                NULL, NULL
-            )
-            RETURNING id, fecha, hora_entrada, hora_salida, trabajador_id, is_asistencia
-        """, (fecha_cl, hora_cl, trabajador_id))
-        created = cur.fetchone()
+        resultado, registro = marcaje.marcar(cur, sql, params)
         conn.commit(); cur.close(); conn.close()
+
+        status, message = respuestas[resultado]
+        body = {"message": message}
+        if registro is not None:
+            body["registro"] = serialize_registro_min(registro)
         return func.HttpResponse(
-            json.dumps({"message": "Ingreso marcado (nuevo registro)", "registro": serialize_registro_min(created)}, ensure_ascii=False),
-            mimetype="application/json", status_code=201
+            json.dumps(body, ensure_ascii=False),
+            mimetype="application/json", status_code=status
         )
 
     except Exception as e:
@@ -431,103 +542,69 @@ def asistencia_marcar_ingreso(req: func.HttpRequest) -> func.HttpResponse:
             json.dumps({"message": f"Error: {str(e)}"}),
             mimetype="application/json", status_code=500
         )
+    finally:
+        # Devuelve la conexión al pool (no hace nada si ya se devolvió)
+        if conn: conn.close()
 
-def resolve_trabajador_id(cur, trabajador_id, email, rut):
-    if trabajador_id:
-        return int(trabajador_id)
-    if email:
-        cur.execute("SELECT id FROM trabajador WHERE email=%s LIMIT 1", (email,))
-    elif rut:
-        cur.execute("SELECT id FROM trabajador WHERE rut=%s LIMIT 1", (rut,))
-    else:
-        return None
-    r = cur.fetchone()
-    return r[0] if r else None
+
+@app.function_name(name="asistencia_marcar_ingreso")
+@app.route(route="asistencia/ingreso", methods=["POST"])
+@instrumentacion.medido
+def asistencia_marcar_ingreso(req: func.HttpRequest) -> func.HttpResponse:
+    return _marcar(req, marcaje.SQL_INGRESO, _RESPUESTAS_INGRESO)
 
 # =========================
 # /api/asistencia/salida
 # =========================
 @app.function_name(name="asistencia_marcar_salida")
 @app.route(route="asistencia/salida", methods=["POST"])
+@instrumentacion.medido
 def asistencia_marcar_salida(req: func.HttpRequest) -> func.HttpResponse:
+    return _marcar(req, marcaje.SQL_SALIDA, _RESPUESTAS_SALIDA)
+
+# =========================
+# /api/asistencia/sincronizar (lote de eventos hechos sin conexión)
+# =========================
+# Body: {"eventos": [{"id_evento": "...", "tipo": "ingreso"|"salida"|"mensaje",
+#                     "trabajador_id"|"email"|"rut": ..., "fecha_hora": "2025-03-10T08:02:11-03:00",
+#                     "mensaje": "..."}]}
+# Devuelve un resultado por evento (status/message/registro como los endpoints
+# individuales). Ver sincronizacion.py.
+@app.function_name(name="asistencia_sincronizar")
+@app.route(route="asistencia/sincronizar", methods=["POST"])
+@instrumentacion.medido
+def asistencia_sincronizar(req: func.HttpRequest) -> func.HttpResponse:
     conn = None
     try:
-        data = req.get_json()
-        trabajador_id = data.get("trabajador_id")
-        email = data.get("email")
-        rut = data.get("rut")
-
-        if not (trabajador_id or email or rut):
+        try:
+            data = req.get_json()
+        except ValueError:
+            data = None
+        eventos = data.get("eventos") if isinstance(data, dict) else None
+        if not isinstance(eventos, list) or not eventos:
             return func.HttpResponse(
-                json.dumps({"message": "Debes enviar 'trabajador_id' o 'email' o 'rut'."}),
+                json.dumps({"message": "Debes enviar 'eventos' (lista no vacía)."}),
                 mimetype="application/json", status_code=400
             )
-
-        # Fecha/hora en Chile
-        now_cl = datetime.now(CHILE_TZ)
-        fecha_cl = now_cl.date()
-        hora_cl = now_cl.time()
-
-        conn = get_conn()
-        conn.autocommit = False
-        cur = conn.cursor()
-
-        # Resolver trabajador
-        trabajador_id = resolve_trabajador_id(cur, trabajador_id, email, rut)
-        if not trabajador_id:
-            cur.close(); conn.close()
-            return func.HttpResponse(
-                json.dumps({"message": "Trabajador no encontrado."}),
-                mimetype="application/json", status_code=404
-            )
-
-        # Buscar asistencia de HOY con entrada y sin salida
-        cur.execute("""
-            SELECT id, fecha, hora_entrada, hora_salida
-              FROM asistencia
-             WHERE trabajador_id = %s
-               AND fecha = %s
-             ORDER BY id DESC
-             LIMIT 1
-             FOR UPDATE
-        """, (trabajador_id, fecha_cl))
-        row = cur.fetchone()
-
-        if not row:
-            conn.rollback(); cur.close(); conn.close()
+        if len(eventos) > sincronizacion.SINCRONIZAR_MAX_EVENTOS:
             return func.HttpResponse(
-                json.dumps({"message": "No existe asistencia de hoy para marcar salida."}),
-                mimetype="application/json", status_code=404
+                json.dumps({"message": f"Máximo {sincronizacion.SINCRONIZAR_MAX_EVENTOS} eventos por lote."}),
+                mimetype="application/json", status_code=413
             )
 
-        a_id, a_fecha, a_hin, a_hout = row
-
-        if a_hin is None:
-            conn.rollback(); cur.close(); conn.close()
-            return func.HttpResponse(
-                json.dumps({"message": "La asistencia de hoy no tiene hora de entrada."}),
-                mimetype="application/json", status_code=409
-            )
-
-        if a_hout is not None:
-            conn.rollback(); cur.close(); conn.close()
-            return func.HttpResponse(
-                json.dumps({"message": "La asistencia de hoy ya tiene hora de salida."}),
-                mimetype="application/json", status_code=409
-            )
-
-        # Marcar salida
-        cur.execute("""
-            UPDATE asistencia
-               SET hora_salida = %s,
-                   is_asistencia = TRUE
-             WHERE id = %s
-         RETURNING id, fecha, hora_entrada, hora_salida, trabajador_id, is_asistencia
-        """, (hora_cl, a_id))
-        updated = cur.fetchone()
+        conn = get_conn()
+        cur = conn.cursor()
+        resultados = sincronizacion.sincronizar(cur, eventos, datetime.now(CHILE_TZ))
         conn.commit(); cur.close(); conn.close()
+
+        resumen = {}
+        for r in resultados:
+            resumen[str(r["status"])] = resumen.get(str(r["status"]), 0) + 1
+            if "registro" in r:
+                valores, cols = r["registro"]
+                r["registro"] = serialize_row_with_cols(valores, cols)
         return func.HttpResponse(
-            json.dumps({"message": "Salida marcada", "registro": serialize_registro_min(updated)}, ensure_ascii=False),
+            json.dumps({"message": "OK", "resumen": resumen, "resultados": resultados}, ensure_ascii=False),
             mimetype="application/json", status_code=200
         )
 
@@ -540,3 +617,30 @@ def asistencia_marcar_salida(req: func.HttpRequest) -> func.HttpResponse:
             json.dumps({"message": f"Error: {str(e)}"}),
             mimetype="application/json", status_code=500
         )
+    finally:
+        # Devuelve la conexión al pool (no hace nada si ya se devolvió)
+        if conn: conn.close()
+
+# =========================
+# /api/salud/pool (métricas del pool de conexiones de esta instancia)
+# =========================
+@app.function_name(name="salud_pool")
+@app.route(route="salud/pool", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+def salud_pool(req: func.HttpRequest) -> func.HttpResponse:
+    return func.HttpResponse(
+        json.dumps({"pool": pool_estadisticas()}),
+        mimetype="application/json", status_code=200
+    )
+
+# =========================
+# /api/salud/metricas (SQL por función, formato Prometheus)
+# =========================
+# Latencia, sentencias por invocación y repeticiones de una misma sentencia
+# (N+1) por función de esta instancia; ver instrumentacion.py.
+@app.function_name(name="salud_metricas")
+@app.route(route="salud/metricas", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+def salud_metricas(req: func.HttpRequest) -> func.HttpResponse:
+    return func.HttpResponse(
+        "\n".join(instrumentacion.prometheus()) + "\n",
+        mimetype="text/plain; version=0.0.4", status_code=200
+    )
@@ -0,0 +1,186 @@
+"""
+Marcaje de ingreso y salida en una sola sentencia.
+
+Cada marcaje es un único statement (CTE con UPDATE/INSERT) que resuelve al
+trabajador, bloquea su última asistencia, aplica las reglas y devuelve la
+fila: una ida y vuelta al servidor en vez de cuatro, y el bloqueo de fila
+dura solo lo que tarda la sentencia.
+
+Reglas (las mismas de siempre):
+  ingreso: si la última asistencia no tiene entrada, se completa (200);
+           si tiene entrada sin salida y es de hoy, 409;
+           en otro caso se crea una asistencia nueva para hoy (201).
+  salida:  se busca la asistencia de hoy (la más reciente); si no hay, 404;
+           sin entrada o con salida ya marcada, 409; si no, se marca (200).
+  En ambos casos, trabajador no encontrado por email/rut → 404.
+
+El campo `resultado` de la fila devuelta indica qué pasó.
+"""
+import threading
+import weakref
+
+# Igual que antes: trabajador_id se usa tal cual; si no, email y luego rut
+# (el rut solo cuando no vino email). Cada búsqueda es una igualdad simple
+# para que también el plan genérico de la sentencia preparada use los
+# índices de email y rut.
+_CTE_TRABAJADOR = """
+    trab AS (
+        SELECT COALESCE(
+                   %(trabajador_id)s::int,
+                   (SELECT id FROM trabajador WHERE email = %(email)s::text LIMIT 1),
+                   (SELECT id FROM trabajador WHERE rut = %(rut)s::text AND %(email)s::text IS NULL LIMIT 1)
+               ) AS id
+    )
+"""
+
+_COLUMNAS = "id, fecha, hora_entrada, hora_salida, trabajador_id, is_asistencia"
+
+SQL_INGRESO = """
+    WITH """ + _CTE_TRABAJADOR + """,
+    ultima AS (
+        SELECT a.id, a.fecha, a.hora_entrada, a.hora_salida
+          FROM asistencia a
+         WHERE a.trabajador_id = (SELECT id FROM trab)
+         ORDER BY a.fecha DESC NULLS LAST, a.id DESC
+         LIMIT 1
+           FOR UPDATE
+    ),
+    actualizada AS (
+        UPDATE asistencia a
+           SET fecha = %(fecha)s,
+               hora_entrada = %(hora)s,
+               is_asistencia = TRUE
+          FROM ultima u
+         WHERE a.id = u.id
+           AND u.hora_entrada IS NULL
+     RETURNING a.id, a.fecha, a.hora_entrada, a.hora_salida, a.trabajador_id, a.is_asistencia
+    ),
+    creada AS (
+        INSERT INTO asistencia (
+            fecha, hora_entrada, hora_salida, geolocalizacion,
+            trabajador_id, numero_asistencia, is_asistencia, justificado,
+            procesado_ia, mensaje, categoria, fecha_inicio_inasistencia,
+            fecha_fin_inasistencia, duracion_dias
+        )
+        SELECT %(fecha)s, %(hora)s, NULL, NULL,
+               t.id, NULL, TRUE, FALSE,
+               FALSE, NULL, NULL, NULL,
+               NULL, NULL
+          FROM trab t
+         WHERE t.id IS NOT NULL
+           AND NOT EXISTS (
+                SELECT 1 FROM ultima u
+                 WHERE u.hora_entrada IS NULL
+                    OR (u.hora_salida IS NULL AND u.fecha = %(fecha)s)
+               )
+        RETURNING """ + _COLUMNAS + """
+    ),
+    registro AS (
+        SELECT 'actualizada' AS origen, * FROM actualizada
+        UNION ALL
+        SELECT 'creada', * FROM creada
+    )
+    SELECT CASE WHEN t.id IS NULL THEN 'sin_trabajador'
+                ELSE COALESCE(r.origen, 'con_entrada') END AS resultado,
+           r.id, r.fecha, r.hora_entrada, r.hora_salida, r.trabajador_id, r.is_asistencia
+      FROM trab t
+      LEFT JOIN registro r ON TRUE
+"""
+
+SQL_SALIDA = """
+    WITH """ + _CTE_TRABAJADOR + """,
+    hoy AS (
+        SELECT a.id, a.hora_entrada, a.hora_salida
+          FROM asistencia a
+         WHERE a.trabajador_id = (SELECT id FROM trab)
+           AND a.fecha = %(fecha)s
+         ORDER BY a.id DESC
+         LIMIT 1
+           FOR UPDATE
+    ),
+    marcada AS (
+        UPDATE asistencia a
+           SET hora_salida = %(hora)s,
+               is_asistencia = TRUE
+          FROM hoy h
+         WHERE a.id = h.id
+           AND h.hora_entrada IS NOT NULL
+           AND h.hora_salida IS NULL
+     RETURNING a.id, a.fecha, a.hora_entrada, a.hora_salida, a.trabajador_id, a.is_asistencia
+    )
+    SELECT CASE WHEN t.id IS NULL           THEN 'sin_trabajador'
+                WHEN h.id IS NULL           THEN 'sin_asistencia'
+                WHEN h.hora_entrada IS NULL THEN 'sin_entrada'
+                WHEN m.id IS NULL           THEN 'con_salida'
+                ELSE 'marcada' END AS resultado,
+           m.id, m.fecha, m.hora_entrada, m.hora_salida, m.trabajador_id, m.is_asistencia
+      FROM trab t
+      LEFT JOIN hoy h     ON TRUE
+      LEFT JOIN marcada m ON TRUE
+"""
+
+
+# Con el pool (conexiones.py) las conexiones sobreviven entre invocaciones, así
+# que cada sentencia se prepara una vez por conexión y después solo se ejecuta:
+# el plan de la CTE cuesta más que ejecutarla.
+_ORDEN_PARAMETROS = ("trabajador_id", "email", "rut", "fecha", "hora")
+_TIPOS = "int, text, text, date, time"
+_PREPARADAS = {}                 # sql -> nombre de la sentencia preparada
+_preparadas_en = {}              # nombre -> conexiones que ya la tienen
+_lock = threading.Lock()
+
+
+def _preparar(sql, nombre):
+    posicional = sql
+    for i, campo in enumerate(_ORDEN_PARAMETROS, start=1):
+        posicional = posicional.replace("%%(%s)s" % campo, "$%d" % i)
+    return "PREPARE %s (%s) AS %s" % (nombre, _TIPOS, posicional)
+
+
+def parametros(trabajador_id, email, rut, fecha, hora):
+    """Normaliza la identificación como lo hacía resolve_trabajador_id."""
+    return {
+        "trabajador_id": int(trabajador_id) if trabajador_id else None,
+        "email": email or None,
+        "rut": rut or None,
+        "fecha": fecha,
+        "hora": hora,
+    }
+
+
+def plan_generico(cur, sql, params):
+    """
+    EXPLAIN (FORMAT JSON) del plan genérico de SQL_INGRESO o SQL_SALIDA: el
+    que termina usando la sentencia preparada, sin ver los valores.
+    """
+    cur.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+    cur.execute(_preparar(sql, "marcaje_plan_generico"))
+    try:
+        cur.execute("EXPLAIN (FORMAT JSON) EXECUTE marcaje_plan_generico (%s, %s, %s, %s, %s)",
+                    [params[campo] for campo in _ORDEN_PARAMETROS])
+        return cur.fetchone()[0][0]["Plan"]
+    finally:
+        cur.execute("DEALLOCATE marcaje_plan_generico")
+        cur.execute("RESET plan_cache_mode")
+
+
+def marcar(cur, sql, params):
+    """Ejecuta SQL_INGRESO o SQL_SALIDA. Devuelve (resultado, fila de 6 columnas o None)."""
+    nombre = _PREPARADAS[sql]
+    conn = cur.connection
+    with _lock:
+        preparada = conn in _preparadas_en[nombre]
+    if not preparada:
+        cur.execute(_preparar(sql, nombre))
+        with _lock:
+            _preparadas_en[nombre].add(conn)
+    cur.execute("EXECUTE %s (%%s, %%s, %%s, %%s, %%s)" % nombre,
+                [params[campo] for campo in _ORDEN_PARAMETROS])
+    fila = cur.fetchone()
+    resultado, registro = fila[0], fila[1:]
+    return resultado, (registro if registro[0] is not None else None)
+
+
+for _nombre, _sql in (("marcaje_ingreso", SQL_INGRESO), ("marcaje_salida", SQL_SALIDA)):
+    _PREPARADAS[_sql] = _nombre
+    _preparadas_en[_nombre] = weakref.WeakSet()
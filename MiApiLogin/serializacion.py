@@ -0,0 +1,132 @@
+"""
+Serialización de filas a JSON para las respuestas de MiApiLogin.
+
+serialize_row_with_cols (function_app.py) decide el formato de cada columna
+por su nombre en cada fila: con historiales largos eso cuesta más que la
+consulta. Aquí el formato se resuelve una vez por consulta a partir de
+cursor.description (tipo de cada columna): el plan sabe de antemano qué
+columnas formatear y con qué función. Solo se tocan las columnas de fecha y
+hora; el resto pasa tal cual, igual que antes.
+
+Para resultados grandes, cuerpo_json codifica las filas por lotes a medida que
+llegan del cursor y las va agregando al buffer de la respuesta, sin armar
+antes la lista completa de dicts ni el string JSON entero.
+
+El formato es el de siempre: fechas "YYYY-MM-DD", horas "HH:MM:SS" y
+timestamps "YYYY-MM-DD HH:MM:SS".
+"""
+import json
+import threading
+from datetime import date, time
+
+# OIDs de Postgres (pg_type) con formato propio
+_DATE, _TIME, _TIMESTAMP, _TIMESTAMPTZ = 1082, 1083, 1114, 1184
+
+
+def _fmt_fecha(v):
+    return date.isoformat(v)
+
+
+def _fmt_hora(v):
+    # isoformat es varias veces más rápido que strftime
+    return time.isoformat(v, "seconds")
+
+
+def _fmt_fecha_hora(v):
+    return v.strftime("%Y-%m-%d %H:%M:%S")
+
+
+FORMATOS = {
+    _DATE: _fmt_fecha,
+    _TIME: _fmt_hora,
+    _TIMESTAMP: _fmt_fecha_hora,
+    _TIMESTAMPTZ: _fmt_fecha_hora,
+}
+
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+_planes = {}
+_lock = threading.Lock()
+
+
+class Plan:
+    """
+    Plan de serialización de una consulta: `columnas` (nombres) y `fila(row)`,
+    que devuelve el dict de la fila ya formateado.
+    """
+    __slots__ = ("columnas", "fila")
+
+    def __init__(self, columnas, tipos):
+        self.columnas = tuple(columnas)
+        # dict(zip(...)) arma la fila en C (zip corta las columnas extra) y
+        # después se formatean solo las columnas de fecha y hora
+        convertir = tuple((nombre, i, FORMATOS[tipo])
+                          for i, (nombre, tipo) in enumerate(zip(self.columnas, tipos))
+                          if tipo in FORMATOS)
+        nombres = self.columnas
+
+        def fila(r):
+            d = dict(zip(nombres, r))
+            for nombre, i, formato in convertir:
+                v = r[i]
+                if v is not None:
+                    d[nombre] = formato(v)
+            return d
+
+        self.fila = fila
+
+    def filas(self, rows):
+        fila = self.fila
+        return [fila(r) for r in rows]
+
+
+def plan(description, columnas=None):
+    """
+    Plan para las filas de un cursor (se cachea por nombres y tipos de
+    columna). Con `columnas` se serializan solo las primeras N; sirve para
+    consultas que traen columnas extra de uso interno al final.
+    """
+    if columnas is not None:
+        description = description[:columnas]
+    clave = tuple((d[0], d[1]) for d in description)
+    encontrado = _planes.get(clave)
+    if encontrado is None:
+        encontrado = Plan([d[0] for d in description], [d[1] for d in description])
+        with _lock:
+            _planes[clave] = encontrado
+    return encontrado
+
+
+def lotes(cur, tamano=2000):
+    """Recorre el resultado de `cur` en listas de hasta `tamano` filas."""
+    while True:
+        filas = cur.fetchmany(tamano)
+        if not filas:
+            return
+        yield filas
+
+
+def cuerpo_json(encabezado, clave, cur, columnas=None, filas=None, tamano=2000):
+    """
+    Devuelve como bytearray (HttpResponse lo acepta tal cual) el equivalente
+    de json.dumps({**encabezado, clave: [filas...]}, ensure_ascii=False).
+
+    Las filas se leen de `cur` por lotes de `tamano`, o se toman de `filas` si
+    ya se leyeron. El plan se arma después del primer fetch porque en los
+    cursores del lado del servidor description recién existe entonces.
+    """
+    buf = bytearray(_encoder.encode(encabezado)[:-1].encode("utf-8"))
+    if encabezado:
+        buf += b", "
+    buf += _encoder.encode(clave).encode("utf-8") + b": ["
+    plan_filas = None
+    for lote in (lotes(cur, tamano) if filas is None else [filas] if filas else []):
+        if plan_filas is None:
+            plan_filas = plan(cur.description, columnas)
+        else:
+            buf += b", "
+        # Un encode por lote: el encoder en C hace el trabajo y solo se
+        # quitan los corchetes de la lista
+        buf += _encoder.encode(plan_filas.filas(lote))[1:-1].encode("utf-8")
+    buf += b"]}"
+    return buf
@@ -0,0 +1,370 @@
+"""
+Sincronización en lote de marcajes hechos sin conexión.
+
+El dispositivo envía los eventos que acumuló (ingreso, salida o mensaje), cada
+uno con la hora en que ocurrió. Se validan todos juntos, los trabajadores se
+resuelven en una sola consulta y las asistencias involucradas se leen y
+bloquean en otra. Los eventos se aplican en orden cronológico, con las mismas
+reglas que /asistencia/ingreso, /asistencia/salida y /asistencia/mensaje,
+pero con la fecha y hora del evento en vez de la del servidor. Al final las
+filas resultantes se escriben con un INSERT y pocos UPDATE sobre arrays
+(unnest), todo en una transacción. Los arrays se convierten a los tipos reales
+de las columnas de asistencia (se leen del catálogo una vez por proceso) y el
+id de las filas nuevas lo pone la tabla.
+
+Reintentos: un evento idéntico a lo que ya está guardado (misma hora de
+entrada o de salida, mismo mensaje) se informa como "duplicado" sin volver a
+escribirse, así el dispositivo puede reenviar el lote completo si no recibió
+la respuesta.
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytz
+
+CHILE_TZ = pytz.timezone("America/Santiago")
+
+SINCRONIZAR_MAX_EVENTOS = int(os.getenv("SINCRONIZAR_MAX_EVENTOS", "2000"))
+SINCRONIZAR_MAX_DIAS = int(os.getenv("SINCRONIZAR_MAX_DIAS", "31"))
+TOLERANCIA_FUTURO = timedelta(minutes=5)   # relojes de dispositivos adelantados
+
+TIPOS = ("ingreso", "salida", "mensaje")
+
+COLUMNAS = [
+    "id", "fecha", "hora_entrada", "hora_salida", "geolocalizacion",
+    "trabajador_id", "numero_asistencia", "is_asistencia", "justificado",
+    "procesado_ia", "mensaje", "categoria", "fecha_inicio_inasistencia",
+    "fecha_fin_inasistencia", "duracion_dias",
+]
+COLUMNAS_MIN = ["id", "fecha", "hora_entrada", "hora_salida", "trabajador_id", "is_asistencia"]
+
+SQL_TRABAJADORES = """
+    SELECT id, email, rut FROM trabajador
+     WHERE id = ANY(%(ids)s::int[]) OR email = ANY(%(emails)s::text[]) OR rut = ANY(%(ruts)s::text[])
+     ORDER BY id
+"""
+
+# Filas que las reglas pueden consultar: la última de cada trabajador (en los
+# dos órdenes que usan ingreso y mensaje) y todas desde la fecha del evento
+# más antiguo (salida busca la del día; un ingreso puede mover la fecha).
+SQL_ASISTENCIAS = """
+    SELECT """ + ", ".join("a." + c for c in COLUMNAS) + """
+      FROM asistencia a
+     WHERE a.id IN (
+            SELECT id FROM asistencia
+             WHERE trabajador_id = ANY(%(ids)s::int[]) AND fecha >= %(desde)s
+            UNION
+            SELECT u.id
+              FROM unnest(%(ids)s::int[]) t(id)
+              CROSS JOIN LATERAL (
+                    SELECT id FROM asistencia
+                     WHERE trabajador_id = t.id
+                     ORDER BY fecha DESC NULLS LAST, id DESC
+                     LIMIT 1) u
+            UNION
+            SELECT m.id
+              FROM unnest(%(ids)s::int[]) t(id)
+              CROSS JOIN LATERAL (
+                    SELECT id FROM asistencia
+                     WHERE trabajador_id = t.id
+                     ORDER BY fecha DESC NULLS LAST, hora_entrada DESC NULLS LAST, id DESC
+                     LIMIT 1) m
+           )
+     ORDER BY a.id
+       FOR UPDATE
+"""
+
+SQL_TIPOS = """
+    SELECT attname, format_type(atttypid, atttypmod)
+      FROM pg_attribute
+     WHERE attrelid = 'asistencia'::regclass AND attnum > 0 AND NOT attisdropped
+"""
+
+_tipos = {}   # columna -> tipo en asistencia, p. ej. "time without time zone"
+
+
+def tipos_columnas(cur):
+    """Tipos de las columnas de asistencia; se consultan una vez por proceso."""
+    if not _tipos:
+        cur.execute(SQL_TIPOS)
+        _tipos.update(cur.fetchall())
+    return _tipos
+
+
+def _unnest(columnas, tipos):
+    return "unnest(" + ", ".join("%%(%s)s::%s[]" % (c, tipos[c]) for c in columnas) + ")"
+
+
+def sql_insertar(tipos):
+    # Sin id: lo asigna la tabla (serial o identity). Las filas entran en el
+    # orden del lote, así que los ids devueltos, de menor a mayor, corresponden
+    # a las filas en ese orden.
+    columnas = ", ".join(COLUMNAS[1:])
+    return (
+        "INSERT INTO asistencia (" + columnas + ")\n"
+        "SELECT " + columnas + "\n"
+        "  FROM " + _unnest(COLUMNAS[1:], tipos) + " WITH ORDINALITY AS u(" + columnas + ", orden)\n"
+        " ORDER BY orden\n"
+        "RETURNING id"
+    )
+
+
+def sql_actualizar(columnas, tipos):
+    """UPDATE de las filas que cambiaron exactamente `columnas`."""
+    return (
+        "UPDATE asistencia a SET " + ", ".join("%s = u.%s" % (c, c) for c in columnas) + "\n"
+        "  FROM " + _unnest(["id"] + list(columnas), tipos) + " AS u(id, " + ", ".join(columnas) + ")\n"
+        " WHERE a.id = u.id"
+    )
+
+
+class EventoInvalido(ValueError):
+    pass
+
+
+def _fecha_hora(valor, ahora):
+    """ISO 8601; sin zona horaria se interpreta como hora de Chile."""
+    if not isinstance(valor, str):
+        raise EventoInvalido("Falta 'fecha_hora' (ISO 8601).")
+    try:
+        momento = datetime.fromisoformat(valor.strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise EventoInvalido("'fecha_hora' no es una fecha ISO 8601 válida.")
+    if momento.tzinfo is None:
+        momento = CHILE_TZ.localize(momento)
+    momento = momento.astimezone(CHILE_TZ)
+    if momento > ahora + TOLERANCIA_FUTURO:
+        raise EventoInvalido("'fecha_hora' está en el futuro.")
+    if momento < ahora - timedelta(days=SINCRONIZAR_MAX_DIAS):
+        raise EventoInvalido(f"'fecha_hora' tiene más de {SINCRONIZAR_MAX_DIAS} días.")
+    return momento
+
+
+def validar(eventos, ahora):
+    """
+    Devuelve (válidos, resultados): los eventos normalizados y un resultado por
+    evento (los inválidos ya quedan con status 400).
+    """
+    validos, resultados = [], []
+    for indice, ev in enumerate(eventos):
+        resultado = {"indice": indice}
+        resultados.append(resultado)
+        try:
+            if not isinstance(ev, dict):
+                raise EventoInvalido("El evento debe ser un objeto.")
+            if "id_evento" in ev:
+                resultado["id_evento"] = ev["id_evento"]
+            tipo = ev.get("tipo")
+            if tipo not in TIPOS:
+                raise EventoInvalido("'tipo' debe ser ingreso, salida o mensaje.")
+            resultado["tipo"] = tipo
+            try:
+                trabajador_id = int(ev["trabajador_id"]) if ev.get("trabajador_id") else None
+            except (TypeError, ValueError):
+                raise EventoInvalido("'trabajador_id' no es un número.")
+            email, rut = ev.get("email") or None, ev.get("rut") or None
+            if not (trabajador_id or email or rut):
+                raise EventoInvalido("Debes enviar 'trabajador_id' o 'email' o 'rut'.")
+            mensaje = (ev.get("mensaje") or "").strip() if tipo == "mensaje" else None
+            if tipo == "mensaje" and not mensaje:
+                raise EventoInvalido("Falta 'mensaje'")
+            momento = _fecha_hora(ev.get("fecha_hora"), ahora)
+        except EventoInvalido as e:
+            resultado.update(status=400, message=str(e))
+            continue
+        validos.append({
+            "indice": indice, "tipo": tipo, "momento": momento,
+            "fecha": momento.date(), "hora": momento.time().replace(tzinfo=None),
+            "trabajador_id": trabajador_id, "email": email, "rut": rut, "mensaje": mensaje,
+        })
+    return validos, resultados
+
+
+def resolver_trabajadores(cur, eventos):
+    """Una consulta para todos: asigna ev['trabajador'] (None si no existe)."""
+    cur.execute(SQL_TRABAJADORES, {
+        "ids": sorted({e["trabajador_id"] for e in eventos if e["trabajador_id"]}),
+        "emails": sorted({e["email"] for e in eventos if not e["trabajador_id"] and e["email"]}),
+        "ruts": sorted({e["rut"] for e in eventos if not (e["trabajador_id"] or e["email"]) and e["rut"]}),
+    })
+    por_id, por_email, por_rut = set(), {}, {}
+    for tid, email, rut in cur.fetchall():
+        por_id.add(tid)
+        por_email.setdefault(email, tid)
+        por_rut.setdefault(rut, tid)
+    for e in eventos:
+        # Misma prioridad que los endpoints individuales: id, luego email, luego rut.
+        # Un id inexistente da 404 (una violación de FK abortaría todo el lote).
+        if e["trabajador_id"]:
+            e["trabajador"] = e["trabajador_id"] if e["trabajador_id"] in por_id else None
+        elif e["email"]:
+            e["trabajador"] = por_email.get(e["email"])
+        else:
+            e["trabajador"] = por_rut.get(e["rut"])
+
+
+# ---- Reglas sobre las filas en memoria ----
+
+def _ultima(filas):
+    # ORDER BY fecha DESC NULLS LAST, id DESC
+    return max(filas, key=lambda f: (f["fecha"] is not None, f["fecha"] or datetime.min.date(), f["id"]),
+               default=None)
+
+
+def _ultima_mensaje(filas):
+    # ORDER BY fecha DESC NULLS LAST, hora_entrada DESC NULLS LAST, id DESC
+    return max(filas, key=lambda f: (f["fecha"] is not None, f["fecha"] or datetime.min.date(),
+                                     f["hora_entrada"] is not None, f["hora_entrada"] or datetime.min.time(),
+                                     f["id"]), default=None)
+
+
+def _del_dia(filas, fecha):
+    return max((f for f in filas if f["fecha"] == fecha), key=lambda f: f["id"], default=None)
+
+
+_PROVISORIO = 1 << 62   # ids provisorios: mayores que cualquier id real
+
+
+class Lote:
+    """Estado en memoria de las asistencias de los trabajadores del lote."""
+
+    def __init__(self, filas):
+        self.filas = {}       # trabajador_id -> [fila]
+        self.nuevas = []
+        self.tocadas = {}     # id -> (fila existente modificada, columnas cambiadas)
+        for fila in filas:
+            self.filas.setdefault(fila["trabajador_id"], []).append(fila)
+        self._provisorio = 0
+
+    def _nueva(self, trabajador_id, **valores):
+        # Como la fila insertada tendrá un id mayor que las existentes, el
+        # provisorio también lo es (importa para "la última asistencia")
+        self._provisorio += 1
+        fila = dict.fromkeys(COLUMNAS)
+        fila.update(valores, id=_PROVISORIO + self._provisorio, trabajador_id=trabajador_id, procesado_ia=False)
+        self.filas.setdefault(trabajador_id, []).append(fila)
+        self.nuevas.append(fila)
+        return fila
+
+    def _tocar(self, fila, **valores):
+        cambiadas = {c for c, v in valores.items() if fila[c] != v}
+        fila.update(valores)
+        if fila["id"] < _PROVISORIO and cambiadas:
+            self.tocadas.setdefault(fila["id"], (fila, set()))[1].update(cambiadas)
+
+    def ingreso(self, tid, fecha, hora):
+        filas = self.filas.get(tid, [])
+        last = _ultima(filas)
+        if last and last["hora_entrada"] is None:
+            self._tocar(last, fecha=fecha, hora_entrada=hora, is_asistencia=True)
+            return 200, "Ingreso marcado", last
+        if last and last["hora_salida"] is None and last["fecha"] == fecha:
+            if last["hora_entrada"] == hora:
+                return 200, "duplicado", last
+            return 409, "La asistencia de hoy ya tiene hora de entrada.", None
+        previa = next((f for f in filas if f["fecha"] == fecha and f["hora_entrada"] == hora), None)
+        if previa:
+            return 200, "duplicado", previa
+        fila = self._nueva(tid, fecha=fecha, hora_entrada=hora, is_asistencia=True, justificado=False)
+        return 201, "Ingreso marcado (nuevo registro)", fila
+
+    def salida(self, tid, fecha, hora):
+        fila = _del_dia(self.filas.get(tid, []), fecha)
+        if not fila:
+            return 404, "No existe asistencia de hoy para marcar salida.", None
+        if fila["hora_entrada"] is None:
+            return 409, "La asistencia de hoy no tiene hora de entrada.", None
+        if fila["hora_salida"] is not None:
+            if fila["hora_salida"] == hora:
+                return 200, "duplicado", fila
+            return 409, "La asistencia de hoy ya tiene hora de salida.", None
+        # Solo posible con horas del dispositivo: una salida previa a la entrada
+        if hora < fila["hora_entrada"]:
+            return 409, "La hora de salida es anterior a la de entrada.", None
+        self._tocar(fila, hora_salida=hora, is_asistencia=True)
+        return 200, "Salida marcada", fila
+
+    def mensaje(self, tid, fecha, mensaje):
+        last = _ultima_mensaje(self.filas.get(tid, []))
+        if last:
+            if last["mensaje"] == mensaje:
+                return 200, "duplicado", last
+            self._tocar(last, mensaje=mensaje, procesado_ia=False, categoria=None, justificado=True,
+                        fecha_inicio_inasistencia=None, fecha_fin_inasistencia=None, duracion_dias=None)
+            return 200, "Mensaje actualizado en la última asistencia", last
+        fila = self._nueva(tid, fecha=fecha, is_asistencia=False, justificado=True, mensaje=mensaje)
+        return 201, "No existía asistencia previa: se creó registro y se guardó el mensaje", fila
+
+
+def _columnas(filas, columnas=COLUMNAS):
+    return {c: [f[c] for f in filas] for c in columnas}
+
+
+def _por_columnas(tocadas):
+    """Agrupa las filas modificadas según qué columnas cambiaron (en orden de COLUMNAS)."""
+    grupos = {}
+    for fila, cambiadas in tocadas.values():
+        columnas = tuple(c for c in COLUMNAS if c in cambiadas)
+        grupos.setdefault(columnas, []).append(fila)
+    return grupos
+
+
+def sincronizar(cur, eventos, ahora):
+    """
+    Aplica el lote dentro de la transacción de `cur` (el llamador hace commit).
+    Devuelve la lista de resultados, uno por evento y en el orden recibido.
+    """
+    validos, resultados = validar(eventos, ahora)
+    if validos:
+        resolver_trabajadores(cur, validos)
+    aplicables = [e for e in validos if e["trabajador"] is not None]
+    for e in validos:
+        if e["trabajador"] is None:
+            resultados[e["indice"]].update(status=404, message="Trabajador no encontrado.")
+    if not aplicables:
+        return resultados
+
+    cur.execute(SQL_ASISTENCIAS, {
+        "ids": sorted({e["trabajador"] for e in aplicables}),
+        "desde": min(e["fecha"] for e in aplicables),
+    })
+    lote = Lote(dict(zip(COLUMNAS, fila)) for fila in cur.fetchall())
+
+    # Orden cronológico; a igual hora, el orden en que llegaron
+    for e in sorted(aplicables, key=lambda e: (e["momento"], e["indice"])):
+        if e["tipo"] == "ingreso":
+            status, message, fila = lote.ingreso(e["trabajador"], e["fecha"], e["hora"])
+        elif e["tipo"] == "salida":
+            status, message, fila = lote.salida(e["trabajador"], e["fecha"], e["hora"])
+        else:
+            status, message, fila = lote.mensaje(e["trabajador"], e["fecha"], e["mensaje"])
+        resultado = resultados[e["indice"]]
+        resultado.update(status=status, message=message)
+        if message == "duplicado":
+            resultado.update(message="Evento ya registrado.", duplicado=True)
+        if fila is not None:
+            # Copia: el registro como quedó tras este evento, no al final del lote
+            resultado["_registro"] = dict(fila)
+
+    if lote.nuevas or lote.tocadas:
+        tipos = tipos_columnas(cur)
+    if lote.nuevas:
+        cur.execute(sql_insertar(tipos), _columnas(lote.nuevas, COLUMNAS[1:]))
+        reales = {}
+        for fila, nuevo_id in zip(lote.nuevas, sorted(r[0] for r in cur.fetchall())):
+            reales[fila["id"]] = nuevo_id
+            fila["id"] = nuevo_id
+        for r in resultados:
+            if "_registro" in r:
+                r["_registro"]["id"] = reales.get(r["_registro"]["id"], r["_registro"]["id"])
+    # Un UPDATE por combinación de columnas cambiadas (ingreso, salida y
+    # mensaje tocan columnas distintas): no se reescribe lo que no cambió
+    for columnas, filas in _por_columnas(lote.tocadas).items():
+        cur.execute(sql_actualizar(columnas, tipos), _columnas(filas, ("id",) + columnas))
+
+    for r in resultados:
+        registro = r.pop("_registro", None)
+        if registro is not None:
+            cols = COLUMNAS if r["tipo"] == "mensaje" else COLUMNAS_MIN
+            r["registro"] = ([registro[c] for c in cols], cols)
+    return resultados
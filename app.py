@@ -2,6 +2,8 @@
 import os
 from dotenv import load_dotenv
 from flask import Flask, redirect, render_template, url_for
+import db
+from precarga import iniciar_precarga
 
 load_dotenv()
 
@@ -15,11 +17,15 @@ from routes.turno_trabajador import turno_trabajador_bp
 from routes.reportes import reportes_bp 
 from routes.sueldos import sueldos_bp
 from routes.login import login_bp
+from routes.metricas import metricas_bp
 
 app = Flask(__name__)
 
 app.secret_key = os.getenv("SECRET_KEY", "clave_por_defecto_para_dev")
 
+# pool de conexiones: devuelve la conexión del request en el teardown
+db.init_app(app)
+
 #  blueprints
 app.register_blueprint(empresa_bp)
 app.register_blueprint(sucursal_bp)
@@ -31,6 +37,10 @@ app.register_blueprint(turno_trabajador_bp)
 app.register_blueprint(reportes_bp) 
 app.register_blueprint(sueldos_bp)
 app.register_blueprint(login_bp)
+app.register_blueprint(metricas_bp)
+
+# Importa pandas/sklearn/plotly/gpt4all en segundo plano (PRECARGAR_DEPENDENCIAS=1)
+iniciar_precarga()
 
 @app.route("/")
 def home():
@@ -0,0 +1,99 @@
+"""
+Benchmark de arranque: tiempo de import y memoria (RSS) por blueprint.
+
+Cada módulo se importa en un proceso nuevo, así los números no dependen del
+orden. Además verifica que `import app` no cargue ninguna dependencia pesada
+(precarga.DEPENDENCIAS_PESADAS); si alguna aparece, el arranque volvió a
+pagar pandas/sklearn/plotly/gpt4all y el script termina con error.
+
+Uso (desde la raíz del repo):
+    python benchmarks/arranque.py
+    python benchmarks/arranque.py --limite-segundos 1.5   # falla si app tarda más
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from precarga import DEPENDENCIAS_PESADAS  # noqa: E402
+
+MODULOS = [
+    "routes.empresa",
+    "routes.sucursal",
+    "routes.areatrabajo",
+    "routes.trabajador",
+    "routes.asistencia",
+    "routes.turno",
+    "routes.turno_trabajador",
+    "routes.reportes",
+    "routes.sueldos",
+    "routes.login",
+    "app",
+]
+
+# Se ejecuta en el proceso hijo: mide el import y devuelve JSON por stdout
+_MEDIR = r"""
+import importlib, json, sys, time
+
+def rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+modulo, pesadas = sys.argv[1], json.loads(sys.argv[2])
+import flask, psycopg2  # base comun a todos los blueprints, fuera de la medicion
+antes = rss_kb()
+inicio = time.perf_counter()
+importlib.import_module(modulo)
+segundos = time.perf_counter() - inicio
+print(json.dumps({
+    "segundos": segundos,
+    "rss_kb": rss_kb() - antes,
+    "pesadas": [p for p in pesadas if p in sys.modules],
+}))
+"""
+
+
+def medir(modulo):
+    env = dict(os.environ, PRECARGAR_DEPENDENCIAS="0")
+    salida = subprocess.run(
+        [sys.executable, "-c", _MEDIR, modulo, json.dumps(DEPENDENCIAS_PESADAS)],
+        cwd=RAIZ, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limite-segundos", type=float, default=None,
+                        help="tiempo máximo permitido para importar app")
+    args = parser.parse_args()
+
+    print(f"{'módulo':<26}{'import (s)':>12}{'RSS (MB)':>11}  dependencias pesadas")
+    errores = []
+    for modulo in MODULOS:
+        r = medir(modulo)
+        pesadas = ", ".join(r["pesadas"]) or "-"
+        print(f"{modulo:<26}{r['segundos']:>12.3f}{r['rss_kb'] / 1024:>11.1f}  {pesadas}")
+        if r["pesadas"]:
+            errores.append(f"{modulo} importa {pesadas} al arrancar")
+        if modulo == "app" and args.limite_segundos is not None and r["segundos"] > args.limite_segundos:
+            errores.append(f"app tardó {r['segundos']:.2f}s (límite {args.limite_segundos}s)")
+
+    for e in errores:
+        print("REGRESIÓN:", e)
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
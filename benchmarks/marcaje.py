@@ -0,0 +1,263 @@
+"""
+Benchmark del marcaje de ingreso/salida (MiApiLogin).
+
+Compara, bajo carga concurrente, el camino anterior (buscar trabajador,
+SELECT ... FOR UPDATE de la última asistencia y luego UPDATE o INSERT: cuatro
+idas y vueltas con el bloqueo tomado) contra la sentencia única de
+MiApiLogin/marcaje.py. Cada hilo usa su propia conexión y repite ciclos de
+ingreso + salida sobre trabajadores al azar (con --trabajadores chico hay más
+contención sobre las mismas filas). Se informa throughput y latencia
+p50/p95/p99 por marcaje.
+
+En local el servidor responde en microsegundos; --rtt-ms agrega una espera
+tras cada sentencia para simular la latencia de red entre la Function y
+Postgres (en Azure suele ser de 1 a 5 ms), que es lo que multiplica el costo
+de las idas y vueltas.
+
+Uso (desde la raíz del repo, contra una base de pruebas):
+    python benchmarks/marcaje.py --dsn "dbname=pruebas user=postgres"
+    python benchmarks/marcaje.py --dsn "..." --hilos 32 --trabajadores 50 --rtt-ms 2
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, "MiApiLogin"))
+
+import psycopg2  # noqa: E402
+
+import marcaje  # noqa: E402
+
+ESQUEMA = "bench_marcaje"
+
+TABLAS = """
+    CREATE TABLE trabajador (id serial PRIMARY KEY, nombre text, email text, rut text);
+    CREATE TABLE asistencia (
+        id serial PRIMARY KEY, fecha date, hora_entrada time, hora_salida time, geolocalizacion text,
+        trabajador_id int REFERENCES trabajador(id), numero_asistencia int, is_asistencia boolean,
+        justificado boolean, procesado_ia boolean, mensaje text, categoria text,
+        fecha_inicio_inasistencia date, fecha_fin_inasistencia date, duracion_dias int
+    );
+"""
+
+INDICES = """
+    CREATE INDEX ON trabajador (email);
+    CREATE INDEX ON asistencia (fecha);
+    CREATE INDEX ON asistencia (trabajador_id, fecha DESC NULLS LAST, id DESC);
+"""
+
+
+def poblar(cur, trabajadores, dias):
+    cur.execute("""
+        INSERT INTO trabajador (nombre, email, rut)
+        SELECT 'Trabajador ' || g, 't' || g || '@bench', 'rut-' || g FROM generate_series(1, %s) g
+    """, (trabajadores,))
+    # Historial previo: una asistencia cerrada por trabajador y día
+    cur.execute("""
+        INSERT INTO asistencia (fecha, hora_entrada, hora_salida, trabajador_id, is_asistencia, justificado, procesado_ia)
+        SELECT d::date, '08:00', '17:00', t, TRUE, FALSE, FALSE
+        FROM generate_series(%s::date, %s::date, INTERVAL '1 day') d, generate_series(1, %s) t
+    """, (date.today() - timedelta(days=dias), date.today() - timedelta(days=1), trabajadores))
+
+
+class Cursor:
+    """Cursor que espera `rtt` segundos tras cada execute (latencia de red simulada)."""
+
+    def __init__(self, cur, rtt):
+        self._cur = cur
+        self._rtt = rtt
+
+    def execute(self, sql, params=None):
+        self._cur.execute(sql, params)
+        if self._rtt:
+            time.sleep(self._rtt)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cur, nombre)
+
+
+# ---- Camino anterior (copia de function_app.py antes del cambio) ----
+
+def _resolver(cur, email):
+    cur.execute("SELECT id FROM trabajador WHERE email=%s LIMIT 1", (email,))
+    r = cur.fetchone()
+    return r[0] if r else None
+
+
+def ingreso_anterior(conn, cur, email, fecha, hora):
+    trabajador_id = _resolver(cur, email)
+    if not trabajador_id:
+        conn.rollback()
+        return 404
+    cur.execute("""
+        SELECT id, fecha, hora_entrada, hora_salida FROM asistencia
+         WHERE trabajador_id = %s ORDER BY fecha DESC NULLS LAST, id DESC LIMIT 1 FOR UPDATE
+    """, (trabajador_id,))
+    last = cur.fetchone()
+    if last:
+        a_id, a_fecha, a_hin, a_hout = last
+        if a_hin is None:
+            cur.execute("""
+                UPDATE asistencia SET fecha = %s, hora_entrada = %s, is_asistencia = TRUE WHERE id = %s
+             RETURNING id, fecha, hora_entrada, hora_salida, trabajador_id, is_asistencia
+            """, (fecha, hora, a_id))
+            cur.fetchone()
+            conn.commit()
+            return 200
+        if a_hout is None and a_fecha == fecha:
+            conn.rollback()
+            return 409
+    cur.execute("""
+        INSERT INTO asistencia (fecha, hora_entrada, trabajador_id, is_asistencia, justificado, procesado_ia)
+        VALUES (%s, %s, %s, TRUE, FALSE, FALSE)
+        RETURNING id, fecha, hora_entrada, hora_salida, trabajador_id, is_asistencia
+    """, (fecha, hora, trabajador_id))
+    cur.fetchone()
+    conn.commit()
+    return 201
+
+
+def salida_anterior(conn, cur, email, fecha, hora):
+    trabajador_id = _resolver(cur, email)
+    if not trabajador_id:
+        conn.rollback()
+        return 404
+    cur.execute("""
+        SELECT id, fecha, hora_entrada, hora_salida FROM asistencia
+         WHERE trabajador_id = %s AND fecha = %s ORDER BY id DESC LIMIT 1 FOR UPDATE
+    """, (trabajador_id, fecha))
+    row = cur.fetchone()
+    if not row:
+        conn.rollback()
+        return 404
+    a_id, _, a_hin, a_hout = row
+    if a_hin is None or a_hout is not None:
+        conn.rollback()
+        return 409
+    cur.execute("""
+        UPDATE asistencia SET hora_salida = %s, is_asistencia = TRUE WHERE id = %s
+     RETURNING id, fecha, hora_entrada, hora_salida, trabajador_id, is_asistencia
+    """, (hora, a_id))
+    cur.fetchone()
+    conn.commit()
+    return 200
+
+
+# ---- Sentencia única ----
+
+_ESTADOS = {"actualizada": 200, "creada": 201, "marcada": 200, "sin_trabajador": 404,
+            "sin_asistencia": 404, "con_entrada": 409, "sin_entrada": 409, "con_salida": 409}
+
+
+def _nuevo(sql):
+    def marcar(conn, cur, email, fecha, hora):
+        resultado, _ = marcaje.marcar(cur, sql, marcaje.parametros(None, email, None, fecha, hora))
+        conn.commit()
+        return _ESTADOS[resultado]
+    return marcar
+
+
+CAMINOS = {
+    "anterior": (ingreso_anterior, salida_anterior),
+    "sentencia única": (_nuevo(marcaje.SQL_INGRESO), _nuevo(marcaje.SQL_SALIDA)),
+}
+
+
+def correr(dsn, ingreso, salida, hilos, ciclos, trabajadores, rtt):
+    latencias, estados, errores = [], {}, []
+    lock = threading.Lock()
+
+    def trabajador_hilo(semilla):
+        azar = random.Random(semilla)
+        conn = psycopg2.connect(dsn)
+        cur = Cursor(conn.cursor(), rtt)
+        cur.execute(f"SET search_path TO {ESQUEMA}")
+        propias, vistos = [], {}
+        try:
+            for _ in range(ciclos):
+                email = f"t{azar.randint(1, trabajadores)}@bench"
+                for funcion in (ingreso, salida):
+                    ahora = datetime.now()
+                    inicio = time.perf_counter()
+                    try:
+                        status = funcion(conn, cur, email, ahora.date(), ahora.time())
+                    except psycopg2.Error as e:
+                        conn.rollback()
+                        status = "error"
+                        errores.append(str(e).strip())
+                    propias.append(time.perf_counter() - inicio)
+                    vistos[status] = vistos.get(status, 0) + 1
+        finally:
+            conn.close()
+        with lock:
+            latencias.extend(propias)
+            for k, v in vistos.items():
+                estados[k] = estados.get(k, 0) + v
+
+    inicio = time.perf_counter()
+    ts = [threading.Thread(target=trabajador_hilo, args=(i,)) for i in range(hilos)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return time.perf_counter() - inicio, latencias, estados, errores
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p / 100.0 * len(ordenados)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="cadena de conexión a una base de pruebas")
+    parser.add_argument("--hilos", type=int, default=16, help="clientes concurrentes")
+    parser.add_argument("--ciclos", type=int, default=200, help="ingreso + salida por hilo")
+    parser.add_argument("--trabajadores", type=int, default=500)
+    parser.add_argument("--dias", type=int, default=365, help="días de historial sintético")
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="latencia de red simulada por sentencia")
+    parser.add_argument("--conservar", action="store_true", help="no borrar el esquema al terminar")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE; CREATE SCHEMA {ESQUEMA}")
+    cur.execute(f"SET search_path TO {ESQUEMA}")
+    try:
+        cur.execute(TABLAS)
+        poblar(cur, args.trabajadores, args.dias)
+        cur.execute(INDICES)
+        cur.execute("ANALYZE")
+        conn.commit()
+        print(f"{args.trabajadores} trabajadores, {args.dias} días de historial, {args.hilos} hilos × "
+              f"{args.ciclos} ciclos, rtt simulado {args.rtt_ms} ms")
+
+        print(f"{'camino':<18}{'marcajes/s':>12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  estados")
+        for nombre, (ingreso, salida) in CAMINOS.items():
+            # Cada camino parte sin asistencias de hoy
+            cur.execute("DELETE FROM asistencia WHERE fecha >= CURRENT_DATE")
+            conn.commit()
+            segundos, latencias, estados, errores = correr(
+                args.dsn, ingreso, salida, args.hilos, args.ciclos, args.trabajadores, args.rtt_ms / 1000.0)
+            ms = [x * 1000 for x in latencias]
+            print(f"{nombre:<18}{len(latencias) / segundos:>12.0f}{statistics.median(ms):>9.2f}"
+                  f"{percentil(ms, 95):>9.2f}{percentil(ms, 99):>9.2f}  "
+                  + ", ".join(f"{k}: {v}" for k, v in sorted(estados.items(), key=str)))
+            for error in sorted(set(errores))[:3]:
+                print(f"    error: {error}")
+    finally:
+        conn.rollback()
+        if not args.conservar:
+            cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
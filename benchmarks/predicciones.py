@@ -0,0 +1,153 @@
+"""
+Benchmark de predicción de inasistencias con datos sintéticos (sin base de datos).
+
+Compara la versión agrupada (routes.asistencia.predecir_inasistencias) con el
+bucle original por trabajador, que filtraba el DataFrame completo y llamaba a
+`predict` una vez por trabajador. También verifica que ambas den el mismo
+resultado.
+
+Uso (desde la raíz del repo):
+    python benchmarks/predicciones.py
+    python benchmarks/predicciones.py --trabajadores 1000 5000 10000 --faltas 8
+    python benchmarks/predicciones.py --max-original 0      # solo la versión nueva
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from routes.asistencia import entrenar_modelo, predecir_inasistencias  # noqa: E402
+
+CATEGORIAS = ["medico", "accidente", "asunto familiar", "asunto personal", "otros"]
+
+
+def datos_sinteticos(n_trabajadores, faltas_promedio, semilla=42):
+    rng = np.random.default_rng(semilla)
+    faltas = rng.poisson(faltas_promedio, n_trabajadores).clip(min=1)
+    tids = np.repeat(np.arange(1, n_trabajadores + 1), faltas)
+    inicio = np.datetime64("2022-01-01")
+    fechas = inicio + rng.integers(0, 4 * 365, len(tids)).astype("timedelta64[D]")
+    df = pd.DataFrame({
+        "trabajador_id": tids,
+        "fecha": pd.to_datetime(fechas).date,
+        "categoria": rng.choice(CATEGORIAS, len(tids)),
+        "duracion_dias": rng.integers(1, 6, len(tids)).astype(float),
+    })
+    fechas_dt = pd.to_datetime(df["fecha"])
+    df["dia_semana"] = ((fechas_dt.dt.dayofweek + 1) % 7).astype(float)  # DOW de Postgres
+    df["mes"] = fechas_dt.dt.month.astype(float)
+    df = df.sort_values("fecha", kind="mergesort").reset_index(drop=True)
+
+    ids = np.arange(1, n_trabajadores + 1)
+    df_trabajadores = pd.DataFrame({
+        "id": ids,
+        "nombre": [f"Nombre{i}" for i in ids],
+        "apellido": [f"Apellido{i}" for i in ids],
+    })
+    df_trabajadores["nombre_completo"] = df_trabajadores["nombre"] + " " + df_trabajadores["apellido"]
+    return df, df_trabajadores
+
+
+def predecir_original(df, df_trabajadores, rf_model, le_cat):
+    """Bucle original de entrenar_y_predecir_inasistencias (O(trabajadores × filas))."""
+    resultados = []
+    for tid in df["trabajador_id"].unique():
+        w_data = df[df["trabajador_id"] == tid].sort_values("fecha")
+        nombre_df = df_trabajadores[df_trabajadores["id"] == tid]
+        nombre = nombre_df["nombre_completo"].iloc[0] if not nombre_df.empty else f"Trabajador {tid}"
+
+        riesgo_texto = "Bajo"
+        promedio_dias_entre_faltas = None
+        fecha_inicio_estimada = None
+        if len(w_data) >= 2:
+            w_data["fecha"] = pd.to_datetime(w_data["fecha"])
+            diferencias = w_data["fecha"].diff().dt.days.dropna()
+            promedio = diferencias.mean() if not diferencias.empty else float("nan")
+            if not pd.isna(promedio) and np.isfinite(promedio):
+                promedio_dias_entre_faltas = promedio
+                fecha_inicio_estimada = w_data["fecha"].iloc[-1] + timedelta(days=promedio)
+                dias_restantes = (fecha_inicio_estimada - datetime.now()).days
+                if fecha_inicio_estimada < datetime.now():
+                    riesgo_texto = "⚠️ ALTO (Atrasado)"
+                elif dias_restantes < 7:
+                    riesgo_texto = "Alto"
+                elif dias_restantes < 15:
+                    riesgo_texto = "Medio"
+            else:
+                fecha_inicio_estimada = datetime.now() + timedelta(days=30)
+                riesgo_texto = "Sin historial suficiente"
+        else:
+            fecha_inicio_estimada = datetime.now() + timedelta(days=30)
+            riesgo_texto = "Sin historial suficiente"
+
+        if rf_model:
+            try:
+                mañana = date.today() + timedelta(days=1)
+                cat_moda = w_data["categoria"].mode()[0]
+                cat_code = le_cat.transform([cat_moda])[0] if cat_moda in le_cat.classes_ else 0
+                X_pred = pd.DataFrame([[tid, mañana.weekday(), mañana.month, cat_code]],
+                                      columns=["trabajador_id", "dia_semana", "mes", "cat_encoded"])
+                dias_duracion_est = rf_model.predict(X_pred)[0]
+            except Exception:
+                dias_duracion_est = w_data["duracion_dias"].mean()
+        else:
+            dias_duracion_est = w_data["duracion_dias"].mean()
+        if pd.isna(dias_duracion_est) or not np.isfinite(dias_duracion_est):
+            dias_duracion_est = 1
+        duracion_entero = max(1, int(round(dias_duracion_est)))
+
+        fecha_fin_estimada = fecha_inicio_estimada + timedelta(days=duracion_entero - 1)
+        str_inicio = fecha_inicio_estimada.strftime("%d/%m/%Y")
+        str_fin = fecha_fin_estimada.strftime("%d/%m/%Y")
+        rango_texto = f"{str_inicio} al {str_fin}" if duracion_entero > 1 else str_inicio
+        if promedio_dias_entre_faltas is not None and np.isfinite(promedio_dias_entre_faltas):
+            freq_text = f"Falta cada {int(round(promedio_dias_entre_faltas))} días"
+        else:
+            freq_text = "N/A"
+        resultados.append({
+            "Trabajador": nombre,
+            "Estado Riesgo": riesgo_texto,
+            "Fechas Exactas Estimadas": rango_texto,
+            "Días Totales": duracion_entero,
+            "Frecuencia Histórica": freq_text,
+        })
+    return resultados
+
+
+def cronometrar(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return time.perf_counter() - inicio, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trabajadores", type=int, nargs="+", default=[100, 1000, 5000, 10000])
+    parser.add_argument("--faltas", type=float, default=8, help="faltas promedio por trabajador")
+    parser.add_argument("--max-original", type=int, default=2000,
+                        help="no correr el bucle original por encima de esta cantidad de trabajadores")
+    args = parser.parse_args()
+
+    print(f"{'trabajadores':>12}{'filas':>10}{'entrenar (s)':>14}{'agrupado (s)':>14}{'original (s)':>14}{'iguales':>9}")
+    for n in args.trabajadores:
+        df, df_trabajadores = datos_sinteticos(n, args.faltas)
+        t_fit, (rf_model, le_cat) = cronometrar(entrenar_modelo, df)
+        t_nuevo, nuevo = cronometrar(predecir_inasistencias, df, df_trabajadores, rf_model, le_cat)
+
+        if n <= args.max_original:
+            t_orig, original = cronometrar(predecir_original, df, df_trabajadores, rf_model, le_cat)
+            col_orig, iguales = f"{t_orig:>14.3f}", "sí" if original == nuevo else "NO"
+        else:
+            col_orig, iguales = f"{'-':>14}", "-"
+        print(f"{n:>12}{len(df):>10}{t_fit:>14.3f}{t_nuevo:>14.3f}{col_orig}{iguales:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Benchmark del gráfico de asistencia (routes.reportes.get_data_for_chart).
+
+Crea un esquema temporal con datos sintéticos de varios años (empresas,
+sucursales, áreas, trabajadores con turno y una fila de asistencia por
+trabajador y día hábil), y compara la consulta original (CROSS JOIN de todos
+los trabajadores con todos los meses y join por TO_CHAR(fecha)) contra
+SQL_GRAFICO con rangos semiabiertos (y SQL_GRAFICO_RESUMEN, que lee la tabla
+asistencia_mensual), para la ventana por defecto y con filtros. Con --explain
+imprime el EXPLAIN ANALYZE de cada consulta.
+
+El esquema se borra al terminar (usar --conservar para inspeccionarlo).
+
+Uso (desde la raíz del repo, contra una base de pruebas):
+    python benchmarks/reportes.py --dsn "dbname=pruebas user=postgres"
+    python benchmarks/reportes.py --dsn "..." --trabajadores 2000 --anios 5 --explain
+    python benchmarks/reportes.py --dsn "..." --sin-indices     # sin índice en asistencia
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import psycopg2  # noqa: E402
+
+import esquema  # noqa: E402
+from resumen_mensual import SQL_RECONSTRUIR  # noqa: E402
+from routes.reportes import SQL_GRAFICO, SQL_GRAFICO_RESUMEN, _sumar_meses, parametros_sql  # noqa: E402
+
+ESQUEMA = "bench_reportes"
+
+SQL_ORIGINAL = """
+    WITH meses AS (
+        SELECT DISTINCT TO_CHAR(fecha, 'YYYY-MM') AS anio_mes
+        FROM asistencia
+    ),
+    trabajadores_meses AS (
+        SELECT
+            t.id AS trabajador_id,
+            TRIM(CONCAT_WS(' ', t.nombre, t.apellido)) AS nombre_trabajador,
+            m.anio_mes
+        FROM trabajador t
+        CROSS JOIN meses m
+    )
+    SELECT
+        tm.nombre_trabajador,
+        EXTRACT(YEAR FROM TO_DATE(tm.anio_mes, 'YYYY-MM')) AS anio,
+        EXTRACT(MONTH FROM TO_DATE(tm.anio_mes, 'YYYY-MM')) AS mes_num,
+        COUNT(DISTINCT a.fecha) AS dias_asistidos
+    FROM trabajadores_meses tm
+    LEFT JOIN asistencia a ON tm.trabajador_id = a.trabajador_id
+                           AND TO_CHAR(a.fecha, 'YYYY-MM') = tm.anio_mes
+                           AND a.is_asistencia = TRUE
+    GROUP BY tm.nombre_trabajador, anio, mes_num
+    ORDER BY anio, mes_num;
+"""
+
+TABLAS = """
+    CREATE TABLE empresa (id serial PRIMARY KEY, nombre text);
+    CREATE TABLE sucursal (id serial PRIMARY KEY, nombre text, empresa_id int);
+    CREATE TABLE areatrabajo (id serial PRIMARY KEY, nombre text, sucursal_id int);
+    CREATE TABLE trabajador (id serial PRIMARY KEY, nombre text, apellido text, sucursal_id int);
+    CREATE TABLE turno (id serial PRIMARY KEY, horario_inicio time DEFAULT '08:00', area_id int);
+    CREATE TABLE turno_trabajador (id serial PRIMARY KEY, turno_id int, trabajador_id int);
+    CREATE TABLE asistencia (id serial PRIMARY KEY, fecha date, trabajador_id int, is_asistencia boolean,
+                             justificado boolean, hora_entrada time, horas_trabajadas interval);
+"""
+
+INDICES = """
+    CREATE INDEX ON asistencia (fecha);
+    CREATE INDEX ON asistencia (trabajador_id, fecha);
+    CREATE INDEX ON turno_trabajador (trabajador_id);
+"""
+
+
+def poblar(cur, trabajadores, anios, sucursales, areas):
+    hasta = date.today()
+    desde = date(hasta.year - anios, hasta.month, 1)
+    cur.execute("INSERT INTO empresa (nombre) SELECT 'Empresa ' || g FROM generate_series(1, 2) g")
+    cur.execute("""
+        INSERT INTO sucursal (nombre, empresa_id)
+        SELECT 'Sucursal ' || g, 1 + g %% 2 FROM generate_series(1, %s) g
+    """, (sucursales,))
+    cur.execute("""
+        INSERT INTO areatrabajo (nombre, sucursal_id)
+        SELECT 'Área ' || g, 1 + g %% %s FROM generate_series(1, %s) g
+    """, (sucursales, areas))
+    cur.execute("INSERT INTO turno (area_id) SELECT g FROM generate_series(1, %s) g", (areas,))
+    cur.execute("""
+        INSERT INTO trabajador (nombre, apellido, sucursal_id)
+        SELECT 'Nombre' || g, 'Apellido' || g, 1 + g %% %s FROM generate_series(1, %s) g
+    """, (sucursales, trabajadores))
+    cur.execute("""
+        INSERT INTO turno_trabajador (turno_id, trabajador_id)
+        SELECT 1 + g %% %s, g FROM generate_series(1, %s) g
+    """, (areas, trabajadores))
+    cur.execute("""
+        INSERT INTO asistencia (fecha, trabajador_id, is_asistencia)
+        SELECT d::date, t, random() > 0.1
+        FROM generate_series(%s::date, %s::date, INTERVAL '1 day') d,
+             generate_series(1, %s) t
+        WHERE EXTRACT(ISODOW FROM d) < 6
+    """, (desde, hasta, trabajadores))
+    cur.execute("SELECT COUNT(*) FROM asistencia")
+    return cur.fetchone()[0]
+
+
+def cronometrar(cur, sql, params, repeticiones):
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cur.execute(sql, params)
+        filas = len(cur.fetchall())
+        segundos = time.perf_counter() - inicio
+        mejor = segundos if mejor is None else min(mejor, segundos)
+    return mejor, filas
+
+
+def explain(cur, sql, params):
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+    return "\n".join(f"    {fila[0]}" for fila in cur.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="cadena de conexión a una base de pruebas")
+    parser.add_argument("--trabajadores", type=int, default=500)
+    parser.add_argument("--anios", type=int, default=4, help="años de historial sintético")
+    parser.add_argument("--sucursales", type=int, default=6)
+    parser.add_argument("--areas", type=int, default=12)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--sin-indices", action="store_true")
+    parser.add_argument("--explain", action="store_true", help="imprimir EXPLAIN ANALYZE")
+    parser.add_argument("--conservar", action="store_true", help="no borrar el esquema al terminar")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE; CREATE SCHEMA {ESQUEMA}")
+    cur.execute(f"SET search_path TO {ESQUEMA}")
+    try:
+        cur.execute(TABLAS)
+        inicio = time.perf_counter()
+        filas = poblar(cur, args.trabajadores, args.anios, args.sucursales, args.areas)
+        if not args.sin_indices:
+            cur.execute(INDICES)
+        # Resumen mensual con sus triggers (mismo DDL que `python esquema.py`)
+        for sentencia in esquema.DDL_RESUMEN_MENSUAL:
+            cur.execute(sentencia)
+        cur.execute(SQL_RECONSTRUIR)
+        cur.execute("ANALYZE")
+        conn.commit()
+        print(f"{filas} asistencias, {args.trabajadores} trabajadores, {args.anios} años "
+              f"({time.perf_counter() - inicio:.1f}s en generar)")
+
+        hasta = date.today().replace(day=1)
+        base = {"desde": _sumar_meses(hasta, -11), "hasta": hasta,
+                "empresa": None, "sucursal": None, "area": None}
+        casos = [
+            ("original (todo el historial)", SQL_ORIGINAL, None),
+            ("nuevo: todo el historial", SQL_GRAFICO,
+             parametros_sql(dict(base, desde=_sumar_meses(hasta, -12 * args.anios)))),
+            ("nuevo: últimos 12 meses", SQL_GRAFICO, parametros_sql(base)),
+            ("nuevo: 12 meses, empresa 1", SQL_GRAFICO, parametros_sql(dict(base, empresa=1))),
+            ("nuevo: 12 meses, sucursal 1", SQL_GRAFICO, parametros_sql(dict(base, sucursal=1))),
+            ("nuevo: 12 meses, área 1", SQL_GRAFICO, parametros_sql(dict(base, area=1))),
+            ("resumen: todo el historial", SQL_GRAFICO_RESUMEN,
+             parametros_sql(dict(base, desde=_sumar_meses(hasta, -12 * args.anios)))),
+            ("resumen: últimos 12 meses", SQL_GRAFICO_RESUMEN, parametros_sql(base)),
+            ("resumen: 12 meses, área 1", SQL_GRAFICO_RESUMEN, parametros_sql(dict(base, area=1))),
+        ]
+
+        print(f"{'consulta':<32}{'filas':>10}{'mejor (s)':>12}")
+        for nombre, sql, params in casos:
+            segundos, n = cronometrar(cur, sql, params, args.repeticiones)
+            print(f"{nombre:<32}{n:>10}{segundos:>12.3f}")
+            if args.explain:
+                print(explain(cur, sql, params))
+            conn.rollback()
+    finally:
+        if not args.conservar:
+            cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
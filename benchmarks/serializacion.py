@@ -0,0 +1,249 @@
+"""
+Benchmark de la serialización de /api/asistencia/listar (MiApiLogin).
+
+Compara el camino anterior (fetchall, serialize_row_with_cols por fila, lista
+completa de dicts y json.dumps) contra MiApiLogin/serializacion.py (plan
+compilado por consulta y JSON codificado por lotes) sobre un historial de
+--filas asistencias de un trabajador:
+
+  - en memoria: filas sintéticas ya cargadas, mide solo la serialización;
+  - con --dsn: además la consulta, leyendo el historial de una tabla temporal;
+    el camino nuevo usa un cursor del lado del servidor, como la Function
+    con historiales sobre LISTAR_STREAM_MIN.
+
+Cada variante corre en un proceso nuevo para medir su pico de memoria (RSS
+máximo sobre el que tenía el proceso antes de empezar, incluye lo que
+reserva libpq) y se informa el costo por fila en microsegundos. Se verifica
+que ambos caminos produzcan exactamente el mismo JSON.
+
+Uso (desde la raíz del repo):
+    python benchmarks/serializacion.py
+    python benchmarks/serializacion.py --filas 100000 --dsn "dbname=pruebas user=postgres"
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from datetime import date, datetime, timedelta
+from datetime import time as dtime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, "MiApiLogin"))
+
+import serializacion  # noqa: E402
+
+ESQUEMA = "bench_serializacion"
+
+COLUMNAS = [
+    "id", "fecha", "hora_entrada", "hora_salida", "geolocalizacion",
+    "trabajador_id", "numero_asistencia", "is_asistencia", "justificado",
+    "procesado_ia", "mensaje", "categoria", "fecha_inicio_inasistencia",
+    "fecha_fin_inasistencia", "duracion_dias",
+]
+# Tipos (OID) de cada columna, como los trae cursor.description
+TIPOS = [23, 1082, 1083, 1083, 25, 23, 23, 16, 16, 16, 25, 25, 1082, 1082, 23]
+
+SQL_HISTORIAL = "SELECT " + ", ".join(COLUMNAS) + """
+      FROM asistencia
+     WHERE trabajador_id = 1
+     ORDER BY fecha DESC, numero_asistencia DESC NULLS LAST, id DESC
+"""
+
+
+# ---- Camino anterior (copia de function_app.py antes del cambio) ----
+
+_DATE_FIELDS = {"fecha", "fecha_inicio_inasistencia", "fecha_fin_inasistencia"}
+_TIME_FIELDS = {"hora_entrada", "hora_salida"}
+
+
+def _fmt_date(v):
+    return v.strftime("%Y-%m-%d") if isinstance(v, date) else v
+
+
+def _fmt_time(v):
+    return v.strftime("%H:%M:%S") if isinstance(v, dtime) else v
+
+
+def _fmt_datetime(v):
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    return v
+
+
+def serialize_row_with_cols(row, cols):
+    out = {}
+    for i, col in enumerate(cols):
+        v = row[i]
+        if col in _DATE_FIELDS:
+            out[col] = _fmt_date(v)
+        elif col in _TIME_FIELDS:
+            out[col] = _fmt_time(v)
+        else:
+            out[col] = _fmt_datetime(v)
+    return out
+
+
+def anterior(encabezado, rows):
+    body = dict(encabezado)
+    body["registros"] = [serialize_row_with_cols(r, COLUMNAS) for r in rows]
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+# ---- Datos ----
+
+def filas_sinteticas(n):
+    """Un historial de n días: entradas/salidas, algunas ausencias y mensajes."""
+    hoy = date.today()
+    filas = []
+    for i in range(n):
+        ausente = i % 11 == 0
+        filas.append((
+            i + 1, hoy - timedelta(days=i),
+            None if ausente else dtime(8, i % 60, i % 37),
+            None if ausente or i % 7 == 0 else dtime(17, i % 60),
+            None, 1, i + 1, not ausente, ausente and i % 2 == 0, ausente,
+            "Licencia médica según certificado" if ausente else None,
+            "licencia" if ausente else None,
+            hoy - timedelta(days=i) if ausente else None,
+            hoy - timedelta(days=i) if ausente else None,
+            1 if ausente else None,
+        ))
+    return filas
+
+
+class CursorEnMemoria:
+    """Lo mínimo de un cursor psycopg2 sobre una lista ya cargada."""
+
+    def __init__(self, filas):
+        self.description = [(c, t) for c, t in zip(COLUMNAS, TIPOS)]
+        self._filas = filas
+        self._pos = 0
+
+    def fetchmany(self, n):
+        lote = self._filas[self._pos:self._pos + n]
+        self._pos += n
+        return lote
+
+
+def preparar_base(dsn, n):
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE; CREATE SCHEMA {ESQUEMA}")
+    cur.execute(f"SET search_path TO {ESQUEMA}")
+    cur.execute("""
+        CREATE TABLE asistencia (
+            id int PRIMARY KEY, fecha date, hora_entrada time, hora_salida time, geolocalizacion text,
+            trabajador_id int, numero_asistencia int, is_asistencia boolean, justificado boolean,
+            procesado_ia boolean, mensaje text, categoria text, fecha_inicio_inasistencia date,
+            fecha_fin_inasistencia date, duracion_dias int
+        )
+    """)
+    cur.executemany("INSERT INTO asistencia VALUES (" + ", ".join(["%s"] * len(COLUMNAS)) + ")",
+                    filas_sinteticas(n))
+    cur.execute("CREATE INDEX ON asistencia (trabajador_id, fecha)")
+    cur.execute("ANALYZE asistencia")
+    conn.commit()
+    conn.close()
+
+
+# ---- Medición (una variante por proceso) ----
+
+ENCABEZADO = {"message": "OK", "total": 0, "cursor": "0"}
+
+
+def _medir(variante, n, dsn, cola):
+    if dsn:
+        import psycopg2
+        conn = psycopg2.connect(dsn, options=f"-c search_path={ESQUEMA}")
+        filas = None
+    else:
+        filas = filas_sinteticas(n)
+    antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    inicio = time.perf_counter()
+    if dsn and variante == "anterior":
+        cur = conn.cursor()
+        cur.execute(SQL_HISTORIAL)
+        cuerpo = anterior(ENCABEZADO, cur.fetchall())
+    elif dsn:
+        cur = conn.cursor(name="historial")
+        cur.execute(SQL_HISTORIAL)
+        cuerpo = serializacion.cuerpo_json(ENCABEZADO, "registros", cur)
+    elif variante == "anterior":
+        cuerpo = anterior(ENCABEZADO, filas)
+    else:
+        cuerpo = serializacion.cuerpo_json(ENCABEZADO, "registros", CursorEnMemoria(filas))
+    segundos = time.perf_counter() - inicio
+
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - antes
+    if dsn:
+        conn.close()
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    pico_mb = pico / (1024.0 * 1024.0) if sys.platform == "darwin" else pico / 1024.0
+    cola.put((segundos, pico_mb, len(cuerpo), hashlib.sha1(cuerpo).hexdigest()))
+
+
+def medir(variante, n, dsn):
+    ctx = multiprocessing.get_context("spawn")
+    cola = ctx.Queue()
+    proceso = ctx.Process(target=_medir, args=(variante, n, dsn, cola))
+    proceso.start()
+    resultado = cola.get()
+    proceso.join()
+    return resultado
+
+
+def en_proceso(funcion, *args):
+    # El proceso principal no debe crecer: en Linux un proceso nuevo hereda
+    # el RSS máximo del que lo lanzó y eso taparía los picos medidos.
+    proceso = multiprocessing.get_context("spawn").Process(target=funcion, args=args)
+    proceso.start()
+    proceso.join()
+    if proceso.exitcode:
+        sys.exit(proceso.exitcode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=100000, help="asistencias del historial")
+    parser.add_argument("--dsn", help="base de pruebas para medir también la consulta")
+    parser.add_argument("--repeticiones", type=int, default=3, help="se informa el mejor tiempo")
+    parser.add_argument("--conservar", action="store_true", help="no borrar el esquema al terminar")
+    args = parser.parse_args()
+
+    escenarios = [("en memoria", None)]
+    if args.dsn:
+        en_proceso(preparar_base, args.dsn, args.filas)
+        escenarios.append(("con consulta", args.dsn))
+
+    try:
+        print(f"{args.filas} filas, mejor de {args.repeticiones}")
+        print(f"{'escenario':<14}{'camino':<12}{'total ms':>10}{'µs/fila':>10}{'pico MB':>10}{'JSON MB':>10}")
+        for escenario, dsn in escenarios:
+            cuerpos = set()
+            for variante in ("anterior", "nuevo"):
+                medidas = [medir(variante, args.filas, dsn) for _ in range(args.repeticiones)]
+                segundos = min(m[0] for m in medidas)
+                pico = min(m[1] for m in medidas)
+                largo, huella = medidas[0][2], medidas[0][3]
+                cuerpos.add(huella)
+                print(f"{escenario:<14}{variante:<12}{segundos * 1000:>10.0f}"
+                      f"{segundos * 1e6 / args.filas:>10.2f}{pico:>10.1f}{largo / 1e6:>10.1f}")
+            if len(cuerpos) != 1:
+                print(f"    ¡los JSON de {escenario} no coinciden!")
+    finally:
+        if args.dsn and not args.conservar:
+            import psycopg2
+            conn = psycopg2.connect(args.dsn)
+            conn.cursor().execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+            conn.commit()
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Benchmark de la consulta de sueldos (routes.sueldos.SQL_SUELDOS).
+
+Crea un esquema temporal con datos sintéticos (una fila de asistencia por
+trabajador y día hábil durante varios años) y mide la consulta para períodos
+de distinto largo: quincena, mes, trimestre y año. Para cada uno muestra las
+filas de asistencia del período, el tiempo y los buffers leídos según
+EXPLAIN (ANALYZE, BUFFERS): con el índice en asistencia.fecha ambos deben
+crecer con el período y no con el tamaño de la tabla. También mide la
+consulta anterior (dos CTE sobre el mes actual) como referencia. Al final
+comprueba la edición masiva (SQL_ACTUALIZAR_LOTE) con un trabajador que tiene
+dos filas en rendimiento.
+
+Uso (desde la raíz del repo, contra una base de pruebas):
+    python benchmarks/sueldos.py --dsn "dbname=pruebas user=postgres"
+    python benchmarks/sueldos.py --dsn "..." --trabajadores 2000 --anios 6
+    python benchmarks/sueldos.py --dsn "..." --sin-indices --explain
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import psycopg2  # noqa: E402
+
+from routes.sueldos import SQL_ACTUALIZAR_LOTE, SQL_SUELDOS, _sumar_meses  # noqa: E402
+
+ESQUEMA = "bench_sueldos"
+
+# Las consultas de la app califican las tablas con public.; aquí se quitan
+# para que resuelvan al esquema temporal vía search_path.
+def _local(sql):
+    return sql.replace("public.", "")
+
+SQL_ORIGINAL = """
+    WITH horas_mes AS (
+        SELECT trabajador_id, SUM(EXTRACT(EPOCH FROM horas_trabajadas) / 3600.0) AS horas_mes
+        FROM asistencia
+        WHERE fecha >= date_trunc('month', CURRENT_DATE)
+          AND fecha <  date_trunc('month', CURRENT_DATE) + INTERVAL '1 month'
+          AND horas_trabajadas IS NOT NULL
+        GROUP BY trabajador_id
+    ),
+    ausencias_mes AS (
+        SELECT trabajador_id, COUNT(*) AS ausencias_mes
+        FROM asistencia
+        WHERE is_asistencia = FALSE
+          AND fecha >= date_trunc('month', CURRENT_DATE)
+          AND fecha <  date_trunc('month', CURRENT_DATE) + INTERVAL '1 month'
+        GROUP BY trabajador_id
+    )
+    SELECT r.trabajador_id, r.trabajador,
+           COALESCE(h.horas_mes, 0) AS horas, COALESCE(a.ausencias_mes, 0) AS ausencias
+    FROM rendimiento r
+    LEFT JOIN horas_mes     h ON h.trabajador_id = r.trabajador_id
+    LEFT JOIN ausencias_mes a ON a.trabajador_id = r.trabajador_id
+    ORDER BY r.trabajador_id
+"""
+
+TABLAS = """
+    CREATE TABLE turno (id serial PRIMARY KEY, horario_inicio time);
+    CREATE TABLE turno_trabajador (id serial PRIMARY KEY, turno_id int, trabajador_id int);
+    CREATE TABLE rendimiento (trabajador_id int PRIMARY KEY, trabajador text, valor_hora numeric[],
+                              "Sueldo" numeric[], total_horas_trabajadas numeric);
+    CREATE TABLE asistencia (id serial PRIMARY KEY, fecha date, trabajador_id int, is_asistencia boolean,
+                             justificado boolean, hora_entrada time, horas_trabajadas interval);
+"""
+
+INDICES = """
+    CREATE INDEX ON asistencia (fecha);
+    CREATE INDEX ON turno_trabajador (trabajador_id);
+"""
+
+
+def poblar(cur, trabajadores, anios):
+    hasta = date.today()
+    desde = date(hasta.year - anios, hasta.month, 1)
+    cur.execute("INSERT INTO turno (horario_inicio) VALUES ('08:00'), ('09:00'), ('14:00')")
+    cur.execute("""
+        INSERT INTO turno_trabajador (turno_id, trabajador_id)
+        SELECT 1 + g %% 3, g FROM generate_series(1, %s) g
+    """, (trabajadores,))
+    cur.execute("""
+        INSERT INTO rendimiento (trabajador_id, trabajador, valor_hora)
+        SELECT g, 'Trabajador ' || g, ARRAY[4000 + g %% 3000]::numeric[] FROM generate_series(1, %s) g
+    """, (trabajadores,))
+    cur.execute("""
+        INSERT INTO asistencia (fecha, trabajador_id, is_asistencia, justificado, hora_entrada, horas_trabajadas)
+        SELECT d::date, t, r > 0.08, r <= 0.05,
+               CASE WHEN r > 0.08 THEN TIME '07:50' + (r * INTERVAL '40 minutes') END,
+               CASE WHEN r > 0.08 THEN INTERVAL '8 hours' + (r * INTERVAL '1 hour') END
+        FROM generate_series(%s::date, %s::date, INTERVAL '1 day') d,
+             generate_series(1, %s) t,
+             LATERAL (SELECT random() AS r OFFSET 0) x
+        WHERE EXTRACT(ISODOW FROM d) < 6
+    """, (desde, hasta, trabajadores))
+    cur.execute("SELECT COUNT(*) FROM asistencia")
+    return cur.fetchone()[0]
+
+
+def periodos():
+    mes = date.today().replace(day=1)
+    mes_anterior = _sumar_meses(mes, -1)
+    return [
+        ("quincena", mes_anterior, mes_anterior.replace(day=16)),
+        ("mes", mes_anterior, mes),
+        ("trimestre", _sumar_meses(mes, -3), mes),
+        ("año", _sumar_meses(mes, -12), mes),
+    ]
+
+
+def medir(cur, sql, params, repeticiones):
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        segundos = time.perf_counter() - inicio
+        mejor = segundos if mejor is None else min(mejor, segundos)
+
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+    plan = cur.fetchone()[0][0]["Plan"]
+    buffers = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+    return mejor, buffers
+
+
+def verificar_lote(cur):
+    """
+    Edición masiva con dos filas de rendimiento para un mismo trabajador: cada
+    fila debe quedar con sus horas × valor_hora y la entrada con un solo
+    resultado. Se deshace al terminar.
+    """
+    cur.execute("SAVEPOINT lote")
+    try:
+        cur.execute("ALTER TABLE rendimiento DROP CONSTRAINT rendimiento_pkey")
+        cur.execute("UPDATE rendimiento SET total_horas_trabajadas = 10 WHERE trabajador_id IN (1, 2)")
+        cur.execute("""
+            INSERT INTO rendimiento (trabajador_id, trabajador, valor_hora, total_horas_trabajadas)
+            VALUES (1, 'Trabajador 1', NULL, 20)
+        """)
+        cur.execute(_local(SQL_ACTUALIZAR_LOTE),
+                    {"ids": [1, 2, 999999], "valores": [1000, None, 1000], "manuales": [None, 500, None]})
+        resultados = [(t, estado, sueldo) for t, estado, sueldo in cur.fetchall()]
+        cur.execute("""
+            SELECT trabajador_id, total_horas_trabajadas, valor_hora, "Sueldo"
+            FROM rendimiento WHERE trabajador_id IN (1, 2) ORDER BY 1, 2
+        """)
+        filas = cur.fetchall()
+    finally:
+        cur.execute("ROLLBACK TO SAVEPOINT lote")
+
+    esperados = [(1, "actualizado", None), (2, "actualizado", 500), (999999, "no_encontrado", None)]
+    assert resultados == esperados, f"resultados del lote: {resultados}"
+    assert [(t, float(h), v, s) for t, h, v, s in filas] == [
+        (1, 10.0, [1000], [10000]), (1, 20.0, [1000], [20000]), (2, 10.0, [4002], [500]),
+    ], f"filas de rendimiento: {filas}"
+    print("edición masiva con dos filas de rendimiento por trabajador: ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="cadena de conexión a una base de pruebas")
+    parser.add_argument("--trabajadores", type=int, default=500)
+    parser.add_argument("--anios", type=int, default=4, help="años de historial sintético")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--sin-indices", action="store_true")
+    parser.add_argument("--explain", action="store_true", help="imprimir el plan de cada período")
+    parser.add_argument("--conservar", action="store_true", help="no borrar el esquema al terminar")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE; CREATE SCHEMA {ESQUEMA}")
+    cur.execute(f"SET search_path TO {ESQUEMA}")
+    try:
+        cur.execute(TABLAS)
+        inicio = time.perf_counter()
+        filas = poblar(cur, args.trabajadores, args.anios)
+        if not args.sin_indices:
+            cur.execute(INDICES)
+        cur.execute("ANALYZE")
+        conn.commit()
+        print(f"{filas} asistencias, {args.trabajadores} trabajadores, {args.anios} años, "
+              f"{'sin' if args.sin_indices else 'con'} índice en fecha "
+              f"({time.perf_counter() - inicio:.1f}s en generar)")
+
+        sql = _local(SQL_SUELDOS)
+        print(f"{'período':<22}{'filas período':>14}{'mejor (s)':>11}{'buffers':>10}")
+        segundos, buffers = medir(cur, SQL_ORIGINAL, None, args.repeticiones)
+        print(f"{'original (mes actual)':<22}{'-':>14}{segundos:>11.3f}{buffers:>10}")
+        for nombre, desde, fin in periodos():
+            params = {"desde": desde, "fin": fin}
+            cur.execute("SELECT COUNT(*) FROM asistencia WHERE fecha >= %(desde)s AND fecha < %(fin)s", params)
+            filas_periodo = cur.fetchone()[0]
+            segundos, buffers = medir(cur, sql, params, args.repeticiones)
+            print(f"{nombre:<22}{filas_periodo:>14}{segundos:>11.3f}{buffers:>10}")
+            if args.explain:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+                print("\n".join(f"    {fila[0]}" for fila in cur.fetchall()))
+        verificar_lote(cur)
+    finally:
+        conn.rollback()
+        if not args.conservar:
+            cur.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
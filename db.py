@@ -1,14 +1,345 @@
 import psycopg2
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from flask import g, has_app_context, request
+
+import instrumentacion
 
 load_dotenv()
 
-def get_connection():
+# ==========================================
+# Pool de conexiones
+# ==========================================
+# Configuración por variables de entorno (ver .env):
+#   PG_POOL_MIN      conexiones que se abren al crear el pool (default 1)
+#   PG_POOL_MAX      máximo de conexiones abiertas a la vez (default 10)
+#   PG_POOL_TIMEOUT  segundos que se espera por una conexión libre (default 30)
+#   PG_POOL_CHECK    segundos de inactividad tras los cuales se hace un
+#                    "SELECT 1" antes de entregar la conexión (default 30, 0 = siempre)
+
+
+def _int_env(nombre, default):
+    try:
+        return int(os.getenv(nombre, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _float_env(nombre, default):
+    try:
+        return float(os.getenv(nombre, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _connect():
     return psycopg2.connect(
         host=os.getenv("PGHOST"),
         database=os.getenv("PGDATABASE"),
         user=os.getenv("PGUSER"),
         password=os.getenv("PGPASSWORD"),
-        port=os.getenv("PGPORT")
+        port=os.getenv("PGPORT"),
+        # Cada sentencia queda medida por ruta (ver instrumentacion.py)
+        connection_factory=instrumentacion.ConexionMedida,
     )
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No se liberó ninguna conexión dentro de PG_POOL_TIMEOUT."""
+
+
+class ConnectionPool:
+    """
+    Pool thread-safe de conexiones psycopg2 con tamaño mínimo/máximo,
+    verificación de salud al entregar y estadísticas de uso.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=30.0, check_idle=30.0, connect=_connect):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("Tamaño de pool inválido: min=%s max=%s" % (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = deque()   # (conn, instante en que se devolvió)
+        self._abiertas = 0
+        self._en_uso = 0
+        self._esperando = 0
+        # Estadísticas acumuladas
+        self._checkouts = 0
+        self._timeouts = 0
+        self._descartadas = 0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._abiertas += 1
+
+    def getconn(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, devuelta = self._idle.pop()
+                    break
+                if self._abiertas < self.maxconn:
+                    # Reservamos el cupo antes de conectar fuera del lock
+                    self._abiertas += 1
+                    conn, devuelta = None, None
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        "No hay conexiones libres en el pool (max=%s)" % self.maxconn
+                    )
+                self._esperando += 1
+                try:
+                    self._cond.wait(restante)
+                finally:
+                    self._esperando -= 1
+
+        conn = self._preparar(conn, devuelta)
+
+        latencia = time.monotonic() - inicio
+        with self._cond:
+            self._en_uso += 1
+            self._checkouts += 1
+            self._latencia_total += latencia
+            if latencia > self._latencia_max:
+                self._latencia_max = latencia
+        return conn
+
+    def _preparar(self, conn, devuelta):
+        """Entrega una conexión sana: reutiliza la ociosa si responde, si no abre otra."""
+        if conn is not None and not self._sana(conn, devuelta):
+            self._cerrar(conn)
+            with self._cond:
+                self._descartadas += 1
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._abiertas -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def _sana(self, conn, devuelta):
+        if conn.closed:
+            return False
+        if self.check_idle > 0 and time.monotonic() - devuelta < self.check_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def putconn(self, conn, cerrar=False):
+        """Devuelve la conexión al pool dejando la transacción limpia."""
+        if not cerrar and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                cerrar = True
+        else:
+            cerrar = True
+
+        with self._cond:
+            self._en_uso -= 1
+            if cerrar or len(self._idle) >= self.maxconn:
+                self._abiertas -= 1
+                self._descartadas += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if cerrar:
+            self._cerrar(conn)
+
+    @staticmethod
+    def _cerrar(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._abiertas -= 1
+                self._cerrar(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "abiertas": self._abiertas,
+                "en_uso": self._en_uso,
+                "libres": len(self._idle),
+                "esperando": self._esperando,
+                "checkouts_total": self._checkouts,
+                "timeouts_total": self._timeouts,
+                "descartadas_total": self._descartadas,
+                "checkout_segundos_total": self._latencia_total,
+                "checkout_segundos_max": self._latencia_max,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=_int_env("PG_POOL_MIN", 1),
+                    maxconn=_int_env("PG_POOL_MAX", 10),
+                    timeout=_float_env("PG_POOL_TIMEOUT", 30.0),
+                    check_idle=_float_env("PG_POOL_CHECK", 30.0),
+                )
+    return _pool
+
+
+def pool_stats():
+    """Estadísticas del pool, o None si todavía no se ha creado."""
+    return _pool.stats() if _pool is not None else None
+
+
+class PooledConnection:
+    """
+    Envoltorio sobre la conexión prestada por el pool. Se comporta como una
+    conexión psycopg2 normal, pero `close()` la devuelve al pool en vez de
+    cerrar el socket. Dentro de un request de Flask `close()` no hace nada:
+    la conexión se comparte durante todo el request y se libera en el teardown.
+    """
+
+    def __init__(self, pool, conn, request_scoped=False):
+        self._pool = pool
+        self._conn = conn
+        self._request_scoped = request_scoped
+
+    def __getattr__(self, nombre):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise psycopg2.InterfaceError("La conexión ya fue devuelta al pool")
+        return getattr(conn, nombre)
+
+    def __setattr__(self, nombre, valor):
+        if nombre.startswith("_"):
+            object.__setattr__(self, nombre, valor)
+        else:
+            setattr(self._conn, nombre, valor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Igual que psycopg2: commit/rollback, sin cerrar
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        return False
+
+    @property
+    def closed(self):
+        conn = self.__dict__.get("_conn")
+        return 1 if conn is None else conn.closed
+
+    def close(self):
+        if not self._request_scoped:
+            self.release()
+
+    def release(self):
+        conn = self.__dict__.get("_conn")
+        if conn is not None:
+            self._conn = None
+            self._pool.putconn(conn)
+
+
+def get_connection():
+    """
+    Devuelve una conexión del pool. Dentro de un request de Flask siempre es
+    la misma conexión y se libera sola al terminar el request (aunque haya
+    excepciones). Fuera de un request (hilos de fondo, scripts) hay que
+    llamar a `close()` para devolverla.
+    """
+    pool = get_pool()
+    if has_app_context():
+        conn = g.get("_db_conn")
+        if conn is None or conn.closed:
+            if conn is not None:
+                # Se cortó (p. ej. el servidor cerró el socket): su cupo vuelve
+                # al pool antes de pedir otra
+                conn.release()
+            conn = PooledConnection(pool, pool.getconn(), request_scoped=True)
+            g._db_conn = conn
+        return conn
+    return PooledConnection(pool, pool.getconn())
+
+
+@contextmanager
+def independent_connection():
+    """
+    Conexión del pool aparte de la del request, con su propia transacción:
+    commit al salir del bloque, rollback si hubo excepción. Sirve para
+    operaciones autónomas (p. ej. cachés) que no deben mezclarse con la
+    transacción del handler.
+    """
+    conn = PooledConnection(get_pool(), get_pool().getconn())
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.release()
+
+
+def _release_request_connection(exc=None):
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        conn.release()
+
+
+def _iniciar_medicion():
+    g._medicion = instrumentacion.iniciar(request.endpoint or "sin_endpoint")
+
+
+def _terminar_medicion(exc=None):
+    iniciada = g.pop("_medicion", None)
+    if iniciada is not None:
+        instrumentacion.terminar(iniciada)
+
+
+def init_app(app):
+    """
+    Registra la devolución automática de la conexión al final de cada request
+    y la medición de las sentencias SQL de cada endpoint (/metrics).
+    """
+    app.before_request(_iniciar_medicion)
+    app.teardown_request(_terminar_medicion)
+    app.teardown_appcontext(_release_request_connection)
@@ -0,0 +1,544 @@
+"""
+Esquema de las tablas auxiliares de la app (cachés, tablas derivadas,
+índices), como migraciones numeradas.
+
+Cada migración se aplica una sola vez y queda registrada en la tabla
+esquema_version. Uso:
+    python esquema.py                         # aplica las migraciones pendientes
+    python esquema.py --estado                # lista cuáles están aplicadas
+    python esquema.py --verificar             # EXPLAIN de las consultas frecuentes
+    python esquema.py --reconstruir-mensual   # además recalcula asistencia_mensual
+
+--verificar sale con código 1 si falta alguna migración o si alguna consulta
+frecuente (marcaje, búsqueda por email/rut, sueldos, predicciones) recorre
+completa una tabla grande: sirve como chequeo después de desplegar.
+"""
+import os
+import re
+import sys
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from db import independent_connection
+
+DDL_IA = [
+    # Caché persistente de clasificaciones de Llama 3 (routes/asistencia.py).
+    # `version` cambia al cambiar el modelo o el prompt.
+    """
+    CREATE TABLE IF NOT EXISTS ia_clasificacion_cache (
+        clave      TEXT        NOT NULL,
+        version    TEXT        NOT NULL,
+        respuesta  TEXT        NOT NULL,
+        creado     TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (clave, version)
+    )
+    """,
+    # Palabras clave para clasificar sin llamar al modelo. Si la tabla está
+    # vacía se usan las de PALABRAS_CLAVE_DEFECTO.
+    """
+    CREATE TABLE IF NOT EXISTS ia_palabra_clave (
+        categoria  TEXT NOT NULL,
+        palabra    TEXT NOT NULL,
+        peso       REAL NOT NULL DEFAULT 1,
+        PRIMARY KEY (categoria, palabra)
+    )
+    """,
+]
+
+DDL_INDICES_FECHA = [
+    # Sueldos y reportes filtran asistencia por rango de fechas: con este
+    # índice el costo depende de las filas del período, no de toda la tabla.
+    # CONCURRENTLY para no bloquear los marcajes mientras se construyen.
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS asistencia_fecha_idx ON asistencia (fecha)",
+    # Marcaje (MiApiLogin/marcaje.py): última asistencia de un trabajador, en
+    # el mismo orden que usa la consulta para que baste leer la primera entrada.
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS asistencia_trabajador_fecha_idx
+        ON asistencia (trabajador_id, fecha DESC NULLS LAST, id DESC)
+    """,
+]
+
+# Recalcula los (trabajador, mes) indicados desde asistencia. Primero toma
+# un advisory lock por trabajador: si dos transacciones tocan el mismo mes,
+# la segunda espera y recalcula viendo lo que la primera ya confirmó.
+# {contador}: sentencias extra tras los locks (ver DDL_VERSION_MENSUAL).
+_SQL_MENSUAL_RECALCULAR = """
+    CREATE OR REPLACE FUNCTION asistencia_mensual_recalcular(p_trabajadores INT[], p_meses DATE[])
+    RETURNS VOID LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('asistencia_mensual'), t)
+        FROM (SELECT DISTINCT t FROM unnest(p_trabajadores) t WHERE t IS NOT NULL ORDER BY t) x;
+{contador}
+        WITH claves AS (
+            SELECT DISTINCT k.trabajador_id, k.mes
+            FROM unnest(p_trabajadores, p_meses) AS k(trabajador_id, mes)
+            WHERE k.trabajador_id IS NOT NULL AND k.mes IS NOT NULL
+        ),
+        calculado AS (
+            SELECT
+                k.trabajador_id,
+                k.mes,
+                COUNT(DISTINCT a.fecha) FILTER (WHERE a.is_asistencia) AS dias_asistidos,
+                COUNT(*) FILTER (WHERE a.is_asistencia = FALSE) AS ausencias,
+                COUNT(*) FILTER (WHERE a.is_asistencia = FALSE AND a.justificado) AS ausencias_justificadas,
+                COALESCE(SUM(EXTRACT(EPOCH FROM a.horas_trabajadas) / 3600.0), 0) AS horas_trabajadas,
+                COUNT(*) FILTER (WHERE a.hora_entrada > (
+                    SELECT MIN(tu.horario_inicio)
+                    FROM turno_trabajador tt
+                    JOIN turno tu ON tu.id = tt.turno_id
+                    WHERE tt.trabajador_id = k.trabajador_id
+                )) AS atrasos
+            FROM claves k
+            JOIN asistencia a ON a.trabajador_id = k.trabajador_id
+                             AND a.fecha >= k.mes
+                             AND a.fecha <  k.mes + INTERVAL '1 month'
+            GROUP BY k.trabajador_id, k.mes
+        ),
+        vacios AS (
+            DELETE FROM asistencia_mensual am
+            USING claves k
+            WHERE am.trabajador_id = k.trabajador_id AND am.mes = k.mes
+              AND NOT EXISTS (SELECT 1 FROM calculado c
+                              WHERE c.trabajador_id = k.trabajador_id AND c.mes = k.mes)
+        )
+        INSERT INTO asistencia_mensual (
+            trabajador_id, mes, dias_asistidos, ausencias, ausencias_justificadas,
+            horas_trabajadas, atrasos, actualizado
+        )
+        SELECT c.*, now() FROM calculado c
+        ON CONFLICT (trabajador_id, mes) DO UPDATE SET
+            dias_asistidos         = EXCLUDED.dias_asistidos,
+            ausencias              = EXCLUDED.ausencias,
+            ausencias_justificadas = EXCLUDED.ausencias_justificadas,
+            horas_trabajadas       = EXCLUDED.horas_trabajadas,
+            atrasos                = EXCLUDED.atrasos,
+            actualizado            = EXCLUDED.actualizado;
+    END
+    $$
+"""
+
+DDL_RESUMEN_MENSUAL = [
+    # Resumen mensual por trabajador (resumen_mensual.py). Lo mantienen los
+    # triggers de abajo; se reconstruye con `python esquema.py --reconstruir-mensual`.
+    """
+    CREATE TABLE IF NOT EXISTS asistencia_mensual (
+        trabajador_id          INT         NOT NULL,
+        mes                    DATE        NOT NULL,  -- primer día del mes
+        dias_asistidos         INT         NOT NULL DEFAULT 0,
+        ausencias              INT         NOT NULL DEFAULT 0,
+        ausencias_justificadas INT         NOT NULL DEFAULT 0,
+        horas_trabajadas       NUMERIC     NOT NULL DEFAULT 0,
+        atrasos                INT         NOT NULL DEFAULT 0,  -- entrada después del inicio de su turno
+        actualizado            TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (trabajador_id, mes)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS asistencia_mensual_mes_idx ON asistencia_mensual (mes)",
+    # MAX(actualizado) fue la marca de la caché de reportes hasta DDL_VERSION_MENSUAL
+    "CREATE INDEX IF NOT EXISTS asistencia_mensual_actualizado_idx ON asistencia_mensual (actualizado)",
+    _SQL_MENSUAL_RECALCULAR.format(contador=""),
+    # Triggers por sentencia con tablas de transición: un UPDATE masivo
+    # (p. ej. procesar pendientes) recalcula cada (trabajador, mes) una vez.
+    """
+    CREATE OR REPLACE FUNCTION asistencia_mensual_trigger()
+    RETURNS TRIGGER LANGUAGE plpgsql AS $$
+    DECLARE
+        v_trabajadores INT[];
+        v_meses DATE[];
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            SELECT array_agg(trabajador_id), array_agg(mes) INTO v_trabajadores, v_meses
+            FROM (SELECT DISTINCT trabajador_id, date_trunc('month', fecha)::date AS mes FROM nuevas) x;
+        ELSIF TG_OP = 'DELETE' THEN
+            SELECT array_agg(trabajador_id), array_agg(mes) INTO v_trabajadores, v_meses
+            FROM (SELECT DISTINCT trabajador_id, date_trunc('month', fecha)::date AS mes FROM viejas) x;
+        ELSE
+            SELECT array_agg(trabajador_id), array_agg(mes) INTO v_trabajadores, v_meses
+            FROM (SELECT trabajador_id, date_trunc('month', fecha)::date AS mes FROM nuevas
+                  UNION
+                  SELECT trabajador_id, date_trunc('month', fecha)::date AS mes FROM viejas) x;
+        END IF;
+        IF v_trabajadores IS NOT NULL THEN
+            PERFORM asistencia_mensual_recalcular(v_trabajadores, v_meses);
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    "DROP TRIGGER IF EXISTS asistencia_mensual_ins ON asistencia",
+    "DROP TRIGGER IF EXISTS asistencia_mensual_upd ON asistencia",
+    "DROP TRIGGER IF EXISTS asistencia_mensual_del ON asistencia",
+    """
+    CREATE TRIGGER asistencia_mensual_ins AFTER INSERT ON asistencia
+    REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION asistencia_mensual_trigger()
+    """,
+    """
+    CREATE TRIGGER asistencia_mensual_upd AFTER UPDATE ON asistencia
+    REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION asistencia_mensual_trigger()
+    """,
+    """
+    CREATE TRIGGER asistencia_mensual_del AFTER DELETE ON asistencia
+    REFERENCING OLD TABLE AS viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION asistencia_mensual_trigger()
+    """,
+]
+
+DDL_TXID_CAMBIO = [
+    # Marca de cambio por fila para /api/asistencia/listar?since= (MiApiLogin):
+    # el id de la transacción que escribió la fila. Se compara contra el xmin
+    # del snapshot de la lectura, así una transacción que empezó antes pero
+    # confirmó después no se salta (con una marca de tiempo sí podría).
+    "ALTER TABLE asistencia ADD COLUMN IF NOT EXISTS txid_cambio BIGINT NOT NULL DEFAULT txid_current()",
+    """
+    CREATE OR REPLACE FUNCTION asistencia_txid_cambio() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.txid_cambio := txid_current();
+        RETURN NEW;
+    END
+    $$
+    """,
+    "DROP TRIGGER IF EXISTS asistencia_txid_cambio ON asistencia",
+    """
+    CREATE TRIGGER asistencia_txid_cambio BEFORE UPDATE ON asistencia
+    FOR EACH ROW EXECUTE FUNCTION asistencia_txid_cambio()
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS asistencia_trabajador_txid_idx
+        ON asistencia (trabajador_id, txid_cambio, id)
+    """,
+]
+
+# Consultas frecuentes que no tenían índice: búsqueda del trabajador por email
+# o rut (cada llamada a MiApiLogin), el historial de inasistencias justificadas
+# que entrena las predicciones (routes/asistencia.py) y las pendientes de
+# clasificar. Los índices parciales solo guardan esas filas. Se crean con
+# CONCURRENTLY para no bloquear los marcajes mientras se construyen.
+DDL_INDICES_FRECUENTES = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS trabajador_email_idx ON trabajador (email)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS trabajador_rut_idx ON trabajador (rut)",
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS asistencia_justificadas_idx
+        ON asistencia (fecha)
+     WHERE is_asistencia = FALSE AND justificado = TRUE
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS asistencia_pendiente_ia_idx
+        ON asistencia (id)
+     WHERE procesado_ia = FALSE
+    """,
+]
+
+# Borrados por trabajador para /api/asistencia/listar (MiApiLogin): un borrado
+# no deja marca en txid_cambio, así que el cliente compara este contador con
+# el de su última respuesta. Solo se escribe al borrar (o al mover una fila a
+# otro trabajador), no en cada marcaje.
+DDL_BORRADOS = [
+    """
+    CREATE TABLE IF NOT EXISTS asistencia_borrados (
+        trabajador_id INT    PRIMARY KEY,
+        borrados      BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION asistencia_borrados_trigger()
+    RETURNS TRIGGER LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO asistencia_borrados AS b (trabajador_id, borrados)
+            SELECT trabajador_id, COUNT(*) FROM viejas
+             WHERE trabajador_id IS NOT NULL
+             GROUP BY trabajador_id
+             ORDER BY trabajador_id
+            ON CONFLICT (trabajador_id) DO UPDATE SET borrados = b.borrados + EXCLUDED.borrados;
+            RETURN NULL;
+        END IF;
+        -- UPDATE que cambia trabajador_id: para el anterior es un borrado
+        INSERT INTO asistencia_borrados AS b (trabajador_id, borrados)
+        VALUES (OLD.trabajador_id, 1)
+        ON CONFLICT (trabajador_id) DO UPDATE SET borrados = b.borrados + 1;
+        RETURN NULL;
+    END
+    $$
+    """,
+    "DROP TRIGGER IF EXISTS asistencia_borrados_del ON asistencia",
+    "DROP TRIGGER IF EXISTS asistencia_borrados_mov ON asistencia",
+    """
+    CREATE TRIGGER asistencia_borrados_del AFTER DELETE ON asistencia
+    REFERENCING OLD TABLE AS viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION asistencia_borrados_trigger()
+    """,
+    """
+    CREATE TRIGGER asistencia_borrados_mov AFTER UPDATE OF trabajador_id ON asistencia
+    FOR EACH ROW
+    WHEN (OLD.trabajador_id IS NOT NULL AND OLD.trabajador_id IS DISTINCT FROM NEW.trabajador_id)
+    EXECUTE FUNCTION asistencia_borrados_trigger()
+    """,
+]
+
+# Marca de cambios de asistencia_mensual para la caché de reportes
+# (resumen_mensual.marca()). MAX(actualizado) no veía los (trabajador, mes)
+# borrados ni las transacciones que confirman después de otra más nueva; este
+# contador por trabajador sube con cada recálculo y la marca es su suma, que
+# cambia con cada confirmación. Se escribe bajo el advisory lock del
+# trabajador que ya toma el recálculo, así que no agrega esperas.
+DDL_VERSION_MENSUAL = [
+    """
+    CREATE TABLE IF NOT EXISTS asistencia_mensual_version (
+        trabajador_id INT    PRIMARY KEY,
+        version       BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    _SQL_MENSUAL_RECALCULAR.format(contador="""
+        INSERT INTO asistencia_mensual_version AS v (trabajador_id, version)
+        SELECT DISTINCT t, 1 FROM unnest(p_trabajadores) t WHERE t IS NOT NULL ORDER BY t
+        ON CONFLICT (trabajador_id) DO UPDATE SET version = v.version + 1;
+"""),
+]
+
+Migracion = namedtuple("Migracion", "version descripcion sentencias concurrente")
+
+# Se aplican en orden y cada una una sola vez (tabla esquema_version). Nunca
+# se edita una migración ya publicada: los cambios van en una nueva al final.
+# Las 1 a 4 son el DDL que antes corría completo en cada `python esquema.py`;
+# como es idempotente, en una base que ya lo tenía solo se registran.
+MIGRACIONES = [
+    Migracion(1, "caché y palabras clave de la IA", DDL_IA, False),
+    Migracion(2, "índices de asistencia por fecha y por trabajador", DDL_INDICES_FECHA, True),
+    Migracion(3, "resumen mensual y sus triggers", DDL_RESUMEN_MENSUAL, False),
+    Migracion(4, "marca de cambio txid_cambio", DDL_TXID_CAMBIO, False),
+    Migracion(5, "índices de email, rut, inasistencias justificadas y pendientes IA",
+              DDL_INDICES_FRECUENTES, True),
+    Migracion(6, "contador de borrados por trabajador", DDL_BORRADOS, False),
+    Migracion(7, "versión de asistencia_mensual para la caché de reportes", DDL_VERSION_MENSUAL, False),
+]
+
+_SQL_VERSIONES = """
+    CREATE TABLE IF NOT EXISTS esquema_version (
+        version     INT         PRIMARY KEY,
+        descripcion TEXT        NOT NULL,
+        aplicada    TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+# Un solo `python esquema.py` a la vez (p. ej. dos despliegues simultáneos)
+_LOCK_MIGRACIONES = "hashtext('esquema_version')"
+
+
+def _versiones_aplicadas(cur):
+    cur.execute("SELECT to_regclass('esquema_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return {}
+    cur.execute("SELECT version, aplicada FROM esquema_version")
+    return dict(cur.fetchall())
+
+
+def _indices_invalidos(cur, sentencias):
+    """
+    Índices de estas sentencias que quedaron inválidos (un CREATE INDEX
+    CONCURRENTLY que falló a la mitad). IF NOT EXISTS los daría por creados.
+    """
+    nombres = [m.group(1) for s in sentencias
+               for m in [re.search(r"INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", s)] if m]
+    if not nombres:
+        return []
+    cur.execute("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+         WHERE NOT i.indisvalid AND c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+    """, (nombres,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def aplicar_migraciones():
+    """Aplica las migraciones pendientes. Devuelve las versiones aplicadas."""
+    aplicadas = []
+    with independent_connection() as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(f"SELECT pg_advisory_lock({_LOCK_MIGRACIONES})")
+        try:
+            cur.execute(_SQL_VERSIONES)
+            hechas = _versiones_aplicadas(cur)
+            for m in MIGRACIONES:
+                if m.version in hechas:
+                    continue
+                print(f"Aplicando migración {m.version}: {m.descripcion}...")
+                if m.concurrente:
+                    # CONCURRENTLY no puede ir dentro de una transacción: cada
+                    # sentencia va sola y la versión se registra al final
+                    for nombre in _indices_invalidos(cur, m.sentencias):
+                        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+                    for sentencia in m.sentencias:
+                        cur.execute(sentencia)
+                    cur.execute("INSERT INTO esquema_version (version, descripcion) VALUES (%s, %s)",
+                                (m.version, m.descripcion))
+                else:
+                    # Todo o nada: la migración y su registro en una transacción
+                    cur.execute("BEGIN")
+                    try:
+                        for sentencia in m.sentencias:
+                            cur.execute(sentencia)
+                        cur.execute("INSERT INTO esquema_version (version, descripcion) VALUES (%s, %s)",
+                                    (m.version, m.descripcion))
+                        cur.execute("COMMIT")
+                    except Exception:
+                        cur.execute("ROLLBACK")
+                        raise
+                aplicadas.append(m.version)
+        finally:
+            cur.execute(f"SELECT pg_advisory_unlock({_LOCK_MIGRACIONES})")
+            cur.close()
+    return aplicadas
+
+
+def estado():
+    """[(version, descripcion, aplicada o None)] de todas las migraciones."""
+    with independent_connection() as conn:
+        cur = conn.cursor()
+        hechas = _versiones_aplicadas(cur)
+        cur.close()
+    return [(m.version, m.descripcion, hechas.get(m.version)) for m in MIGRACIONES]
+
+
+# ==========================================
+# Verificación de planes
+# ==========================================
+# Cada consulta frecuente con las tablas que NO deben recorrerse completas.
+# Las que viven como constantes se importan; las que están escritas dentro de
+# una función se copian aquí (mantenerlas iguales).
+
+SQL_TRABAJADOR_EMAIL = "SELECT id FROM trabajador WHERE email=%(email)s LIMIT 1"   # MiApiLogin
+SQL_TRABAJADOR_RUT = "SELECT id FROM trabajador WHERE rut=%(rut)s LIMIT 1"         # MiApiLogin
+
+# routes/asistencia.py: cargar_historial_inasistencias()
+SQL_HISTORIAL_INASISTENCIAS = """
+    SELECT id, trabajador_id, fecha, categoria, duracion_dias,
+           EXTRACT(DOW FROM fecha) as dia_semana,
+           EXTRACT(MONTH FROM fecha) as mes
+    FROM asistencia
+    WHERE is_asistencia = FALSE AND justificado = TRUE
+    ORDER BY fecha ASC
+"""
+
+# routes/asistencia.py: procesar_pendientes()
+SQL_PENDIENTES_IA = """
+    SELECT id, mensaje, fecha
+    FROM asistencia
+    WHERE procesado_ia = FALSE
+      AND COALESCE(TRIM(mensaje), '') <> ''
+    ORDER BY id
+"""
+
+
+def consultas_frecuentes():
+    """
+    [(nombre, sql, tablas que no deben recorrerse completas, función que da
+    el plan o None para EXPLAIN directo)]. El marcaje corre como sentencia
+    preparada, así que se verifica su plan genérico.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "MiApiLogin"))
+    import marcaje
+    from routes.sueldos import SQL_SUELDOS
+
+    return [
+        ("marcaje de ingreso", marcaje.SQL_INGRESO, ["asistencia", "trabajador"], marcaje.plan_generico),
+        ("marcaje de salida", marcaje.SQL_SALIDA, ["asistencia", "trabajador"], marcaje.plan_generico),
+        ("trabajador por email", SQL_TRABAJADOR_EMAIL, ["trabajador"], None),
+        ("trabajador por rut", SQL_TRABAJADOR_RUT, ["trabajador"], None),
+        # rendimiento y turno_trabajador se leen completos a propósito
+        ("sueldos del mes", SQL_SUELDOS, ["asistencia"], None),
+        ("historial de inasistencias (predicciones)", SQL_HISTORIAL_INASISTENCIAS, ["asistencia"], None),
+        ("pendientes de clasificar (IA)", SQL_PENDIENTES_IA, ["asistencia"], None),
+    ]
+
+
+def _parametros(cur):
+    """Valores reales para los parámetros (un trabajador existente, el mes actual)."""
+    cur.execute("SELECT id, email, rut FROM trabajador WHERE email IS NOT NULL ORDER BY id LIMIT 1")
+    trabajador_id, email, rut = cur.fetchone() or (1, "verificar@ejemplo.cl", "1-9")
+    hoy = date.today()
+    desde = hoy.replace(day=1)
+    fin = (desde + timedelta(days=32)).replace(day=1)
+    return {
+        # El marcaje se verifica por email, el camino de la app móvil
+        "trabajador_id": None, "email": email, "rut": rut,
+        "fecha": hoy, "hora": datetime.now().time().replace(microsecond=0),
+        "desde": desde, "fin": fin,
+    }
+
+
+def _seq_scans(plan):
+    """Tablas con Seq Scan en un plan de EXPLAIN (FORMAT JSON)."""
+    tablas = [plan["Relation Name"]] if plan.get("Node Type") == "Seq Scan" else []
+    for hijo in plan.get("Plans", []):
+        tablas.extend(_seq_scans(hijo))
+    return tablas
+
+
+def verificar(min_filas=10000):
+    """
+    EXPLAIN de cada consulta frecuente. Falla (devuelve False) si alguna hace
+    Seq Scan sobre una de sus tablas vigiladas con al menos `min_filas` filas
+    estimadas; en tablas chicas el Seq Scan es lo que corresponde.
+    """
+    ok = True
+    with independent_connection() as conn:
+        cur = conn.cursor()
+        params = _parametros(cur)
+        pendientes = [m for m in estado() if m[2] is None]
+        if pendientes:
+            ok = False
+            print("Migraciones pendientes: " + ", ".join(str(m[0]) for m in pendientes))
+        for nombre in _indices_invalidos(cur, [s for m in MIGRACIONES for s in m.sentencias]):
+            ok = False
+            print(f"Índice inválido: {nombre} (volver a correr `python esquema.py`)")
+
+        for nombre, sql, vigiladas, explicar in consultas_frecuentes():
+            if explicar:
+                plan = explicar(cur, sql, params)
+            else:
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cur.fetchone()[0][0]["Plan"]
+            cur.execute("SELECT relname, reltuples FROM pg_class WHERE relname = ANY(%s) AND relkind = 'r'",
+                        (vigiladas,))
+            filas = dict(cur.fetchall())
+            grandes = sorted({t for t in _seq_scans(plan) if t in vigiladas and filas.get(t, 0) >= min_filas})
+            if grandes:
+                ok = False
+                print(f"FALLA  {nombre}: Seq Scan sobre {', '.join(grandes)}")
+            else:
+                print(f"ok     {nombre} (costo {plan['Total Cost']:.0f})")
+        # Solo lectura: EXPLAIN sin ANALYZE no ejecuta los UPDATE/INSERT
+        conn.rollback()
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    import resumen_mensual
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--estado", action="store_true", help="listar las migraciones y cuáles están aplicadas")
+    parser.add_argument("--verificar", action="store_true",
+                        help="EXPLAIN de las consultas frecuentes; sale con error si alguna recorre una tabla grande")
+    parser.add_argument("--min-filas", type=int, default=10000,
+                        help="desde cuántas filas una tabla cuenta como grande para --verificar")
+    parser.add_argument("--reconstruir-mensual", action="store_true",
+                        help="recalcular asistencia_mensual completa desde asistencia")
+    args = parser.parse_args()
+
+    if args.estado:
+        for version, descripcion, aplicada in estado():
+            print(f"{version:>3}  {aplicada.strftime('%Y-%m-%d %H:%M') if aplicada else 'pendiente':<16}  {descripcion}")
+        sys.exit(0)
+    if args.verificar:
+        sys.exit(0 if verificar(args.min_filas) else 1)
+
+    aplicadas = aplicar_migraciones()
+    print(f"Esquema al día (versión {MIGRACIONES[-1].version}"
+          + (f", aplicadas ahora: {', '.join(map(str, aplicadas))})." if aplicadas else ")."))
+    # Recién creada la tabla está vacía: se llena una vez con todo el historial
+    if args.reconstruir_mensual or resumen_mensual.vacio():
+        print(f"asistencia_mensual reconstruida ({resumen_mensual.reconstruir()} filas).")
@@ -0,0 +1,321 @@
+"""
+Instrumentación de SQL: duración, filas y ruta de cada sentencia.
+
+Las conexiones se abren con `connection_factory=ConexionMedida`, así todo
+cursor que se cree (también con cursor_factory=DictCursor, cursores con
+nombre o los que abre pandas) mide cada execute/executemany. Cada sentencia
+se atribuye a la "ruta" en curso: el endpoint de Flask, la Azure Function o
+el trabajo de fondo que la ejecutó (`medir(ruta)`); fuera de eso, "sin_ruta".
+
+Por ruta se acumulan histogramas de latencia, de consultas por request y de
+cuántas veces se repitió la misma sentencia en un request (un N+1 aparece
+como muchas repeticiones), que `prometheus()` devuelve en formato de texto.
+
+Variables de entorno:
+  SQL_LENTA_MS        sentencias que tardan más se registran en el log "sql"
+                      con los parámetros ocultos (default 500, 0 = ninguna)
+  SQL_REPETIDA_AVISO  se avisa si un request repite la misma sentencia más
+                      veces (default 20, 0 = nunca)
+
+MiApiLogin usa este mismo módulo: se despliega sola, así que
+`python vendorizar.py` lo copia a su carpeta antes de levantarla o
+desplegarla. Se edita solo este archivo.
+"""
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+
+def _float_env(nombre, default):
+    try:
+        return float(os.getenv(nombre, default))
+    except (TypeError, ValueError):
+        return default
+
+
+SQL_LENTA_MS = _float_env("SQL_LENTA_MS", 500.0)
+SQL_REPETIDA_AVISO = int(_float_env("SQL_REPETIDA_AVISO", 20))
+# Largo máximo del SQL en el log
+SQL_LOG_MAX = 1000
+
+# Límites de los histogramas
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+log = logging.getLogger("sql")
+
+_SIN_RUTA = "sin_ruta"
+
+
+class _Medicion:
+    """Lo que se va sumando durante un request (o trabajo)."""
+    __slots__ = ("ruta", "inicio", "consultas", "segundos_sql", "repeticiones")
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.segundos_sql = 0.0
+        self.repeticiones = {}   # texto SQL -> veces
+
+
+_actual = contextvars.ContextVar("instrumentacion_medicion", default=None)
+
+
+# ==========================================
+# Redacción
+# ==========================================
+
+def _oculto(valor):
+    if valor is None or isinstance(valor, bool):
+        return valor
+    if isinstance(valor, (list, tuple)):
+        return "<%s:%d>" % (type(valor).__name__, len(valor))
+    return "<%s>" % type(valor).__name__
+
+
+def redactar(params):
+    """Parámetros con cada valor reemplazado por su tipo (p. ej. '<str>')."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _oculto(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [_oculto(v) for v in params]
+    return _oculto(params)
+
+
+def _texto(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        # psycopg2.sql.Composed y similares
+        query = repr(query)
+    texto = " ".join(query.split())
+    return texto if len(texto) <= SQL_LOG_MAX else texto[:SQL_LOG_MAX] + "..."
+
+
+# ==========================================
+# Acumuladores
+# ==========================================
+
+class _Histograma:
+    __slots__ = ("limites", "cuentas", "suma", "total")
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.cuentas = [0] * len(limites)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.suma += valor
+        self.total += 1
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.cuentas[i] += 1
+
+    def lineas(self, nombre, etiquetas):
+        for limite, cuenta in zip(self.limites, self.cuentas):
+            yield '%s_bucket{%s,le="%s"} %d' % (nombre, etiquetas, limite, cuenta)
+        yield '%s_bucket{%s,le="+Inf"} %d' % (nombre, etiquetas, self.total)
+        yield "%s_sum{%s} %.6f" % (nombre, etiquetas, self.suma)
+        yield "%s_count{%s} %d" % (nombre, etiquetas, self.total)
+
+
+class _Ruta:
+    __slots__ = ("duracion", "consultas_request", "repetida_max", "sql_duracion",
+                 "filas", "lentas", "errores")
+
+    def __init__(self):
+        self.duracion = _Histograma(BUCKETS_SEGUNDOS)
+        self.consultas_request = _Histograma(BUCKETS_CONSULTAS)
+        self.repetida_max = _Histograma(BUCKETS_CONSULTAS)
+        self.sql_duracion = _Histograma(BUCKETS_SEGUNDOS)
+        self.filas = 0
+        self.lentas = 0
+        self.errores = 0
+
+
+_lock = threading.Lock()
+_rutas = {}   # ruta -> _Ruta
+
+
+def _ruta(nombre):
+    ruta = _rutas.get(nombre)
+    if ruta is None:
+        ruta = _rutas[nombre] = _Ruta()
+    return ruta
+
+
+def registrar_sentencia(query, params, segundos, filas, error=False, lote=None):
+    """Lo llama el cursor tras cada sentencia; `lote` = filas de un executemany."""
+    medicion = _actual.get()
+    nombre = medicion.ruta if medicion is not None else _SIN_RUTA
+    lenta = SQL_LENTA_MS > 0 and segundos * 1000.0 >= SQL_LENTA_MS
+    with _lock:
+        # Bajo el lock: un trabajo puede repartir su medición entre varios
+        # hilos (contextvars.copy_context().run)
+        if medicion is not None:
+            medicion.consultas += 1
+            medicion.segundos_sql += segundos
+            texto = query if isinstance(query, (str, bytes)) else repr(query)
+            medicion.repeticiones[texto] = medicion.repeticiones.get(texto, 0) + 1
+        ruta = _ruta(nombre)
+        ruta.sql_duracion.observar(segundos)
+        if filas is not None and filas > 0:
+            ruta.filas += filas
+        if lenta:
+            ruta.lentas += 1
+        if error:
+            ruta.errores += 1
+    if lenta:
+        log.warning("SQL lenta: %.0f ms en %s (filas=%s%s): %s params=%s",
+                    segundos * 1000.0, nombre, filas, ", con error" if error else "",
+                    _texto(query), "<%d filas>" % lote if lote is not None else redactar(params))
+
+
+def iniciar(ruta):
+    """Empieza a medir `ruta` en el contexto actual. Devuelve lo que recibe terminar()."""
+    medicion = _Medicion(ruta)
+    return medicion, _actual.set(medicion)
+
+
+def terminar(iniciada):
+    """Cierra la medición abierta con iniciar() y la suma a su ruta."""
+    medicion, token = iniciada
+    try:
+        _actual.reset(token)
+    except ValueError:
+        # El teardown corrió en otro contexto que el before_request
+        _actual.set(None)
+    segundos = time.perf_counter() - medicion.inicio
+    with _lock:
+        texto, veces = max(medicion.repeticiones.items(), key=lambda x: x[1], default=("", 0))
+        ruta = _ruta(medicion.ruta)
+        ruta.duracion.observar(segundos)
+        ruta.consultas_request.observar(medicion.consultas)
+        ruta.repetida_max.observar(veces)
+    if SQL_REPETIDA_AVISO > 0 and veces > SQL_REPETIDA_AVISO:
+        log.warning("Posible N+1 en %s: la misma sentencia %d veces en un request (%d en total, "
+                    "%.0f ms de SQL): %s", medicion.ruta, veces, medicion.consultas,
+                    medicion.segundos_sql * 1000.0, _texto(texto))
+
+
+@contextmanager
+def medir(ruta):
+    """Mide el bloque como un request de `ruta` (trabajos de fondo, scripts)."""
+    iniciada = iniciar(ruta)
+    try:
+        yield
+    finally:
+        terminar(iniciada)
+
+
+def medido(funcion):
+    """Decorador: mide cada llamada a `funcion` como un request con su nombre."""
+    @functools.wraps(funcion)
+    def envoltorio(*args, **kwargs):
+        with medir(funcion.__name__):
+            return funcion(*args, **kwargs)
+    return envoltorio
+
+
+# ==========================================
+# Cursores y conexión
+# ==========================================
+
+class _CursorMedido:
+    """Mixin que mide execute/executemany del cursor al que se agrega."""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        error = True
+        try:
+            resultado = super().execute(query, vars)
+            error = False
+            return resultado
+        finally:
+            registrar_sentencia(query, vars, time.perf_counter() - inicio,
+                                None if error else self.rowcount, error)
+
+    def executemany(self, query, vars_list):
+        if not isinstance(vars_list, (list, tuple)):
+            vars_list = list(vars_list)
+        inicio = time.perf_counter()
+        error = True
+        try:
+            resultado = super().executemany(query, vars_list)
+            error = False
+            return resultado
+        finally:
+            registrar_sentencia(query, None, time.perf_counter() - inicio,
+                                None if error else self.rowcount, error, lote=len(vars_list))
+
+
+_clases = {}
+
+
+def _clase_medida(factory):
+    if issubclass(factory, _CursorMedido):
+        return factory
+    clase = _clases.get(factory)
+    if clase is None:
+        clase = _clases[factory] = type(factory.__name__ + "Medido", (_CursorMedido, factory), {})
+    return clase
+
+
+class ConexionMedida(psycopg2.extensions.connection):
+    """Conexión cuyos cursores, de cualquier clase, miden cada sentencia."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _clase_medida(factory)
+        return super().cursor(*args, **kwargs)
+
+
+# ==========================================
+# Exposición
+# ==========================================
+
+def _etiqueta(valor):
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus():
+    """Líneas en formato de texto de Prometheus con las métricas por ruta."""
+    with _lock:
+        rutas = sorted(_rutas.items())
+        metricas = [
+            ("ruta_duracion_segundos", "histogram", "Duración de cada request o trabajo",
+             lambda r: r.duracion),
+            ("ruta_consultas_sql", "histogram", "Sentencias SQL por request",
+             lambda r: r.consultas_request),
+            ("ruta_sql_repetida_max", "histogram",
+             "Máximo de veces que se repitió una misma sentencia en un request (N+1)",
+             lambda r: r.repetida_max),
+            ("sql_duracion_segundos", "histogram", "Duración de cada sentencia SQL",
+             lambda r: r.sql_duracion),
+            ("sql_filas_total", "counter", "Filas devueltas o afectadas", lambda r: r.filas),
+            ("sql_lentas_total", "counter", "Sentencias sobre SQL_LENTA_MS", lambda r: r.lentas),
+            ("sql_errores_total", "counter", "Sentencias que fallaron", lambda r: r.errores),
+        ]
+        lineas = []
+        for nombre, tipo, ayuda, valor in metricas:
+            lineas.append("# HELP %s %s" % (nombre, ayuda))
+            lineas.append("# TYPE %s %s" % (nombre, tipo))
+            for ruta_nombre, ruta in rutas:
+                etiquetas = 'ruta="%s"' % _etiqueta(ruta_nombre)
+                if tipo == "histogram":
+                    histograma = valor(ruta)
+                    if histograma.total:
+                        lineas.extend(histograma.lineas(nombre, etiquetas))
+                else:
+                    lineas.append("%s{%s} %d" % (nombre, etiquetas, valor(ruta)))
+    return lineas
@@ -0,0 +1,133 @@
+import itertools
+import threading
+import time
+import traceback
+
+import instrumentacion
+
+# ==========================================
+# Trabajos en segundo plano
+# ==========================================
+# Registro en memoria de tareas largas (procesar justificaciones, recalcular
+# sueldos...) que no deben bloquear el request. Cada trabajo corre en su
+# propio hilo y publica su avance para que la página lo consulte.
+# El nombre puede llevar un alcance después de ":" (p. ej.
+# "recalcular_sueldos:3:todas"): trabajos con distinto alcance corren en
+# paralelo y se consultan por separado.
+
+_MAX_HISTORIAL = 20
+
+_ids = itertools.count(1)
+_lock = threading.Lock()
+_trabajos = {}  # id -> Trabajo
+
+
+class Trabajo:
+    def __init__(self, nombre):
+        self.id = next(_ids)
+        self.nombre = nombre
+        self.estado = "en_cola"   # en_cola | ejecutando | terminado | error
+        self.total = 0
+        self.procesados = 0
+        self.cambiados = 0
+        self.errores = 0
+        self.mensaje = ""
+        self.inicio = None
+        self.fin = None
+        self._lock = threading.Lock()
+
+    def avanzar(self, procesados=1, cambiados=0, errores=0):
+        with self._lock:
+            self.procesados += procesados
+            self.cambiados += cambiados
+            self.errores += errores
+
+    @property
+    def activo(self):
+        return self.estado in ("en_cola", "ejecutando")
+
+    def como_dict(self):
+        with self._lock:
+            porcentaje = round(100.0 * self.procesados / self.total, 1) if self.total else (100.0 if not self.activo else 0.0)
+            return {
+                "id": self.id,
+                "nombre": self.nombre,
+                "estado": self.estado,
+                "total": self.total,
+                "procesados": self.procesados,
+                "cambiados": self.cambiados,
+                "errores": self.errores,
+                "porcentaje": porcentaje,
+                "mensaje": self.mensaje,
+                "inicio": self.inicio,
+                "fin": self.fin,
+            }
+
+
+def _ejecutar(trabajo, funcion, args, kwargs):
+    trabajo.estado = "ejecutando"
+    trabajo.inicio = time.time()
+    try:
+        # Sus sentencias SQL van a /metrics como ruta "trabajo:<nombre>"
+        # (sin el alcance, para no abrir una serie por empresa o sucursal)
+        with instrumentacion.medir(f"trabajo:{trabajo.nombre.split(':', 1)[0]}"):
+            funcion(trabajo, *args, **kwargs)
+        trabajo.estado = "terminado"
+    except Exception as e:
+        traceback.print_exc()
+        trabajo.estado = "error"
+        trabajo.mensaje = str(e)
+    finally:
+        trabajo.fin = time.time()
+
+
+def lanzar(nombre, funcion, *args, **kwargs):
+    """
+    Ejecuta `funcion(trabajo, *args, **kwargs)` en un hilo de fondo.
+    Si ya hay un trabajo activo con el mismo nombre se devuelve ese en vez de
+    lanzar otro (evita que dos clics procesen lo mismo dos veces).
+    Devuelve (trabajo, nuevo).
+    """
+    with _lock:
+        actual = _ultimo(nombre)
+        if actual is not None and actual.activo:
+            return actual, False
+
+        trabajo = Trabajo(nombre)
+        _trabajos[trabajo.id] = trabajo
+        # Olvidamos los trabajos terminados más antiguos
+        terminados = [t for t in _trabajos.values() if not t.activo]
+        for t in terminados[:max(0, len(_trabajos) - _MAX_HISTORIAL)]:
+            del _trabajos[t.id]
+
+    hilo = threading.Thread(
+        target=_ejecutar, args=(trabajo, funcion, args, kwargs),
+        name=f"trabajo-{nombre}-{trabajo.id}", daemon=True,
+    )
+    hilo.start()
+    return trabajo, True
+
+
+def obtener(trabajo_id):
+    return _trabajos.get(trabajo_id)
+
+
+def _ultimo(nombre):
+    candidatos = [t for t in _trabajos.values() if t.nombre == nombre]
+    return candidatos[-1] if candidatos else None
+
+
+def ultimo(nombre):
+    """Último trabajo lanzado con ese nombre (activo o no), o None."""
+    with _lock:
+        return _ultimo(nombre)
+
+
+def ultimos(base):
+    """Último trabajo de cada alcance de `base` (nombres "base:..."), por nombre."""
+    with _lock:
+        por_nombre = {}
+        for t in _trabajos.values():
+            if t.nombre == base or t.nombre.startswith(base + ":"):
+                por_nombre[t.nombre] = t
+        return [por_nombre[n] for n in sorted(por_nombre)]
@@ -0,0 +1,39 @@
+import importlib
+import os
+import threading
+import time
+
+# Dependencias pesadas que los blueprints importan recién al usarse
+# (routes.asistencia: IA y predicciones; routes.reportes: gráficos).
+DEPENDENCIAS_PESADAS = [
+    "pandas",
+    "numpy",
+    "sklearn.ensemble",
+    "sklearn.preprocessing",
+    "plotly.express",
+    "gpt4all",
+]
+
+
+def precargar_dependencias():
+    """Importa las dependencias pesadas para que el primer request no pague ese costo."""
+    for nombre in DEPENDENCIAS_PESADAS:
+        inicio = time.perf_counter()
+        try:
+            importlib.import_module(nombre)
+        except Exception as e:
+            print(f"Precarga: no se pudo importar {nombre}: {e}")
+            continue
+        print(f"Precarga: {nombre} en {time.perf_counter() - inicio:.2f}s")
+
+
+def iniciar_precarga():
+    """
+    Lanza la precarga en un hilo de fondo si PRECARGAR_DEPENDENCIAS=1.
+    El servidor atiende requests (p. ej. el login) mientras tanto.
+    """
+    if os.getenv("PRECARGAR_DEPENDENCIAS", "0") != "1":
+        return None
+    hilo = threading.Thread(target=precargar_dependencias, name="precarga", daemon=True)
+    hilo.start()
+    return hilo
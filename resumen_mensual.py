@@ -0,0 +1,133 @@
+"""
+Resumen mensual de asistencia (tabla asistencia_mensual).
+
+Una fila por trabajador y mes con los contadores que usan los reportes y
+sueldos: días asistidos, ausencias, ausencias justificadas, horas trabajadas
+y atrasos. La tabla y los triggers que la mantienen al día se crean con
+`python esquema.py` (ver DDL_RESUMEN_MENSUAL en esquema.py): cada INSERT,
+UPDATE o DELETE sobre asistencia recalcula solo los (trabajador, mes)
+afectados, venga de la app, del marcaje (MiApiLogin) o de un script.
+
+Para reconstruirla completa (reparación):
+    python esquema.py --reconstruir-mensual
+
+USAR_RESUMEN_MENSUAL=0 hace que las consultas vuelvan a agregar asistencia.
+"""
+import os
+import psycopg2.errors
+
+from db import independent_connection
+
+USAR_RESUMEN_MENSUAL = os.getenv("USAR_RESUMEN_MENSUAL", "1") == "1"
+
+_disponible = True
+
+# Mismo cálculo que asistencia_mensual_recalcular() en esquema.py, para todo
+# el historial de una vez.
+SQL_RECONSTRUIR = """
+    INSERT INTO asistencia_mensual (
+        trabajador_id, mes, dias_asistidos, ausencias, ausencias_justificadas,
+        horas_trabajadas, atrasos, actualizado
+    )
+    SELECT
+        a.trabajador_id,
+        date_trunc('month', a.fecha)::date,
+        COUNT(DISTINCT a.fecha) FILTER (WHERE a.is_asistencia),
+        COUNT(*) FILTER (WHERE a.is_asistencia = FALSE),
+        COUNT(*) FILTER (WHERE a.is_asistencia = FALSE AND a.justificado),
+        COALESCE(SUM(EXTRACT(EPOCH FROM a.horas_trabajadas) / 3600.0), 0),
+        COUNT(*) FILTER (WHERE a.hora_entrada > it.inicio),
+        now()
+    FROM asistencia a
+    LEFT JOIN (
+        SELECT tt.trabajador_id, MIN(tu.horario_inicio) AS inicio
+        FROM turno_trabajador tt
+        JOIN turno tu ON tu.id = tt.turno_id
+        GROUP BY tt.trabajador_id
+    ) it ON it.trabajador_id = a.trabajador_id
+    WHERE a.trabajador_id IS NOT NULL AND a.fecha IS NOT NULL
+    GROUP BY a.trabajador_id, date_trunc('month', a.fecha)
+"""
+
+
+def activo():
+    """True si las consultas deben leer de asistencia_mensual."""
+    return USAR_RESUMEN_MENSUAL and _disponible
+
+
+def desactivar():
+    """La tabla no existe: se vuelve a agregar asistencia hasta reiniciar."""
+    global _disponible
+    _disponible = False
+    print("ADVERTENCIA: no existe asistencia_mensual (ejecuta `python esquema.py`). "
+          "Los reportes se calcularán desde asistencia.")
+
+
+def ejecutar(cur, sql_resumen, sql_asistencia, params):
+    """
+    Ejecuta `sql_resumen` si el resumen está activo y `sql_asistencia` si no
+    (o si la tabla todavía no existe).
+    """
+    if activo():
+        try:
+            cur.execute(sql_resumen, params)
+            return
+        except psycopg2.errors.UndefinedTable:
+            cur.connection.rollback()
+            desactivar()
+    cur.execute(sql_asistencia, params)
+
+
+def marca(cur):
+    """
+    Marca de cambios de asistencia_mensual: (trabajadores, suma de sus
+    versiones) de asistencia_mensual_version, que sube con cada recálculo
+    confirmado, también los del marcaje, los borrados y las transacciones que
+    confirman tarde. None si el resumen no está activo.
+    """
+    if not activo():
+        return None
+    try:
+        cur.execute("SELECT COUNT(*), COALESCE(SUM(version), 0)::bigint FROM asistencia_mensual_version")
+        return tuple(cur.fetchone())
+    except psycopg2.errors.UndefinedTable:
+        # Falta la migración 7: la marca de antes, mejor que ninguna
+        cur.connection.rollback()
+    try:
+        cur.execute("SELECT MAX(actualizado) FROM asistencia_mensual")
+        return cur.fetchone()[0]
+    except psycopg2.errors.UndefinedTable:
+        cur.connection.rollback()
+        desactivar()
+        return None
+
+
+def reconstruir():
+    """
+    Vuelve a calcular asistencia_mensual desde cero. Bloquea las escrituras
+    sobre asistencia mientras dura, así ningún trigger corre a la vez.
+    Devuelve la cantidad de filas generadas.
+    """
+    with independent_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("LOCK TABLE asistencia IN SHARE MODE")
+        cur.execute("DELETE FROM asistencia_mensual")
+        cur.execute(SQL_RECONSTRUIR)
+        filas = cur.rowcount
+        # La caché de reportes tiene que ver el cambio (resumen_mensual.marca())
+        cur.execute("""
+            INSERT INTO asistencia_mensual_version AS v (trabajador_id, version)
+            SELECT DISTINCT trabajador_id, 1 FROM asistencia_mensual ORDER BY trabajador_id
+            ON CONFLICT (trabajador_id) DO UPDATE SET version = v.version + 1
+        """)
+        cur.close()
+    return filas
+
+
+def vacio():
+    with independent_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT NOT EXISTS (SELECT 1 FROM asistencia_mensual)")
+        resultado = cur.fetchone()[0]
+        cur.close()
+    return resultado
@@ -1,18 +1,25 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, send_file
-from db import get_connection
-from gpt4all import GPT4All
-from datetime import datetime, date, timedelta
+from flask import Blueprint, Response, request, render_template, redirect, url_for, flash, jsonify, has_request_context
+from db import get_connection, independent_connection
+import jobs
+from routes.reportes import cache_reportes
+from datetime import datetime, date, timedelta, time as dt_time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 import threading
+import hashlib
+import json
 import re
+import time
+import unicodedata
+import psycopg2
+import psycopg2.errors
 from psycopg2.extras import DictCursor
-import pandas as pd
-import io
-import numpy as np
 import os
+import tempfile
 
-# LIBRERIAS DE MACHINE LEARNING 
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
+# gpt4all, pandas, numpy y sklearn se importan dentro de las funciones que los
+# usan: cargarlos al importar el blueprint retrasaba el arranque de toda la app
+# (incluido el login). Ver precarga.py para calentarlos en segundo plano.
 
 asistencia_bp = Blueprint("asistencia", __name__)
 
@@ -22,13 +29,28 @@ asistencia_bp = Blueprint("asistencia", __name__)
 _model = None
 _model_lock = threading.Lock()
 
+#Usamos Llama 3 8B. Es el mejor modelo balanceado hoy en día.
+MODELO_NOMBRE = "Meta-Llama-3-8B-Instruct.Q4_0.gguf"
+
+# Prompt optimizado para Llama 3
+# Llama 3 es muy inteligente, le damos instrucciones directas.
+PROMPT_CLASIFICACION = """<|start_header_id|>system<|end_header_id|>
+Tu tarea es clasificar la justificación de una inasistencia laboral.
+Analiza el texto del usuario y extrae SOLO la categoría principal.
+Las categorías posibles son: Salud, Accidente, Trámite Personal, Familiar, Otro.
+Responde con una sola palabra o frase muy corta.
+<|eot_id|><|start_header_id|>user<|end_header_id|>
+Texto del trabajador: "{mensaje}"
+Categoría:<|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
+
 def get_model():
     global _model
     if _model is None:
         with _model_lock:
             if _model is None:
-                #Usamos Llama 3 8B. Es el mejor modelo balanceado hoy en día.
-                modelo_nombre = "Meta-Llama-3-8B-Instruct.Q4_0.gguf"
+                from gpt4all import GPT4All
+
+                modelo_nombre = MODELO_NOMBRE
                 model_path = "routes" 
 
                 full_path = os.path.join(model_path, modelo_nombre)
@@ -57,34 +79,39 @@ def get_model():
 
     return _model
 
+def _generar_resumen(mensaje: str) -> str:
+    """Llama al modelo (sin caché). Lanza la excepción si el modelo falla."""
+    model = get_model()
+    prompt = PROMPT_CLASIFICACION.format(mensaje=mensaje)
+
+    with _model_lock:
+        with model.chat_session():
+            # temp=0.1 para máxima precisión
+            out = model.generate(prompt, max_tokens=15, temp=0.1)
+
+    limpio = (out or "").strip()
+
+    # Limpieza básica
+    limpio = limpio.replace("Categoría:", "").replace(".", "").strip()
+
+    return limpio
+
 def resumir_mensaje(mensaje: str) -> str:
     """
     Usa Llama 3 para extraer el motivo principal.
+    Consulta antes la caché de clasificaciones (memoria y tabla).
     """
+    clave = normalizar_mensaje(mensaje)
+    cacheado = cache_clasificacion.obtener(clave)
+    if cacheado is not None:
+        return cacheado
+
     try:
-        model = get_model()
-        
-        # Prompt optimizado para Llama 3
-        # Llama 3 es muy inteligente, le damos instrucciones directas.
-        prompt = f"""<|start_header_id|>system<|end_header_id|>
-Tu tarea es clasificar la justificación de una inasistencia laboral.
-Analiza el texto del usuario y extrae SOLO la categoría principal.
-Las categorías posibles son: Salud, Accidente, Trámite Personal, Familiar, Otro.
-Responde con una sola palabra o frase muy corta.
-<|eot_id|><|start_header_id|>user<|end_header_id|>
-Texto del trabajador: "{mensaje}"
-Categoría:<|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
-        
-        with _model_lock:
-            with model.chat_session():
-                # temp=0.1 para máxima precisión
-                out = model.generate(prompt, max_tokens=15, temp=0.1)
-        
-        limpio = (out or "").strip()
-        
-        # Limpieza básica
-        limpio = limpio.replace("Categoría:", "").replace(".", "").strip()
-        
+        # Solo aquí se llega al modelo: lo resuelto por la caché no cuenta
+        clasificador_palabras.contar(atajo=False)
+        inicio = time.perf_counter()
+        limpio = _generar_resumen(mensaje)
+        cache_clasificacion.guardar(clave, limpio, time.perf_counter() - inicio)
         return limpio
         
     except Exception as e:
@@ -95,15 +122,329 @@ def detectar_categoria(texto_ia: str) -> str:
     """
     Mapea la respuesta de la IA a las categorías de tu base de datos.
     """
-    m = (texto_ia or "").lower()
-    
-    # Mapa de palabras clave
-    if any(x in m for x in ['accidente', 'choque', 'vehicular', 'siniestro']): return 'accidente'
-    if any(x in m for x in ['salud', 'médico', 'medico', 'enfermedad', 'doctor', 'hospital', 'fiebre', 'gripe', 'licencia', 'medica', 'médica']): return 'medico'
-    if any(x in m for x in ['familiar', 'hijo', 'funeral', 'mamá', 'papá', 'hermano', 'madre', 'padre', 'abuelo', 'abuela']): return 'asunto familiar'
-    if any(x in m for x in ['personal', 'trámite', 'tramite', 'banco', 'notaría', 'viaje', 'mudanza']): return 'asunto personal'
-    
-    return 'otros'
+    return clasificador_palabras.clasificar(texto_ia).categoria
+
+# ==========================================
+# 1b. CACHÉ DE CLASIFICACIONES
+# ==========================================
+# Los trabajadores repiten mucho los mismos mensajes ("licencia médica",
+# "hijo enfermo"...). Antes de llamar al modelo se busca el mensaje
+# normalizado en un LRU en memoria y luego en la tabla ia_clasificacion_cache
+# (compartida entre procesos y persistente; ver esquema.py). Las entradas se
+# guardan con una versión derivada del modelo y el prompt, así que cambiar
+# cualquiera de los dos invalida la caché.
+
+def normalizar_mensaje(mensaje: str) -> str:
+    """Minúsculas, sin tildes, sin números ni puntuación y espacios colapsados."""
+    texto = unicodedata.normalize("NFKD", (mensaje or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"\d+", "0", texto)
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+@contextmanager
+def cursor_auxiliar():
+    """
+    Cursor para las tablas auxiliares de la IA (caché y palabras clave). En
+    un request usa la conexión del request en vez de pedir otra al pool: sin
+    transacción abierta hace commit al salir (no queda abierta mientras corre
+    el modelo), y dentro de una trabaja en un savepoint para que un error no
+    la aborte. En los trabajos de fondo, una conexión propia.
+    """
+    if not has_request_context():
+        with independent_connection() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+        return
+
+    conn = get_connection()
+    cur = conn.cursor()
+    en_transaccion = conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    try:
+        if en_transaccion:
+            cur.execute("SAVEPOINT ia_auxiliar")
+        yield cur
+    except Exception:
+        if en_transaccion:
+            cur.execute("ROLLBACK TO SAVEPOINT ia_auxiliar")
+        else:
+            conn.rollback()
+        raise
+    else:
+        if en_transaccion:
+            cur.execute("RELEASE SAVEPOINT ia_auxiliar")
+        else:
+            conn.commit()
+    finally:
+        cur.close()
+
+
+class CacheClasificacion:
+    def __init__(self, version, max_memoria=1024):
+        self.version = version
+        self.max_memoria = max_memoria
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._tabla_disponible = True
+        self.aciertos_memoria = 0
+        self.aciertos_tabla = 0
+        self.fallos = 0
+        self.segundos_inferencia = 0.0
+
+    def _recordar(self, clave, respuesta):
+        with self._lock:
+            self._memoria[clave] = respuesta
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+
+    def obtener(self, clave):
+        if not clave:
+            return None
+        with self._lock:
+            if clave in self._memoria:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                return self._memoria[clave]
+
+        respuesta = self._leer_tabla(clave)
+        if respuesta is not None:
+            self._recordar(clave, respuesta)
+            with self._lock:
+                self.aciertos_tabla += 1
+            return respuesta
+
+        with self._lock:
+            self.fallos += 1
+        return None
+
+    def guardar(self, clave, respuesta, segundos=0.0):
+        with self._lock:
+            self.segundos_inferencia += segundos
+        if not clave or not respuesta:
+            return
+        self._recordar(clave, respuesta)
+        self._escribir_tabla(clave, respuesta)
+
+    def _leer_tabla(self, clave):
+        if not self._tabla_disponible:
+            return None
+        try:
+            with cursor_auxiliar() as cur:
+                cur.execute(
+                    "SELECT respuesta FROM ia_clasificacion_cache WHERE clave = %s AND version = %s",
+                    (clave, self.version),
+                )
+                row = cur.fetchone()
+            return row[0] if row else None
+        except psycopg2.errors.UndefinedTable:
+            self._desactivar_tabla()
+        except Exception as e:
+            print(f"Caché IA: error leyendo la tabla: {e}")
+        return None
+
+    def _escribir_tabla(self, clave, respuesta):
+        if not self._tabla_disponible:
+            return
+        try:
+            with cursor_auxiliar() as cur:
+                cur.execute("""
+                    INSERT INTO ia_clasificacion_cache (clave, version, respuesta)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (clave, version) DO NOTHING
+                """, (clave, self.version, respuesta))
+        except psycopg2.errors.UndefinedTable:
+            self._desactivar_tabla()
+        except Exception as e:
+            print(f"Caché IA: error escribiendo la tabla: {e}")
+
+    def _desactivar_tabla(self):
+        self._tabla_disponible = False
+        print("ADVERTENCIA: no existe ia_clasificacion_cache (ejecuta `python esquema.py`). "
+              "Se usará solo la caché en memoria.")
+
+    def estadisticas(self):
+        with self._lock:
+            aciertos = self.aciertos_memoria + self.aciertos_tabla
+            promedio = self.segundos_inferencia / self.fallos if self.fallos else 0.0
+            return {
+                "version": self.version,
+                "entradas_memoria": len(self._memoria),
+                "aciertos_memoria": self.aciertos_memoria,
+                "aciertos_tabla": self.aciertos_tabla,
+                "fallos": self.fallos,
+                "segundos_inferencia": self.segundos_inferencia,
+                # Estimación: cada acierto evitó una inferencia de duración promedio
+                "segundos_ahorrados": aciertos * promedio,
+            }
+
+
+def _version_cache():
+    firma = f"{MODELO_NOMBRE}\n{PROMPT_CLASIFICACION}".encode("utf-8")
+    return hashlib.sha1(firma).hexdigest()[:16]
+
+
+cache_clasificacion = CacheClasificacion(
+    _version_cache(), max_memoria=int(os.getenv("IA_CACHE_MEMORIA", "1024"))
+)
+
+# ==========================================
+# 1c. CLASIFICACIÓN RÁPIDA POR PALABRAS CLAVE
+# ==========================================
+# Un solo regex compilado recorre el mensaje una vez y suma el peso de cada
+# palabra/frase encontrada por categoría. La confianza es la fracción del
+# puntaje que se lleva la categoría ganadora: "accidente vehicular" o
+# "licencia médica" se resuelven aquí en microsegundos y solo los mensajes
+# ambiguos ("licencia por hijo enfermo") van a Llama 3.
+#
+# Las palabras se pueden configurar en la tabla ia_palabra_clave (ver
+# esquema.py); si está vacía o no existe se usan las de abajo.
+#
+# Cada palabra coincide completa ("salud" no cuenta en "saludos"). Terminada
+# en "*" es una raíz: "hijo*" cuenta en "hijo" y en "hijos".
+
+# Categoría -> {palabra o frase: peso}. El orden define el desempate.
+PALABRAS_CLAVE_DEFECTO = {
+    'accidente': {
+        'accidente*': 2, 'choque*': 2, 'vehicular': 1, 'siniestro': 2,
+        'accidente vehicular': 4, 'accidente de transito': 4, 'accidente laboral': 4,
+    },
+    'medico': {
+        'salud': 1, 'médico*': 1, 'médica*': 1, 'enfermedad*': 2, 'doctor': 2,
+        'hospital*': 2, 'fiebre': 2, 'gripe': 2, 'licencia*': 1,
+        'licencia médica': 4, 'hora médica': 4, 'control médico': 4,
+    },
+    'asunto familiar': {
+        'familiar': 1, 'hijo*': 2, 'hija*': 2, 'funeral': 3, 'mamá': 2, 'papá': 2,
+        'hermano*': 2, 'madre': 2, 'padre': 2, 'abuelo*': 2, 'abuela*': 2,
+    },
+    'asunto personal': {
+        'personal': 1, 'trámite*': 2, 'banco': 2, 'notaría': 2, 'viaje': 1, 'mudanza': 2,
+    },
+}
+
+IA_UMBRAL_CONFIANZA = float(os.getenv("IA_UMBRAL_CONFIANZA", "0.75"))
+IA_PUNTAJE_MINIMO = float(os.getenv("IA_PUNTAJE_MINIMO", "2"))
+IA_PALABRAS_TTL = float(os.getenv("IA_PALABRAS_TTL", "300"))
+
+ResultadoPalabras = namedtuple("ResultadoPalabras", "categoria confianza puntaje")
+
+
+class ClasificadorPalabras:
+    def __init__(self, palabras_defecto, ttl=300.0):
+        self.palabras_defecto = palabras_defecto
+        self.ttl = ttl
+        self._compilado = None   # (regex, {palabra: [(categoria, peso)]}, orden, raíces)
+        self._cargado_en = 0.0
+        self._lock = threading.Lock()
+        self._tabla_disponible = True
+        # Los incrementan los hilos de procesar_pendientes: van con su propio
+        # lock (el otro se toma mientras se recarga la tabla)
+        self._lock_contadores = threading.Lock()
+        self.atajos = 0          # mensajes resueltos sin llamar al modelo
+        self.consultas_modelo = 0  # inferencias de Llama 3 (lo cacheado no cuenta)
+
+    @staticmethod
+    def compilar(palabras):
+        indice, orden = {}, []
+        for categoria, tabla in palabras.items():
+            orden.append(categoria)
+            for palabra, peso in tabla.items():
+                palabra = palabra.strip()
+                clave = normalizar_mensaje(palabra.rstrip("*"))
+                if clave:
+                    # Las raíces quedan en el índice con su "*"
+                    clave += "*" if palabra.endswith("*") else ""
+                    indice.setdefault(clave, []).append((categoria, float(peso)))
+        # Más largas primero para que "licencia medica" gane sobre "licencia*"
+        alternativas = sorted(indice, key=len, reverse=True)
+        patrones = [re.escape(a[:-1]) + r"\w*" if a.endswith("*") else re.escape(a) for a in alternativas]
+        regex = re.compile(r"\b(" + "|".join(patrones) + r")\b") if alternativas else None
+        raices = [a for a in alternativas if a.endswith("*")]
+        return regex, indice, orden, raices
+
+    @staticmethod
+    def _clave(encontrada, indice, raices):
+        """Entrada del índice que produjo la coincidencia (palabra exacta o raíz)."""
+        if encontrada in indice:
+            return encontrada
+        return next(r for r in raices if encontrada.startswith(r[:-1]))
+
+    def _palabras_tabla(self):
+        if not self._tabla_disponible:
+            return None
+        try:
+            with cursor_auxiliar() as cur:
+                cur.execute("SELECT categoria, palabra, peso FROM ia_palabra_clave ORDER BY categoria")
+                filas = cur.fetchall()
+        except psycopg2.errors.UndefinedTable:
+            self._tabla_disponible = False
+            return None
+        except Exception as e:
+            print(f"Palabras clave: error leyendo ia_palabra_clave: {e}")
+            return None
+        if not filas:
+            return None
+        # Respetamos el orden de desempate de las categorías conocidas
+        palabras = {c: {} for c in self.palabras_defecto}
+        for categoria, palabra, peso in filas:
+            palabras.setdefault(categoria, {})[palabra] = peso
+        return {c: t for c, t in palabras.items() if t}
+
+    def _actual(self):
+        ahora = time.monotonic()
+        if self._compilado is None or ahora - self._cargado_en > self.ttl:
+            with self._lock:
+                if self._compilado is None or ahora - self._cargado_en > self.ttl:
+                    palabras = self._palabras_tabla() or self.palabras_defecto
+                    self._compilado = self.compilar(palabras)
+                    self._cargado_en = ahora
+        return self._compilado
+
+    def recargar(self):
+        with self._lock:
+            self._compilado = None
+
+    def clasificar(self, texto):
+        regex, indice, orden, raices = self._actual()
+        if regex is None:
+            return ResultadoPalabras('otros', 0.0, 0.0)
+
+        puntajes = {}
+        for m in regex.finditer(normalizar_mensaje(texto)):
+            for categoria, peso in indice[self._clave(m.group(1), indice, raices)]:
+                puntajes[categoria] = puntajes.get(categoria, 0.0) + peso
+
+        if not puntajes:
+            return ResultadoPalabras('otros', 0.0, 0.0)
+
+        prioridad = {c: i for i, c in enumerate(orden)}
+        categoria = min(puntajes, key=lambda c: (-puntajes[c], prioridad.get(c, len(orden))))
+        total = sum(puntajes.values())
+        return ResultadoPalabras(categoria, puntajes[categoria] / total, puntajes[categoria])
+
+    def es_inequivoco(self, resultado):
+        return (resultado.categoria != 'otros'
+                and resultado.confianza >= IA_UMBRAL_CONFIANZA
+                and resultado.puntaje >= IA_PUNTAJE_MINIMO)
+
+    def contar(self, atajo):
+        with self._lock_contadores:
+            if atajo:
+                self.atajos += 1
+            else:
+                self.consultas_modelo += 1
+
+    def estadisticas(self):
+        with self._lock_contadores:
+            return {"atajos": self.atajos, "consultas_modelo": self.consultas_modelo}
+
+
+clasificador_palabras = ClasificadorPalabras(PALABRAS_CLAVE_DEFECTO, ttl=IA_PALABRAS_TTL)
 
 # ==========================================
 # 2. UTILIDADES (Fechas/Regex) - SIN CAMBIOS
@@ -144,14 +485,151 @@ def calcular_rango(mensaje: str, fecha_dialogo: date):
         return fecha_dialogo, fecha_dialogo + timedelta(days=dias - 1), dias
     return fecha_dialogo, fecha_dialogo, 1
 
+# ==========================================
+# 2b. CLASIFICACIÓN DE JUSTIFICACIONES (individual y por lotes)
+# ==========================================
+# La inferencia de Llama 3 tarda segundos, así que se hace SIN tener la fila
+# bloqueada ni una transacción abierta: se lee el mensaje, se clasifica y
+# recién al final se escribe con un UPDATE corto. El UPDATE solo aplica si el
+# mensaje sigue siendo el mismo que se clasificó.
+
+# Concurrencia máxima del lote (la generación en sí está serializada por _model_lock)
+IA_LOTE_CONCURRENCIA = max(1, int(os.getenv("IA_LOTE_CONCURRENCIA", "2")))
+TRABAJO_PENDIENTES = "procesar_pendientes"
+
+
+def clasificar_justificacion(id, msg_original, fecha):
+    """
+    Devuelve (categoria, inicio, fin, duracion, justificado) para el mensaje.
+    No toca la base de datos.
+    """
+    msg_original = (msg_original or "").strip()
+
+    if len(msg_original) <= 3:
+        print(f"ID {id}: Sin contenido suficiente.")
+        return "otros", fecha, fecha, 1, False
+
+    # A. Atajo: si las palabras clave no dejan dudas no hace falta el modelo
+    rapido = clasificador_palabras.clasificar(msg_original)
+    if clasificador_palabras.es_inequivoco(rapido):
+        clasificador_palabras.contar(atajo=True)
+        cat = rapido.categoria
+        print(f"ID {id}: Palabras clave -> {cat} (confianza {rapido.confianza:.2f})")
+    else:
+        print(f"ID {id}: Procesando con Llama 3: '{msg_original}'")
+
+        # B. Usamos Llama 3 para sacar la "Intención" (Categoría en texto)
+        intencion_ia = resumir_mensaje(msg_original)
+        print(f"   -> Llama 3 dice: {intencion_ia}")
+
+        # C. Convertimos esa intención a nuestras categorías fijas
+        cat = detectar_categoria(intencion_ia)
+
+        # Fallback si Llama 3 falla (raro, pero posible)
+        if cat == "otros":
+            cat = rapido.categoria
+
+    # D. Calcular fechas
+    ini, fin, dur = calcular_rango(msg_original, fecha)
+
+    print(f"   -> Categoría Final: {cat} | Duración: {dur}")
+    return cat, ini, fin, dur, True
+
+
+def guardar_clasificacion(cur, id, mensaje, resultado):
+    """
+    Escribe el resultado (SIN TOCAR EL MENSAJE ORIGINAL). Devuelve False si la
+    fila ya no existe o su mensaje cambió mientras se clasificaba.
+    """
+    cat, ini, fin, dur, justificado = resultado
+    cur.execute("""
+        UPDATE asistencia 
+        SET categoria=%s, 
+            fecha_inicio_inasistencia=%s, 
+            fecha_fin_inasistencia=%s, 
+            duracion_dias=%s, 
+            procesado_ia=TRUE,
+            justificado=%s
+        WHERE id=%s
+          AND mensaje IS NOT DISTINCT FROM %s
+    """, (cat, ini, fin, dur, justificado, id, mensaje))
+    return cur.rowcount == 1
+
+
+def _procesar_pendiente(trabajo, id, mensaje, fecha):
+    try:
+        resultado = clasificar_justificacion(id, mensaje, fecha)
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            # Transacción corta: solo el UPDATE tiene la fila bloqueada
+            guardado = guardar_clasificacion(cur, id, mensaje, resultado)
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        trabajo.avanzar(cambiados=1 if guardado else 0)
+    except Exception as e:
+        print(f"Error procesando asistencia {id}: {e}")
+        trabajo.avanzar(errores=1)
+
+
+def procesar_pendientes(trabajo):
+    """
+    Trabajo de fondo: clasifica todas las filas con procesado_ia = FALSE y
+    mensaje no vacío, con a lo sumo IA_LOTE_CONCURRENCIA a la vez.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import contextvars
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        # Misma consulta que SQL_PENDIENTES_IA en esquema.py (--verificar)
+        cur.execute("""
+            SELECT id, mensaje, fecha
+            FROM asistencia
+            WHERE procesado_ia = FALSE
+              AND COALESCE(TRIM(mensaje), '') <> ''
+            ORDER BY id
+        """)
+        pendientes = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    trabajo.total = len(pendientes)
+    if not pendientes:
+        trabajo.mensaje = "No hay justificaciones pendientes."
+        return
+
+    with ThreadPoolExecutor(max_workers=IA_LOTE_CONCURRENCIA, thread_name_prefix="ia-lote") as pool:
+        for id, mensaje, fecha in pendientes:
+            # Los hilos del pool no heredan el contexto: sin esto sus sentencias
+            # SQL no se atribuirían al trabajo en /metrics
+            pool.submit(contextvars.copy_context().run, _procesar_pendiente, trabajo, id, mensaje, fecha)
+
+    if trabajo.cambiados:
+        cache_reportes.invalidar()
+        recalcular_predicciones_en_fondo()
+    trabajo.mensaje = f"{trabajo.cambiados} de {trabajo.total} justificaciones clasificadas."
+
+
 # ==========================================
 # 3. MÓDULO DE PREDICCIÓN (ML) 
 # ==========================================
-def entrenar_y_predecir_inasistencias():
+def cargar_historial_inasistencias():
+    """Inasistencias justificadas (para entrenar/predecir) y nombres de trabajadores."""
+    import pandas as pd
+
     conn = get_connection()
     try:
+        # Misma consulta que SQL_HISTORIAL_INASISTENCIAS en esquema.py (--verificar)
         query = """
-            SELECT trabajador_id, fecha, categoria, duracion_dias, 
+            SELECT id, trabajador_id, fecha, categoria, duracion_dias, 
                    EXTRACT(DOW FROM fecha) as dia_semana,
                    EXTRACT(MONTH FROM fecha) as mes
             FROM asistencia 
@@ -163,90 +641,127 @@ def entrenar_y_predecir_inasistencias():
         df_trabajadores['nombre_completo'] = df_trabajadores['nombre'] + " " + df_trabajadores['apellido']
     finally:
         conn.close()
+    return df, df_trabajadores
+
 
-    if df.empty:
-        return []
+def entrenar_modelo(df):
+    """Entrena el RandomForest de duración. Devuelve (rf_model o None, le_cat)."""
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.preprocessing import LabelEncoder
 
     le_cat = LabelEncoder()
     rf_model = None
     
     if len(df) > 5:
-        df['cat_encoded'] = le_cat.fit_transform(df['categoria'].astype(str))
-        X = df[['trabajador_id', 'dia_semana', 'mes', 'cat_encoded']].fillna(0)
+        cat_encoded = le_cat.fit_transform(df['categoria'].astype(str))
+        X = df[['trabajador_id', 'dia_semana', 'mes']].assign(cat_encoded=cat_encoded).fillna(0)
        
         y = df['duracion_dias'].fillna(1)
         rf_model = RandomForestRegressor(n_estimators=50, random_state=42)
         rf_model.fit(X, y)
 
-    unique_workers = df['trabajador_id'].unique()
+    return rf_model, le_cat
+
+
+def estadisticas_por_trabajador(df):
+    """
+    Calcula en una sola pasada agrupada, por trabajador: cantidad de faltas,
+    promedio de días entre faltas, última falta, duración media y categoría
+    más frecuente (moda; ante empate la menor alfabéticamente, como
+    Series.mode()). Conserva el orden de primera aparición de cada trabajador.
+    """
+    import pandas as pd
+
+    orden = df['trabajador_id'].unique()
+
+    datos = df[['trabajador_id', 'fecha', 'categoria', 'duracion_dias']].copy()
+    datos['fecha'] = pd.to_datetime(datos['fecha'])
+    datos = datos.sort_values(['trabajador_id', 'fecha'], kind='mergesort')
+    datos['gap'] = datos.groupby('trabajador_id')['fecha'].diff().dt.days
+
+    grupos = datos.groupby('trabajador_id', sort=False)
+    stats = pd.DataFrame({
+        'n': grupos.size(),
+        'gaps': grupos['gap'].count(),
+        'promedio_gap': grupos['gap'].mean(),
+        'ultima_falta': grupos['fecha'].last(),
+        'duracion_media': grupos['duracion_dias'].mean(),
+    })
+
+    modas = (
+        datos.dropna(subset=['categoria'])
+        .groupby(['trabajador_id', 'categoria']).size().rename('veces').reset_index()
+        .sort_values(['trabajador_id', 'veces', 'categoria'], ascending=[True, False, True], kind='mergesort')
+        .drop_duplicates('trabajador_id')
+        .set_index('trabajador_id')['categoria']
+    )
+    stats['cat_moda'] = modas
+
+    return stats.reindex(orden)
+
+
+def predecir_inasistencias(df, df_trabajadores, rf_model, le_cat):
+    """
+    Arma la predicción de cada trabajador a partir de las estadísticas
+    agrupadas. Todas las filas pasan por un único `predict` del modelo.
+    """
+    import pandas as pd
+    import numpy as np
+
+    stats = estadisticas_por_trabajador(df)
+    ahora = datetime.now()
+
+    nombres = (
+        df_trabajadores.drop_duplicates('id').set_index('id')['nombre_completo']
+        if not df_trabajadores.empty else pd.Series(dtype=object)
+    )
+
+    # Duración estimada: un solo predict para todos los trabajadores con moda
+    duracion = stats['duracion_media'].copy()
+    if rf_model is not None:
+        con_moda = stats[stats['cat_moda'].notna()]
+        if not con_moda.empty:
+            clases = {c: i for i, c in enumerate(le_cat.classes_)}
+            mañana = date.today() + timedelta(days=1)
+            X_pred = pd.DataFrame({
+                'trabajador_id': con_moda.index.to_numpy(),
+                'dia_semana': mañana.weekday(),
+                'mes': mañana.month,
+                'cat_encoded': [clases.get(c, 0) for c in con_moda['cat_moda']],
+            })
+            try:
+                duracion.loc[con_moda.index] = rf_model.predict(X_pred)
+            except Exception:
+                pass  # nos quedamos con la duración media
+
     resultados = []
     
-    for tid in unique_workers:
-        w_data = df[df['trabajador_id'] == tid].sort_values('fecha')
-
+    for tid, fila, dias_duracion_est in zip(stats.index, stats.itertuples(index=False), duracion):
         # si no encuentra el nombre 
-        nombre_df = df_trabajadores[df_trabajadores['id'] == tid]
-        if not nombre_df.empty:
-            nombre = nombre_df['nombre_completo'].iloc[0]
-        else:
-            nombre = f"Trabajador {tid}"
+        nombre = nombres.get(tid, f"Trabajador {tid}")
         
         # inicio
         riesgo_texto = "Bajo"
         promedio_dias_entre_faltas = None
-        fecha_inicio_estimada = None
-        
-        if len(w_data) >= 2:
-            w_data['fecha'] = pd.to_datetime(w_data['fecha'])
-            diferencias = w_data['fecha'].diff().dt.days.dropna()
-
-            if not diferencias.empty:
-                promedio = diferencias.mean()
-                # si el promedio es válido 
-                if not pd.isna(promedio) and np.isfinite(promedio):
-                    promedio_dias_entre_faltas = promedio
-                    ultima_falta = w_data['fecha'].iloc[-1]
-                    fecha_inicio_estimada = ultima_falta + timedelta(days=promedio)
-
-                    dias_restantes = (fecha_inicio_estimada - datetime.now()).days
-                    
-                    if fecha_inicio_estimada < datetime.now():
-                        riesgo_texto = "⚠️ ALTO (Atrasado)"
-                    elif dias_restantes < 7:
-                        riesgo_texto = "Alto"
-                    elif dias_restantes < 15:
-                        riesgo_texto = "Medio"
-                    else:
-                        riesgo_texto = "Bajo"
-                else:
-                   
-                    fecha_inicio_estimada = datetime.now() + timedelta(days=30)
-                    riesgo_texto = "Sin historial suficiente"
-            else:
-                
-                fecha_inicio_estimada = datetime.now() + timedelta(days=30)
-                riesgo_texto = "Sin historial suficiente"
-        else:
-            fecha_inicio_estimada = datetime.now() + timedelta(days=30)  # Default si no hay datos
-            riesgo_texto = "Sin historial suficiente"
 
-        # Días
-        dias_duracion_est = 1.0
-        if rf_model:
-            try:
-                mañana = date.today() + timedelta(days=1)
-                cat_moda = w_data['categoria'].mode()[0] if not w_data['categoria'].empty else 'otros'
-                cat_code = le_cat.transform([cat_moda])[0] if cat_moda in le_cat.classes_ else 0
+        promedio = fila.promedio_gap
+        if fila.n >= 2 and fila.gaps > 0 and not pd.isna(promedio) and np.isfinite(promedio):
+            promedio_dias_entre_faltas = promedio
+            fecha_inicio_estimada = fila.ultima_falta + timedelta(days=promedio)
 
-                X_pred = pd.DataFrame(
-                    [[tid, mañana.weekday(), mañana.month, cat_code]],
-                    columns=['trabajador_id', 'dia_semana', 'mes', 'cat_encoded']
-                )
-                dias_duracion_est = rf_model.predict(X_pred)[0]
-            except Exception:
-                dias_duracion_est = w_data['duracion_dias'].mean()
+            dias_restantes = (fecha_inicio_estimada - ahora).days
+            
+            if fecha_inicio_estimada < ahora:
+                riesgo_texto = "⚠️ ALTO (Atrasado)"
+            elif dias_restantes < 7:
+                riesgo_texto = "Alto"
+            elif dias_restantes < 15:
+                riesgo_texto = "Medio"
+            else:
+                riesgo_texto = "Bajo"
         else:
-            dias_duracion_est = w_data['duracion_dias'].mean() if not w_data.empty else 1
+            fecha_inicio_estimada = ahora + timedelta(days=30)  # Default si no hay datos
+            riesgo_texto = "Sin historial suficiente"
 
         # si la media viene NaN forzamos a 1 día
         if pd.isna(dias_duracion_est) or not np.isfinite(dias_duracion_est):
@@ -290,18 +805,426 @@ def entrenar_y_predecir_inasistencias():
     return resultados
 
 
+# ------------------------------------------
+# Modelo persistido en disco
+# ------------------------------------------
+# El RandomForest y el LabelEncoder se guardan junto con una "marca de agua"
+# de los datos con que se entrenaron (filas, id máximo y una firma del
+# contenido, que cambia si se edita cualquier fila usada para entrenar).
+# Solo se reentrena si la marca cambia o si se pide explícitamente.
+PREDICCION_MODELO_PATH = os.getenv(
+    "PREDICCION_MODELO_PATH", os.path.join("routes", "modelo_inasistencias.joblib")
+)
+
+_modelo_pred = None          # {"marca": ..., "rf_model": ..., "le_cat": ..., "entrenado": ...}
+_modelo_pred_lock = threading.Lock()
+
+
+def marca_de_agua(df):
+    """Resume los datos de entrenamiento: filas, id máximo y firma del contenido."""
+    import pandas as pd
+
+    columnas = ['id', 'trabajador_id', 'fecha', 'categoria', 'duracion_dias']
+    firma = int(pd.util.hash_pandas_object(df[columnas].astype(str), index=False).sum()) if len(df) else 0
+    return {
+        "filas": int(len(df)),
+        "max_id": int(df['id'].max()) if len(df) else 0,
+        "firma": firma,
+    }
+
+
+def _leer_modelo_disco():
+    import joblib
+
+    if not os.path.exists(PREDICCION_MODELO_PATH):
+        return None
+    try:
+        return joblib.load(PREDICCION_MODELO_PATH)
+    except Exception as e:
+        print(f"ADVERTENCIA: no se pudo leer {PREDICCION_MODELO_PATH}: {e}")
+        return None
+
+
+def _guardar_modelo_disco(guardado):
+    import joblib
+
+    # Escritura atómica: otro proceso nunca ve un archivo a medio escribir
+    tmp = f"{PREDICCION_MODELO_PATH}.{os.getpid()}.tmp"
+    try:
+        joblib.dump(guardado, tmp)
+        os.replace(tmp, PREDICCION_MODELO_PATH)
+    except Exception as e:
+        print(f"ADVERTENCIA: no se pudo guardar {PREDICCION_MODELO_PATH}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def obtener_modelo(df, reentrenar=False):
+    """
+    Devuelve (rf_model, le_cat) para estos datos: desde memoria, desde disco o
+    entrenando de nuevo si la marca de agua no coincide (o si reentrenar=True).
+    """
+    global _modelo_pred
+
+    marca = marca_de_agua(df)
+    with _modelo_pred_lock:
+        if not reentrenar:
+            if _modelo_pred is not None and _modelo_pred["marca"] == marca:
+                return _modelo_pred["rf_model"], _modelo_pred["le_cat"]
+            guardado = _leer_modelo_disco()
+            if guardado is not None and guardado.get("marca") == marca:
+                _modelo_pred = guardado
+                return guardado["rf_model"], guardado["le_cat"]
+
+        print(f"--> Entrenando modelo de inasistencias ({marca['filas']} filas)...")
+        rf_model, le_cat = entrenar_modelo(df)
+        _modelo_pred = {
+            "marca": marca,
+            "rf_model": rf_model,
+            "le_cat": le_cat,
+            "entrenado": datetime.now(),
+        }
+        _guardar_modelo_disco(_modelo_pred)
+        return rf_model, le_cat
+
+
+def entrenar_y_predecir_inasistencias(reentrenar=False):
+    """Calcula las predicciones con el historial actual y las guarda como las últimas."""
+    global _predicciones_desactualizadas
+
+    # Lo que se clasifique desde aquí las vuelve a marcar como desactualizadas
+    _predicciones_desactualizadas = False
+    try:
+        df, df_trabajadores = cargar_historial_inasistencias()
+        if df.empty:
+            predicciones = []
+        else:
+            rf_model, le_cat = obtener_modelo(df, reentrenar=reentrenar)
+            predicciones = predecir_inasistencias(df, df_trabajadores, rf_model, le_cat)
+    except Exception:
+        _predicciones_desactualizadas = True
+        raise
+
+    return _recordar_predicciones(predicciones, marca_de_agua(df))["predicciones"]
+
+
+# ------------------------------------------
+# Últimas predicciones calculadas
+# ------------------------------------------
+# Cada vez que se calculan predicciones (dashboard, reentrenar, trabajo de
+# fondo) el resultado queda en memoria y en un JSON junto al modelo, con la
+# marca de agua de los datos con que se calculó. La exportación a Excel usa
+# ese resultado tal cual, sin leer el historial ni predecir en el request: si
+# no hay, si es más viejo que PREDICCION_VIGENCIA_HORAS (el riesgo depende de
+# la fecha de hoy) o si desde entonces se clasificó alguna inasistencia, se
+# recalcula en segundo plano (trabajo TRABAJO_PREDICCIONES) y la exportación
+# indica que el resultado está desactualizado.
+PREDICCION_RESULTADOS_PATH = os.getenv(
+    "PREDICCION_RESULTADOS_PATH", os.path.join("routes", "predicciones_inasistencias.json")
+)
+PREDICCION_VIGENCIA_HORAS = float(os.getenv("PREDICCION_VIGENCIA_HORAS", "24"))
+TRABAJO_PREDICCIONES = "predicciones"
+
+_ultimas_predicciones = None  # {"calculado": datetime, "marca": {...}, "predicciones": [...]}
+_predicciones_desactualizadas = False
+
+
+def _recordar_predicciones(predicciones, marca):
+    """Guarda el resultado (memoria y disco) y lo devuelve."""
+    global _ultimas_predicciones
+
+    registro = {"calculado": datetime.now(), "marca": marca, "predicciones": predicciones}
+    _ultimas_predicciones = registro
+    tmp = f"{PREDICCION_RESULTADOS_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "calculado": registro["calculado"].isoformat(),
+                "marca": marca,
+                "predicciones": predicciones,
+            }, f, ensure_ascii=False)
+        os.replace(tmp, PREDICCION_RESULTADOS_PATH)
+    except Exception as e:
+        print(f"ADVERTENCIA: no se pudo guardar {PREDICCION_RESULTADOS_PATH}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return registro
+
+
+def _leer_predicciones_disco():
+    if not os.path.exists(PREDICCION_RESULTADOS_PATH):
+        return None
+    try:
+        with open(PREDICCION_RESULTADOS_PATH, encoding="utf-8") as f:
+            guardado = json.load(f)
+        return {
+            "calculado": datetime.fromisoformat(guardado["calculado"]),
+            # Los guardados antes de llevar marca se recalculan
+            "marca": guardado.get("marca"),
+            "predicciones": guardado["predicciones"],
+        }
+    except Exception as e:
+        print(f"ADVERTENCIA: no se pudo leer {PREDICCION_RESULTADOS_PATH}: {e}")
+        return None
+
+
+def olvidar_predicciones():
+    """Descarta el último resultado (memoria y disco)."""
+    global _ultimas_predicciones
+
+    _ultimas_predicciones = None
+    try:
+        os.remove(PREDICCION_RESULTADOS_PATH)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"ADVERTENCIA: no se pudo borrar {PREDICCION_RESULTADOS_PATH}: {e}")
+
+
+def _recalcular_predicciones(trabajo):
+    """Trabajo de fondo: predicciones con el historial actual (reentrena solo si cambió)."""
+    trabajo.total = 1
+    predicciones = entrenar_y_predecir_inasistencias()
+    trabajo.avanzar()
+    trabajo.mensaje = f"{len(predicciones)} predicciones calculadas."
+
+
+def recalcular_predicciones_en_fondo():
+    """Marca el resultado como desactualizado y lanza el recálculo (uno a la vez)."""
+    global _predicciones_desactualizadas
+
+    _predicciones_desactualizadas = True
+    jobs.lanzar(TRABAJO_PREDICCIONES, _recalcular_predicciones)
+
+
+def ultimas_predicciones():
+    """
+    Devuelve (predicciones, calculado, vigente) con el último resultado
+    guardado, sin calcular nada: ([], None, False) si todavía no hay. Si no
+    está vigente lanza el recálculo en segundo plano.
+    """
+    global _ultimas_predicciones
+
+    registro = _ultimas_predicciones
+    if registro is None:
+        registro = _leer_predicciones_disco()
+        if registro is not None:
+            _ultimas_predicciones = registro
+
+    vigente = (registro is not None and registro["marca"] is not None
+               and not _predicciones_desactualizadas
+               and datetime.now() - registro["calculado"] < timedelta(hours=PREDICCION_VIGENCIA_HORAS))
+    if not vigente:
+        recalcular_predicciones_en_fondo()
+    if registro is None:
+        return [], None, False
+    return registro["predicciones"], registro["calculado"], vigente
+
+
+
+# ==========================================
+# 3b. EXPORTACIÓN A EXCEL (memoria constante)
+# ==========================================
+# El historial se lee con un cursor con nombre (server-side) en bloques y se
+# escribe con xlsxwriter en modo constant_memory, que baja cada fila a disco
+# apenas se completa. Así nunca hay más de un bloque de filas en RAM. El
+# ancho de las columnas se va calculando mientras se escriben las filas.
+EXPORT_BLOQUE = int(os.getenv("EXPORT_BLOQUE", "2000"))
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+COLUMNAS_HISTORIAL = ["ID", "Trabajador", "Fecha", "Entrada", "Salida", "Horas", "Asistió",
+                      "Justificado", "Mensaje Original", "Categoria Detectada", "Días"]
+COLUMNAS_PREDICCION = ["Trabajador", "Fechas Exactas Estimadas", "Estado Riesgo",
+                       "Días Totales", "Frecuencia Histórica"]
+
+
+class HojaExcel:
+    """Escribe filas en orden sobre una hoja y lleva el ancho máximo de cada columna."""
+
+    def __init__(self, workbook, nombre, columnas, margen=2):
+        self.ws = workbook.add_worksheet(nombre)
+        self.margen = margen
+        self.fila = 0
+        self.anchos = [0] * len(columnas)
+        self.formatos = {
+            date: workbook.add_format({"num_format": "yyyy-mm-dd"}),
+            dt_time: workbook.add_format({"num_format": "hh:mm:ss"}),
+        }
+        self.escribir(columnas, workbook.add_format({"bold": True, "border": 1}))
+
+    def escribir(self, valores, formato=None):
+        for col, valor in enumerate(valores):
+            if valor is None:
+                largo = 4  # "None", como lo medía la versión anterior
+            else:
+                largo = len(str(valor))
+                fmt = formato or self.formatos.get(type(valor))
+                if isinstance(valor, (date, dt_time)):
+                    self.ws.write_datetime(self.fila, col, valor, fmt)
+                else:
+                    self.ws.write(self.fila, col, valor, fmt)
+            if largo > self.anchos[col]:
+                self.anchos[col] = largo
+        self.fila += 1
+
+    def cerrar(self):
+        for col, ancho in enumerate(self.anchos):
+            self.ws.set_column(col, col, ancho + self.margen)
+
+
+def _horas_trabajadas(fecha, entrada, salida):
+    h_str = "0:00:00"
+    if entrada and salida:
+        di = datetime.combine(fecha, entrada)
+        do = datetime.combine(fecha, salida)
+        if do < di: do += timedelta(days=1)
+        ts = int((do - di).total_seconds())
+        h, r = divmod(ts, 3600); m, s = divmod(r, 60)
+        h_str = f"{h}:{m:02d}:{s:02d}"
+    return h_str
+
+
+def escribir_historial(cur, hoja, primer_bloque):
+    """Vuelca el cursor en la hoja bloque a bloque."""
+    bloque = primer_bloque
+    while bloque:
+        for (id_, trabajador, fecha, entrada, salida, is_asistencia,
+             mensaje, categoria, duracion, justificado) in bloque:
+            hoja.escribir([
+                id_, trabajador, fecha, entrada, salida,
+                _horas_trabajadas(fecha, entrada, salida),
+                "Sí" if is_asistencia else "No",
+                "Sí" if justificado else "No",
+                mensaje, categoria, duracion,
+            ])
+        bloque = cur.fetchmany(EXPORT_BLOQUE)
+
+
+def enviar_archivo_temporal(ruta, nombre_descarga, mimetype):
+    """
+    Envía el archivo en bloques y lo borra al cerrar la respuesta: también si
+    el generador nunca arranca (HEAD, cliente que corta antes del primer bloque).
+    """
+    archivo = open(ruta, "rb")
+
+    def generar():
+        while True:
+            bloque = archivo.read(EXPORT_CHUNK_BYTES)
+            if not bloque:
+                break
+            yield bloque
+
+    def limpiar():
+        archivo.close()
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+    respuesta = Response(
+        generar(),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{nombre_descarga}"',
+            "Content-Length": str(os.path.getsize(ruta)),
+        },
+    )
+    # Sin direct_passthrough: Werkzeug envuelve el iterable y al cerrarlo
+    # llama a los call_on_close
+    respuesta.call_on_close(limpiar)
+    return respuesta
+
 
 # ==========================================
 # 4. RUTAS
 # ==========================================
+PAGINA_DEFECTO = 50
+PAGINA_MAXIMA = 500
+CATEGORIAS = ["medico", "accidente", "asunto familiar", "asunto personal", "otros"]
+
+
+def _parse_fecha(valor):
+    try:
+        return date.fromisoformat(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def _parse_int(valor):
+    try:
+        return int(valor) if valor not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _parse_bool(valor):
+    # "si"/"no" desde el formulario; cualquier otra cosa = sin filtro
+    return {"si": True, "no": False}.get((valor or "").lower())
+
+
+def filtros_asistencia(args):
+    """
+    Lee los filtros de la query string y arma el WHERE (sin paginación).
+    Devuelve (condiciones_sql, params, filtros) donde `filtros` son los valores
+    ya normalizados para volver a pintarlos en el formulario.
+    """
+    filtros = {
+        "trabajador": _parse_int(args.get("trabajador")),
+        "desde": _parse_fecha(args.get("desde")),
+        "hasta": _parse_fecha(args.get("hasta")),
+        "procesado_ia": _parse_bool(args.get("procesado_ia")),
+        "justificado": _parse_bool(args.get("justificado")),
+        "categoria": (args.get("categoria") or "").strip() or None,
+    }
+    condiciones, params = [], []
+    if filtros["trabajador"] is not None:
+        condiciones.append("a.trabajador_id = %s")
+        params.append(filtros["trabajador"])
+    if filtros["desde"] is not None:
+        condiciones.append("a.fecha >= %s")
+        params.append(filtros["desde"])
+    if filtros["hasta"] is not None:
+        condiciones.append("a.fecha <= %s")
+        params.append(filtros["hasta"])
+    if filtros["procesado_ia"] is not None:
+        condiciones.append("a.procesado_ia = %s")
+        params.append(filtros["procesado_ia"])
+    if filtros["justificado"] is not None:
+        condiciones.append("a.justificado = %s")
+        params.append(filtros["justificado"])
+    if filtros["categoria"] is not None:
+        condiciones.append("a.categoria = %s")
+        params.append(filtros["categoria"])
+    return condiciones, params, filtros
+
+
 @asistencia_bp.route("/asistencias", methods=["GET"])
 def listar_asistencias():
+    """
+    Listado paginado por keyset sobre (fecha, id): la página siguiente parte
+    desde la última fila mostrada (?despues_fecha=...&despues_id=...), así que
+    cada página cuesta lo mismo sin importar cuántas filas tenga la tabla.
+    """
+    condiciones, params, filtros = filtros_asistencia(request.args)
+
+    limite = _parse_int(request.args.get("limite")) or PAGINA_DEFECTO
+    limite = max(1, min(limite, PAGINA_MAXIMA))
+
+    despues_fecha = _parse_fecha(request.args.get("despues_fecha"))
+    despues_id = _parse_int(request.args.get("despues_id"))
+    if despues_fecha is not None and despues_id is not None:
+        condiciones.append("(a.fecha, a.id) < (%s, %s)")
+        params += [despues_fecha, despues_id]
+
+    where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+
     conn = get_connection()
     try:
         cur = conn.cursor(cursor_factory=DictCursor)
-        cur.execute("""
+        # Pedimos una fila extra solo para saber si hay página siguiente
+        cur.execute(f"""
             SELECT 
-                a.id, a.fecha, a.hora_entrada, a.hora_salida, 
+                a.id, a.fecha, a.hora_entrada, a.hora_salida, a.trabajador_id,
                 TRIM(CONCAT_WS(' ', t.nombre, t.apellido)) AS trabajador_nombre,
                 a.is_asistencia, a.justificado, a.procesado_ia,
                 COALESCE(a.mensaje, '') AS mensaje_texto, 
@@ -309,83 +1232,85 @@ def listar_asistencias():
                 a.fecha_inicio_inasistencia, a.fecha_fin_inasistencia, a.duracion_dias
             FROM asistencia a 
             LEFT JOIN trabajador t ON t.id = a.trabajador_id
-            ORDER BY a.fecha DESC, a.id DESC;
-        """)
+            {where}
+            ORDER BY a.fecha DESC, a.id DESC
+            LIMIT %s;
+        """, params + [limite + 1])
         asistencias = cur.fetchall()
-        return render_template("asistencia/lista.html", asistencias=asistencias)
     finally:
         conn.close()
 
+    # Query string de los filtros activos, para los links de paginación
+    filtros_query = {k: v for k, v in request.args.items()
+                     if k not in ("despues_fecha", "despues_id") and v != ""}
+
+    siguiente = None
+    if len(asistencias) > limite:
+        asistencias = asistencias[:limite]
+        ultima = asistencias[-1]
+        siguiente = dict(filtros_query, despues_fecha=ultima["fecha"].isoformat(), despues_id=ultima["id"])
+
+    return render_template(
+        "asistencia/lista.html",
+        asistencias=asistencias,
+        filtros=filtros,
+        filtros_query=filtros_query,
+        siguiente=siguiente,
+        es_primera_pagina=despues_id is None,
+        limite=limite,
+        categorias=CATEGORIAS,
+    )
+
 
 @asistencia_bp.route("/predicciones", methods=["GET"])
 def dashboard_predicciones():
     try: 
-        return render_template("asistencia/predicciones.html", predicciones=entrenar_y_predecir_inasistencias())
+        return render_template(
+            "asistencia/predicciones.html",
+            predicciones=entrenar_y_predecir_inasistencias(),
+            modelo_entrenado=_modelo_pred["entrenado"] if _modelo_pred else None,
+        )
     except Exception as e: 
         return f"Error generando predicciones: {e}"
 
+@asistencia_bp.route("/predicciones/reentrenar", methods=["POST"])
+def reentrenar_predicciones():
+    try:
+        # Si el reentrenamiento falla no debe quedar el resultado anterior
+        olvidar_predicciones()
+        entrenar_y_predecir_inasistencias(reentrenar=True)
+        flash("Modelo de predicción reentrenado.", "success")
+    except Exception as e:
+        flash(f"Error reentrenando el modelo: {e}", "danger")
+    return redirect(url_for("asistencia.dashboard_predicciones"))
+
 @asistencia_bp.route("/asistencias/<int:id>/procesar", methods=["POST"])
 def procesar_asistencia(id):
     conn = get_connection()
     cur = conn.cursor(cursor_factory=DictCursor)
     try:
-        cur.execute("SELECT * FROM asistencia WHERE id = %s FOR UPDATE", (id,))
+        cur.execute("SELECT id, fecha, mensaje FROM asistencia WHERE id = %s", (id,))
         row = cur.fetchone()
+        # No dejamos la transacción abierta mientras corre el modelo
+        conn.rollback()
 
         if not row:
             flash("Asistencia no encontrada.", "danger")
             return redirect(url_for("asistencia.listar_asistencias"))
 
-        # 1. Obtener mensaje original
-        msg_original = row['mensaje'] or ""
-        msg_original = msg_original.strip()
-        
-        # 2. Verificar contenido
-        tiene_contenido = len(msg_original) > 3
-        
-        # Variables default
-        cat = "otros"
-        ini, fin, dur = row['fecha'], row['fecha'], 1
-        nuevo_estado_justificado = False
-
-        if not tiene_contenido:
-            print(f"ID {id}: Sin contenido suficiente.")
-            nuevo_estado_justificado = False
-        else:
-            print(f"ID {id}: Procesando con Llama 3: '{msg_original}'")
-            
-            # A. Usamos Llama 3 para sacar la "Intención" (Categoría en texto)
-            intencion_ia = resumir_mensaje(msg_original)
-            print(f"   -> Llama 3 dice: {intencion_ia}")
-            
-            # B. Convertimos esa intención a nuestras categorías fijas
-            cat = detectar_categoria(intencion_ia)
-            
-            # Fallback si Llama 3 falla (raro, pero posible)
-            if cat == "otros":
-                cat = detectar_categoria(msg_original)
+        resultado = clasificar_justificacion(id, row['mensaje'], row['fecha'])
 
-            # C. Calcular fechas
-            ini, fin, dur = calcular_rango(msg_original, row['fecha'])
-            
-            nuevo_estado_justificado = True
-            print(f"   -> Categoría Final: {cat} | Duración: {dur}")
+        if not guardar_clasificacion(cur, id, row['mensaje'], resultado):
+            conn.rollback()
+            flash("El mensaje cambió mientras se procesaba. Intenta nuevamente.", "warning")
+            return redirect(url_for("asistencia.listar_asistencias"))
 
-        # 3. ACTUALIZACIÓN (SIN TOCAR EL MENSAJE ORIGINAL)
-        cur.execute("""
-            UPDATE asistencia 
-            SET categoria=%s, 
-                fecha_inicio_inasistencia=%s, 
-                fecha_fin_inasistencia=%s, 
-                duracion_dias=%s, 
-                procesado_ia=TRUE,
-                justificado=%s
-            WHERE id=%s
-        """, (cat, ini, fin, dur, nuevo_estado_justificado, id))
-        
         conn.commit()
+        cache_reportes.invalidar()
+        recalcular_predicciones_en_fondo()
         
-        if nuevo_estado_justificado:
+        cat, justificado = resultado[0], resultado[4]
+        if justificado:
             flash(f"Procesado con IA. Categoría: {cat}", "success")
         else:
             flash("Sin mensaje para justificar.", "warning")
@@ -399,82 +1324,103 @@ def procesar_asistencia(id):
         
     return redirect(url_for("asistencia.listar_asistencias"))
 
+
+@asistencia_bp.route("/asistencias/procesar-pendientes", methods=["POST"])
+def procesar_pendientes_lote():
+    trabajo, nuevo = jobs.lanzar(TRABAJO_PENDIENTES, procesar_pendientes)
+    if nuevo:
+        flash("Procesando todas las justificaciones pendientes en segundo plano.", "info")
+    else:
+        flash("Ya hay un procesamiento de pendientes en curso.", "warning")
+    return redirect(url_for("asistencia.listar_asistencias"))
+
+
+@asistencia_bp.route("/asistencias/procesar-pendientes/estado")
+def estado_procesar_pendientes():
+    trabajo = jobs.ultimo(TRABAJO_PENDIENTES)
+    return jsonify(trabajo.como_dict() if trabajo else {"estado": "sin_trabajos"})
+
+EXPORT_CONTENIDOS = ("ambos", "historial", "predicciones")
+
+
 @asistencia_bp.route("/asistencias/descargar")
 def descargar_asistencias():
-    conn = get_connection()
-    try:
-        # 1. HISTORIAL
-        cur = conn.cursor(cursor_factory=DictCursor)
+    """
+    ?contenido=historial   solo el historial (no toca el modelo)
+    ?contenido=predicciones solo la hoja de predicciones
+    ?contenido=ambos        las dos hojas (por defecto)
+    """
+    import xlsxwriter
+
+    contenido = request.args.get("contenido", "ambos")
+    if contenido not in EXPORT_CONTENIDOS:
+        flash(f"Contenido de exportación inválido: {contenido}", "danger")
+        return redirect(url_for("asistencia.listar_asistencias"))
+    con_historial = contenido in ("ambos", "historial")
+    con_predicciones = contenido in ("ambos", "predicciones")
+
+    cur = None
+    if con_historial:
+        conn = get_connection()
+        # 1. HISTORIAL (cursor server-side: las filas se traen de a EXPORT_BLOQUE)
+        cur = conn.cursor(name="export_asistencias")
+        cur.itersize = EXPORT_BLOQUE
         cur.execute("""
             SELECT a.id, TRIM(CONCAT_WS(' ', t.nombre, t.apellido)) AS trabajador,
                    a.fecha, a.hora_entrada, a.hora_salida, a.is_asistencia,
-                   a.mensaje, a.categoria, a.duracion_dias, a.is_atrasado, a.justificado, a.procesado_ia
+                   a.mensaje, a.categoria, a.duracion_dias, a.justificado
             FROM asistencia a LEFT JOIN trabajador t ON t.id = a.trabajador_id
-            ORDER BY a.fecha DESC
+            ORDER BY a.fecha DESC, a.id DESC
         """)
-        registros = cur.fetchall()
-        
-        if not registros:
+        primer_bloque = cur.fetchmany(EXPORT_BLOQUE)
+
+        if not primer_bloque:
+            cur.close()
             flash("No hay datos.", "warning")
             return redirect(url_for("asistencia.listar_asistencias"))
 
-        datos_hist = []
-        for reg in registros:
-            h_str = "0:00:00"
-            if reg['hora_entrada'] and reg['hora_salida']:
-                di = datetime.combine(reg['fecha'], reg['hora_entrada'])
-                do = datetime.combine(reg['fecha'], reg['hora_salida'])
-                if do < di: do += timedelta(days=1)
-                ts = int((do - di).total_seconds())
-                h, r = divmod(ts, 3600); m, s = divmod(r, 60)
-                h_str = f"{h}:{m:02d}:{s:02d}"
-
-            datos_hist.append({
-                "ID": reg['id'], "Trabajador": reg['trabajador'], "Fecha": reg['fecha'],
-                "Entrada": reg['hora_entrada'], "Salida": reg['hora_salida'], "Horas": h_str,
-                "Asistió": "Sí" if reg['is_asistencia'] else "No",
-                "Justificado": "Sí" if reg['justificado'] else "No",
-                "Mensaje Original": reg['mensaje'], "Categoria Detectada": reg['categoria'], "Días": reg['duracion_dias']
-            })
-        
-        df_hist = pd.DataFrame(datos_hist)
-
-        # 2. PREDICCIONES
-        predicciones_list = entrenar_y_predecir_inasistencias()
-        df_pred = pd.DataFrame(predicciones_list)
-
-        # 3. EXCEL
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_hist.to_excel(writer, index=False, sheet_name='Reporte Histórico')
-            ws1 = writer.sheets['Reporte Histórico']
-            for col in ws1.columns:
-                max_len = 0
-                col_let = col[0].column_letter
-                for cell in col:
-                    try:
-                        if len(str(cell.value)) > max_len: max_len = len(str(cell.value))
-                    except: pass
-                ws1.column_dimensions[col_let].width = max_len + 2
-
-            if not df_pred.empty:
-                cols_orden = ["Trabajador", "Fechas Exactas Estimadas", "Estado Riesgo", "Días Totales", "Frecuencia Histórica"]
-                cols_final = [c for c in cols_orden if c in df_pred.columns]
-                df_pred = df_pred[cols_final]
-                df_pred.to_excel(writer, index=False, sheet_name='Predicciones IA')
-                
-                ws2 = writer.sheets['Predicciones IA']
-                for col in ws2.columns:
-                    max_len = 0
-                    col_let = col[0].column_letter
-                    for cell in col:
-                        try:
-                            if len(str(cell.value)) > max_len: max_len = len(str(cell.value))
-                        except: pass
-                    ws2.column_dimensions[col_let].width = max_len + 4 
-
-        output.seek(0)
-        return send_file(output, as_attachment=True, download_name=f'reporte_Llama3_{date.today()}.xlsx',
-                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    finally:
-        conn.close()
\ No newline at end of file
+    # 2. PREDICCIONES (último resultado calculado; no se predice en el request)
+    predicciones_list, calculado, vigente = [], None, True
+    if con_predicciones:
+        predicciones_list, calculado, vigente = ultimas_predicciones()
+        if calculado is None:
+            flash("Las predicciones se están calculando en segundo plano; "
+                  "vuelve a descargarlas en unos minutos.", "info")
+            if not con_historial:
+                return redirect(url_for("asistencia.listar_asistencias"))
+        elif not predicciones_list and not con_historial:
+            flash("No hay predicciones para exportar.", "warning")
+            return redirect(url_for("asistencia.listar_asistencias"))
+
+    fd, ruta = tempfile.mkstemp(prefix="reporte_asistencia_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(ruta, {"constant_memory": True})
+
+        if con_historial:
+            hoja = HojaExcel(workbook, "Reporte Histórico", COLUMNAS_HISTORIAL)
+            escribir_historial(cur, hoja, primer_bloque)
+            hoja.cerrar()
+            cur.close()
+            conn.rollback()  # termina la transacción del cursor server-side
+
+        if predicciones_list:
+            hoja = HojaExcel(workbook, "Predicciones IA", COLUMNAS_PREDICCION, margen=4)
+            for p in predicciones_list:
+                hoja.escribir([p.get(c) for c in COLUMNAS_PREDICCION])
+            # Nota al pie, fuera del cálculo de anchos
+            hoja.ws.write(hoja.fila + 1, 0, f"Calculadas el {calculado:%Y-%m-%d %H:%M}"
+                          + ("" if vigente else " (desactualizadas; se están recalculando)"))
+            hoja.cerrar()
+
+        workbook.close()
+    except Exception:
+        os.remove(ruta)
+        raise
+
+    # 3. ENVÍO
+    sufijo = "" if contenido == "ambos" else f"_{contenido}"
+    return enviar_archivo_temporal(
+        ruta, f'reporte_Llama3{sufijo}_{date.today()}.xlsx',
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
@@ -0,0 +1,54 @@
+from flask import Blueprint, Response
+from db import pool_stats
+import instrumentacion
+from routes.asistencia import cache_clasificacion, clasificador_palabras
+from routes.reportes import cache_reportes
+
+metricas_bp = Blueprint("metricas", __name__)
+
+
+def _linea(nombre, valor, tipo="gauge", ayuda=""):
+    return [
+        f"# HELP {nombre} {ayuda}",
+        f"# TYPE {nombre} {tipo}",
+        f"{nombre} {valor}",
+    ]
+
+
+# Ruta con formato de texto de Prometheus para que se pueda "scrapear"
+@metricas_bp.route("/metrics")
+def metricas():
+    lineas = []
+    stats = pool_stats()
+    if stats:
+        lineas += _linea("db_pool_max", stats["max"], ayuda="Conexiones máximas del pool")
+        lineas += _linea("db_pool_abiertas", stats["abiertas"], ayuda="Conexiones abiertas")
+        lineas += _linea("db_pool_en_uso", stats["en_uso"], ayuda="Conexiones prestadas")
+        lineas += _linea("db_pool_libres", stats["libres"], ayuda="Conexiones ociosas en el pool")
+        lineas += _linea("db_pool_esperando", stats["esperando"], ayuda="Hilos esperando una conexión")
+        lineas += _linea("db_pool_checkouts_total", stats["checkouts_total"], "counter", "Conexiones entregadas")
+        lineas += _linea("db_pool_timeouts_total", stats["timeouts_total"], "counter", "Esperas que agotaron PG_POOL_TIMEOUT")
+        lineas += _linea("db_pool_descartadas_total", stats["descartadas_total"], "counter", "Conexiones cerradas por fallar el chequeo de salud")
+        lineas += _linea("db_pool_checkout_segundos_total", f"{stats['checkout_segundos_total']:.6f}", "counter", "Tiempo acumulado obteniendo conexiones")
+        lineas += _linea("db_pool_checkout_segundos_max", f"{stats['checkout_segundos_max']:.6f}", ayuda="Mayor espera por una conexión")
+
+    cache = cache_clasificacion.estadisticas()
+    lineas += _linea("ia_cache_aciertos_memoria_total", cache["aciertos_memoria"], "counter", "Clasificaciones servidas desde el LRU en memoria")
+    lineas += _linea("ia_cache_aciertos_tabla_total", cache["aciertos_tabla"], "counter", "Clasificaciones servidas desde ia_clasificacion_cache")
+    lineas += _linea("ia_cache_fallos_total", cache["fallos"], "counter", "Clasificaciones que requirieron inferencia")
+    lineas += _linea("ia_cache_entradas_memoria", cache["entradas_memoria"], ayuda="Entradas en el LRU en memoria")
+    lineas += _linea("ia_inferencia_segundos_total", f"{cache['segundos_inferencia']:.3f}", "counter", "Tiempo total de inferencia de Llama 3")
+    lineas += _linea("ia_cache_segundos_ahorrados_total", f"{cache['segundos_ahorrados']:.3f}", "counter", "Tiempo de inferencia estimado que evitó la caché")
+
+    palabras = clasificador_palabras.estadisticas()
+    lineas += _linea("ia_atajo_palabras_total", palabras["atajos"], "counter", "Justificaciones clasificadas solo con palabras clave")
+    lineas += _linea("ia_consultas_modelo_total", palabras["consultas_modelo"], "counter", "Inferencias de Llama 3 (sin las resueltas por la caché)")
+    reportes = cache_reportes.estadisticas()
+    lineas += _linea("reportes_cache_aciertos_total", reportes["aciertos"], "counter", "Consultas del reporte servidas desde la caché")
+    lineas += _linea("reportes_cache_fallos_total", reportes["fallos"], "counter", "Consultas del reporte que fueron a la base")
+    lineas += _linea("reportes_cache_invalidaciones_total", reportes["invalidaciones"], "counter", "Veces que se vació la caché por escrituras de asistencia")
+    lineas += _linea("reportes_cache_entradas", reportes["entradas"], ayuda="Entradas en la caché del reporte")
+
+    # Latencia, sentencias por request y repeticiones (N+1) por endpoint
+    lineas += instrumentacion.prometheus()
+    return Response("\n".join(lineas) + "\n", mimetype="text/plain; version=0.0.4")
@@ -1,10 +1,13 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, send_file
+from flask import Blueprint, request, render_template, flash, redirect, url_for, send_file
 from db import get_connection
+import resumen_mensual
 from psycopg2.extras import DictCursor
-import pandas as pd
-import plotly.express as px
+from collections import OrderedDict
 import locale
 import io
+import os
+import threading
+import time
 from datetime import date
 
 try:
@@ -17,38 +20,137 @@ except locale.Error:
 
 reportes_bp = Blueprint("reportes", __name__, template_folder="../templates")
 
-def get_data_for_chart():
+# ==========================================
+# Filtros del reporte
+# ==========================================
+# El reporte trabaja por meses completos: `desde` y `hasta` se aceptan como
+# YYYY-MM (o una fecha, de la que se toma el mes) y se convierten en un rango
+# semiabierto [primer día de `desde`, primer día del mes siguiente a `hasta`),
+# igual que en sueldos. Así la consulta filtra `a.fecha` directamente y puede
+# usar un índice, en vez de comparar TO_CHAR(a.fecha, 'YYYY-MM').
+MESES_DEFECTO = 12
+
+def _parse_mes(valor):
+    """'2024-03' o '2024-03-15' -> date(2024, 3, 1). None si no es válido."""
+    try:
+        anio, mes = (valor or "").strip().split("-")[:2]
+        return date(int(anio), int(mes), 1)
+    except ValueError:
+        return None
+
+def _parse_int(valor):
+    try:
+        return int(valor) if valor not in (None, "") else None
+    except ValueError:
+        return None
+
+def _sumar_meses(mes, n):
+    total = mes.year * 12 + mes.month - 1 + n
+    return date(total // 12, total % 12 + 1, 1)
+
+def filtros_reporte(args):
+    """
+    Lee desde/hasta/empresa/sucursal/area de la query string.
+    Por defecto se muestran los últimos MESES_DEFECTO meses (incluido el actual).
+    """
+    hasta = _parse_mes(args.get("hasta")) or date.today().replace(day=1)
+    desde = _parse_mes(args.get("desde")) or _sumar_meses(hasta, -(MESES_DEFECTO - 1))
+    if desde > hasta:
+        desde, hasta = hasta, desde
+    return {
+        "desde": desde,
+        "hasta": hasta,
+        "empresa": _parse_int(args.get("empresa")),
+        "sucursal": _parse_int(args.get("sucursal")),
+        "area": _parse_int(args.get("area")),
+    }
+
+def parametros_url(filtros):
+    """Filtros en formato query string (para links de descarga y el formulario)."""
+    params = {"desde": filtros["desde"].strftime("%Y-%m"), "hasta": filtros["hasta"].strftime("%Y-%m")}
+    for clave in ("empresa", "sucursal", "area"):
+        if filtros[clave] is not None:
+            params[clave] = filtros[clave]
+    return params
+
+# Trabajadores del alcance × meses del rango, con los días asistidos de cada
+# mes. Las asistencias se agregan una sola vez dentro del rango semiabierto y
+# recién después se cruzan con la grilla de meses (los meses sin asistencias
+# quedan en 0, como antes). Con el resumen mensual activo (resumen_mensual.py)
+# los días salen de asistencia_mensual y no hace falta leer asistencia.
+_SQL_GRAFICO = """
+    WITH meses AS (
+        SELECT m::date AS inicio
+        FROM generate_series(%(desde)s::date, %(hasta)s::date, INTERVAL '1 month') m
+    ),
+    trabajadores AS (
+        SELECT t.id, TRIM(CONCAT_WS(' ', t.nombre, t.apellido)) AS nombre_trabajador,
+               s.nombre AS sucursal,
+               ARRAY(
+                   SELECT DISTINCT ar.nombre
+                   FROM turno_trabajador tt
+                   JOIN turno tu ON tu.id = tt.turno_id
+                   JOIN areatrabajo ar ON ar.id = tu.area_id
+                   WHERE tt.trabajador_id = t.id
+               ) AS areas
+        FROM trabajador t
+        LEFT JOIN sucursal s ON s.id = t.sucursal_id
+        WHERE (%(empresa)s::int IS NULL OR s.empresa_id = %(empresa)s)
+          AND (%(sucursal)s::int IS NULL OR t.sucursal_id = %(sucursal)s)
+          AND (%(area)s::int IS NULL OR EXISTS (
+                SELECT 1
+                FROM turno_trabajador tt
+                JOIN turno tu ON tu.id = tt.turno_id
+                WHERE tt.trabajador_id = t.id AND tu.area_id = %(area)s
+          ))
+    ),
+    dias AS ({dias})
+    SELECT
+        tr.id AS trabajador_id,
+        tr.nombre_trabajador,
+        tr.sucursal,
+        tr.areas,
+        EXTRACT(YEAR FROM m.inicio) AS anio,
+        EXTRACT(MONTH FROM m.inicio) AS mes_num,
+        COALESCE(d.dias_asistidos, 0) AS dias_asistidos
+    FROM trabajadores tr
+    CROSS JOIN meses m
+    LEFT JOIN dias d ON d.trabajador_id = tr.id AND d.inicio = m.inicio
+    ORDER BY m.inicio, tr.nombre_trabajador
+"""
+
+SQL_GRAFICO = _SQL_GRAFICO.format(dias="""
+        SELECT a.trabajador_id,
+               date_trunc('month', a.fecha)::date AS inicio,
+               COUNT(DISTINCT a.fecha) AS dias_asistidos
+        FROM asistencia a
+        JOIN trabajadores tr ON tr.id = a.trabajador_id
+        WHERE a.fecha >= %(desde)s
+          AND a.fecha <  %(fin)s
+          AND a.is_asistencia = TRUE
+        GROUP BY a.trabajador_id, date_trunc('month', a.fecha)
+    """)
+
+SQL_GRAFICO_RESUMEN = _SQL_GRAFICO.format(dias="""
+        SELECT am.trabajador_id, am.mes AS inicio, am.dias_asistidos
+        FROM asistencia_mensual am
+        JOIN trabajadores tr ON tr.id = am.trabajador_id
+        WHERE am.mes >= %(desde)s
+          AND am.mes <  %(fin)s
+    """)
+
+def parametros_sql(filtros):
+    return dict(filtros, fin=_sumar_meses(filtros["hasta"], 1))
+
+def get_data_for_chart(filtros):
     """Función centralizada para obtener y procesar los datos del gráfico."""
+    # pandas y plotly se importan recién al usar los reportes (arranque rápido)
+    import pandas as pd
+
     conn = get_connection()
     cur = conn.cursor(cursor_factory=DictCursor)
-    
 
-    sql_query = """
-        WITH meses AS (
-            SELECT DISTINCT TO_CHAR(fecha, 'YYYY-MM') AS anio_mes
-            FROM asistencia
-        ),
-        trabajadores_meses AS (
-            SELECT
-                t.id AS trabajador_id,
-                TRIM(CONCAT_WS(' ', t.nombre, t.apellido)) AS nombre_trabajador,
-                m.anio_mes
-            FROM trabajador t
-            CROSS JOIN meses m
-        )
-        SELECT
-            tm.nombre_trabajador,
-            EXTRACT(YEAR FROM TO_DATE(tm.anio_mes, 'YYYY-MM')) AS anio,
-            EXTRACT(MONTH FROM TO_DATE(tm.anio_mes, 'YYYY-MM')) AS mes_num,
-            COUNT(DISTINCT a.fecha) AS dias_asistidos
-        FROM trabajadores_meses tm
-        LEFT JOIN asistencia a ON tm.trabajador_id = a.trabajador_id
-                               AND TO_CHAR(a.fecha, 'YYYY-MM') = tm.anio_mes
-                               AND a.is_asistencia = TRUE
-        GROUP BY tm.nombre_trabajador, anio, mes_num
-        ORDER BY anio, mes_num;
-    """
-    cur.execute(sql_query)
+    resumen_mensual.ejecutar(cur, SQL_GRAFICO_RESUMEN, SQL_GRAFICO, parametros_sql(filtros))
     
     column_names = [desc[0] for desc in cur.description]
     registros = cur.fetchall()
@@ -60,42 +162,345 @@ def get_data_for_chart():
         return None
 
     df = pd.DataFrame(registros, columns=column_names)
-    df['mes_nombre'] = df['mes_num'].apply(lambda x: date(int(df['anio'].iloc[0]), int(x), 1).strftime('%B').capitalize())
-    df_sorted = df.sort_values(by=['anio', 'mes_num'])
+    # El año va en la etiqueta: con rangos de varios años "Marzo" se repetiría
+    df['mes_nombre'] = [
+        f"{date(int(a), int(m), 1).strftime('%B').capitalize()} {int(a)}"
+        for a, m in zip(df['anio'], df['mes_num'])
+    ]
+    df_sorted = df.sort_values(by=['anio', 'mes_num'], kind='mergesort')
     return df_sorted
 
+# ==========================================
+# Caché del reporte
+# ==========================================
+# El gráfico solo cambia cuando se escribe asistencia, pero los dashboards lo
+# refrescan todo el día. Se guardan el DataFrame y el HTML de plotly por
+# combinación de filtros. Una entrada se descarta si:
+#   - pasó REPORTES_CACHE_TTL segundos,
+#   - la app escribió asistencia (invalidar(), desde routes/asistencia.py), o
+#   - cambió la marca de asistencia_mensual (escrituras de otros procesos,
+#     p. ej. el marcaje de MiApiLogin; ver resumen_mensual.marca()).
+# ?refrescar=1 ignora la caché y la vuelve a llenar.
+REPORTES_CACHE_TTL = float(os.getenv("REPORTES_CACHE_TTL", "300"))
+REPORTES_CACHE_MAX = int(os.getenv("REPORTES_CACHE_MAX", "64"))
+
+class CacheReportes:
+    def __init__(self, ttl=300.0, max_entradas=64):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()  # clave -> (valor, marca, creado, generacion)
+        self._lock = threading.Lock()
+        self.generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave, marca):
+        """Devuelve (valor, edad_segundos) o (None, None) si no hay entrada vigente."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                valor, marca_guardada, creado, generacion = entrada
+                edad = time.monotonic() - creado
+                if edad < self.ttl and marca_guardada == marca and generacion == self.generacion:
+                    self._entradas.move_to_end(clave)
+                    self.aciertos += 1
+                    return valor, edad
+                del self._entradas[clave]
+            self.fallos += 1
+            return None, None
+
+    def guardar(self, clave, marca, valor, generacion):
+        """`generacion` es la leída antes de consultar: si hubo invalidar() entremedio no se guarda."""
+        with self._lock:
+            if generacion != self.generacion:
+                return
+            self._entradas[clave] = (valor, marca, time.monotonic(), generacion)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self):
+        with self._lock:
+            self.generacion += 1
+            self._entradas.clear()
+            self.invalidaciones += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "invalidaciones": self.invalidaciones,
+                "entradas": len(self._entradas),
+            }
+
+cache_reportes = CacheReportes(REPORTES_CACHE_TTL, REPORTES_CACHE_MAX)
+
+def _clave_cache(tipo, filtros):
+    return (tipo, resumen_mensual.activo()) + tuple(sorted(filtros.items()))
+
+def marca_actual():
+    cur = get_connection().cursor()
+    marca = resumen_mensual.marca(cur)
+    cur.close()
+    return marca
+
+def datos_grafico(filtros, marca, refrescar=False):
+    """get_data_for_chart con caché. Devuelve (df, edad); edad es None si se acaba de calcular."""
+    clave = _clave_cache("datos", filtros)
+    if not refrescar:
+        df, edad = cache_reportes.obtener(clave, marca)
+        if df is not None:
+            return df, edad
+
+    generacion = cache_reportes.generacion
+    df = get_data_for_chart(filtros)
+    if df is not None:
+        cache_reportes.guardar(clave, marca, df, generacion)
+    return df, None
+
+def opciones_filtros():
+    """Empresas, sucursales y áreas para los selects del formulario."""
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=DictCursor)
+    opciones = {}
+    for clave, tabla in (("empresas", "empresa"), ("sucursales", "sucursal"), ("areas", "areatrabajo")):
+        cur.execute(f"SELECT id, nombre FROM {tabla} ORDER BY nombre")
+        opciones[clave] = cur.fetchall()
+    cur.close()
+    conn.close()
+    return opciones
+
 @reportes_bp.route("/reportes/asistencia")
 def grafico_asistencia():
-    df = get_data_for_chart()
+    filtros = filtros_reporte(request.args)
+    vista = vista_reporte(request.args)
+    refrescar = request.args.get("refrescar") == "1"
+    parametros = dict(parametros_url(filtros), **vista)
+    contexto = dict(filtros=filtros, parametros=parametros, vistas=VISTAS, **vista, **opciones_filtros())
 
-    if df is None or df.empty:
-        return render_template("reportes/grafico_asistencia.html", chart_html=None)
-
-    fig = px.line(
-        df, x='mes_nombre', y='dias_asistidos', color='nombre_trabajador', markers=True,
-        title="Evolución de la Asistencia por Mes",
-        labels={
-            "mes_nombre": "Mes",
-            "dias_asistidos": "Dias asistidos",
-            "nombre_trabajador": "Trabajador"
-        }
+    marca = marca_actual()
+    clave_html = _clave_cache("html", dict(filtros, **vista))
+    guardado, edad = (None, None) if refrescar else cache_reportes.obtener(clave_html, marca)
+    if guardado is not None:
+        estado = "HIT"
+        chart_html, aviso = guardado
+    else:
+        generacion = cache_reportes.generacion
+        df, edad = datos_grafico(filtros, marca, refrescar)
+        estado = "MISS" if edad is None else "HIT-DATOS"
+        chart_html, aviso = None, None
+        if df is not None and not df.empty:
+            chart_html, aviso = generar_html_grafico(df, vista["vista"], vista["n"])
+            cache_reportes.guardar(clave_html, marca, (chart_html, aviso), generacion)
+
+    html = render_template(
+        "reportes/grafico_asistencia.html", chart_html=chart_html, aviso=aviso,
+        cache={"estado": estado, "edad": edad}, **contexto,
     )
-    fig.update_layout(xaxis_title="Mes del Año", yaxis_title="Dias asistidos", title_font_size=22, xaxis_tickangle=-45)
+    return html, 200, {"X-Cache": estado}
 
-    chart_html = fig.to_html(full_html=False, include_plotlyjs='cdn')
-    return render_template("reportes/grafico_asistencia.html", chart_html=chart_html)
+# ==========================================
+# Vistas del gráfico
+# ==========================================
+# Con una línea por trabajador el HTML crece con la dotación (miles de
+# trazas = megabytes y un navegador colgado). Las vistas agregadas reducen
+# las series a unas pocas:
+#   trabajador   una línea por trabajador (la vista original)
+#   sucursal     promedio de días asistidos por sucursal
+#   area         promedio por área (un trabajador cuenta en cada área de sus turnos)
+#   top/bottom   los N trabajadores con más/menos días en el rango
+#   percentiles  bandas P10-P90 y P25-P75 con la mediana, mes a mes
+# Si la vista por trabajador supera REPORTES_MAX_TRAZAS se muestra la de
+# percentiles; sobre REPORTES_WEBGL_PUNTOS se dibuja con WebGL, y un HTML
+# mayor a REPORTES_MAX_BYTES no se envía.
+VISTAS = {
+    "trabajador": "Por trabajador",
+    "sucursal": "Por sucursal",
+    "area": "Por área",
+    "top": "Top N (más asistencia)",
+    "bottom": "Bottom N (menos asistencia)",
+    "percentiles": "Bandas de percentiles",
+}
+REPORTES_TOP_DEFECTO = 10
+REPORTES_MAX_TRAZAS = int(os.getenv("REPORTES_MAX_TRAZAS", "200"))
+REPORTES_WEBGL_PUNTOS = int(os.getenv("REPORTES_WEBGL_PUNTOS", "2000"))
+REPORTES_MAX_BYTES = int(os.getenv("REPORTES_MAX_BYTES", str(3 * 1024 * 1024)))
+
+PERCENTILES = [("P10", 0.10), ("P25", 0.25), ("Mediana", 0.50), ("P75", 0.75), ("P90", 0.90)]
+
+def vista_reporte(args):
+    vista = args.get("vista") if args.get("vista") in VISTAS else "trabajador"
+    n = _parse_int(args.get("n")) or REPORTES_TOP_DEFECTO
+    return {"vista": vista, "n": max(1, min(n, REPORTES_MAX_TRAZAS))}
+
+def agregar_vista(df, vista, n):
+    """
+    Lleva el DataFrame por trabajador a la vista pedida. Devuelve un DataFrame
+    largo con columnas anio, mes_num, mes_nombre, serie y valor, y el título
+    del eje Y.
+    """
+    import pandas as pd
+
+    meses = ['anio', 'mes_num', 'mes_nombre']
+
+    if vista in ("top", "bottom"):
+        totales = df.groupby('trabajador_id')['dias_asistidos'].sum()
+        # Desempate estable por id para que el ranking no salte entre vistas
+        totales = totales.sort_index().sort_values(ascending=(vista == "bottom"), kind='mergesort')
+        df = df[df['trabajador_id'].isin(totales.index[:n])]
+        vista = "trabajador"
+
+    if vista == "trabajador":
+        largo = df[meses + ['nombre_trabajador', 'dias_asistidos']]
+        largo = largo.rename(columns={'nombre_trabajador': 'serie', 'dias_asistidos': 'valor'})
+        return largo, "Dias asistidos"
+
+    if vista in ("sucursal", "area"):
+        if vista == "area":
+            df = df.explode('areas').rename(columns={'areas': 'grupo'})
+        else:
+            df = df.rename(columns={'sucursal': 'grupo'})
+        df = df.assign(grupo=df['grupo'].fillna("Sin " + ("área" if vista == "area" else "sucursal")))
+        largo = (df.groupby(meses + ['grupo'], sort=False)['dias_asistidos'].mean()
+                   .round(2).reset_index()
+                   .rename(columns={'grupo': 'serie', 'dias_asistidos': 'valor'}))
+        return largo, "Promedio de días asistidos"
+
+    # percentiles
+    por_mes = df.groupby(meses, sort=False)['dias_asistidos']
+    partes = []
+    for nombre, q in PERCENTILES:
+        parte = por_mes.quantile(q).round(2).reset_index().rename(columns={'dias_asistidos': 'valor'})
+        partes.append(parte.assign(serie=nombre))
+    largo = pd.concat(partes, ignore_index=True)
+    return largo[meses + ['serie', 'valor']], "Dias asistidos (percentil entre trabajadores)"
+
+def vista_efectiva(df, vista):
+    """
+    (vista, aviso): con más de REPORTES_MAX_TRAZAS trabajadores la vista por
+    trabajador pasa a percentiles, en el gráfico y en el Excel.
+    """
+    if vista == "trabajador" and df['trabajador_id'].nunique() > REPORTES_MAX_TRAZAS:
+        return "percentiles", (
+            f"Hay {df['trabajador_id'].nunique()} trabajadores en el rango: se muestran bandas de "
+            f"percentiles. Usa Top/Bottom N o filtra por sucursal o área para ver líneas individuales.")
+    return vista, None
+
+def generar_html_grafico(df, vista, n):
+    """Devuelve (html, aviso). html es None si el gráfico supera REPORTES_MAX_BYTES."""
+    import plotly.express as px
+
+    vista, aviso = vista_efectiva(df, vista)
+    largo, titulo_y = agregar_vista(df, vista, n)
+    render_mode = "webgl" if len(largo) > REPORTES_WEBGL_PUNTOS else "svg"
+
+    if vista == "percentiles":
+        fig = figura_percentiles(largo, titulo_y)
+    else:
+        fig = px.line(
+            largo, x='mes_nombre', y='valor', color='serie', markers=True,
+            title="Evolución de la Asistencia por Mes",
+            labels={"mes_nombre": "Mes", "valor": titulo_y, "serie": VISTAS[vista].replace("Por ", "").capitalize()},
+            render_mode=render_mode,
+        )
+    fig.update_layout(xaxis_title="Mes del Año", yaxis_title=titulo_y, title_font_size=22, xaxis_tickangle=-45)
+
+    html = fig.to_html(full_html=False, include_plotlyjs='cdn')
+    if len(html) > REPORTES_MAX_BYTES:
+        return None, (f"El gráfico pesa {len(html) / 1024 / 1024:.1f} MB (máximo "
+                      f"{REPORTES_MAX_BYTES / 1024 / 1024:.1f} MB). Usa una vista agregada o acota el rango.")
+    return html, aviso
+
+def figura_percentiles(largo, titulo_y):
+    import plotly.graph_objects as go
+
+    ancho = largo.pivot_table(index=['anio', 'mes_num', 'mes_nombre'], columns='serie',
+                              values='valor', sort=True).reset_index()
+    x = ancho['mes_nombre']
+    fig = go.Figure()
+    for bajo, alto, opacidad in (("P10", "P90", 0.15), ("P25", "P75", 0.3)):
+        fig.add_trace(go.Scatter(x=x, y=ancho[bajo], mode='lines', line={'width': 0},
+                                 showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=x, y=ancho[alto], mode='lines', line={'width': 0}, fill='tonexty',
+                                 fillcolor=f'rgba(31, 119, 180, {opacidad})', name=f"{bajo}–{alto}"))
+    fig.add_trace(go.Scatter(x=x, y=ancho['Mediana'], mode='lines+markers', name="Mediana",
+                             line={'color': 'rgb(31, 119, 180)'}))
+    fig.update_layout(title="Evolución de la Asistencia por Mes (percentiles)", yaxis_title=titulo_y)
+    return fig
+
+# El gráfico del Excel es un gráfico nativo de xlsxwriter ligado a la hoja
+# "Resumen" (meses en filas, una serie de la vista por columna): no hace
+# falta renderizar nada en el servidor. Usa la misma vista que la página
+# (vista_efectiva), así que con muchos trabajadores el Resumen trae
+# percentiles en vez de miles de columnas. La imagen PNG de plotly (que
+# levanta kaleido y un navegador headless por descarga) queda solo con
+# ?formato_grafico=png.
+MAX_SERIES_EXCEL = 255  # límite de series por gráfico de Excel
+
+def insertar_grafico_nativo(writer, largo, titulo_y, hoja_datos, celda, aviso=None):
+    """
+    Escribe la hoja Resumen (una columna por serie de agregar_vista) y agrega
+    un gráfico de líneas ligado a ella. `aviso` (series reducidas o
+    recortadas) se escribe arriba de la tabla.
+    """
+    pivote = largo.pivot_table(
+        index=['anio', 'mes_num', 'mes_nombre'], columns='serie',
+        values='valor', aggfunc='sum', fill_value=0, sort=True,
+    ).reset_index(level=['anio', 'mes_num'], drop=True)
+    pivote.index.name = 'Mes'
+    if len(pivote.columns) > MAX_SERIES_EXCEL:
+        aviso = ((aviso + " ") if aviso else "") + (
+            f"El gráfico muestra las primeras {MAX_SERIES_EXCEL} de {len(pivote.columns)} series "
+            f"(máximo de Excel); la tabla las trae todas.")
+
+    # Con aviso la tabla empieza dos filas más abajo
+    fila0 = 2 if aviso else 0
+    pivote.to_excel(writer, sheet_name='Resumen', startrow=fila0)
+
+    hoja_resumen = writer.sheets['Resumen']
+    if aviso:
+        hoja_resumen.write(0, 0, aviso, writer.book.add_format({'bold': True, 'font_color': '#9C5700'}))
+    hoja_resumen.set_column(0, 0, max(len(m) for m in pivote.index) + 2)
+    hoja_resumen.freeze_panes(fila0 + 1, 1)
+
+    n_meses = len(pivote.index)
+    chart = writer.book.add_chart({'type': 'line'})
+    for col in range(1, min(len(pivote.columns), MAX_SERIES_EXCEL) + 1):
+        chart.add_series({
+            'name':       ['Resumen', fila0, col],
+            'categories': ['Resumen', fila0 + 1, 0, fila0 + n_meses, 0],
+            'values':     ['Resumen', fila0 + 1, col, fila0 + n_meses, col],
+            'marker':     {'type': 'circle', 'size': 5},
+        })
+    chart.set_title({'name': 'Evolución de la Asistencia por Mes'})
+    chart.set_x_axis({'name': 'Mes', 'num_font': {'rotation': -45}})
+    chart.set_y_axis({'name': titulo_y, 'min': 0})
+    chart.set_legend({'position': 'right'})
+    chart.set_size({'width': 960, 'height': 520})
+    writer.sheets[hoja_datos].insert_chart(celda, chart)
+
+def insertar_grafico_png(writer, df, hoja_datos, celda):
+    """Versión anterior: imagen estática de plotly (requiere kaleido)."""
+    import plotly.express as px
+
+    fig = px.line(df, x='mes_nombre', y='dias_asistidos', color='nombre_trabajador', markers=True, 
+                  title="Evolución de la Asistencia por Mes")
+    img_bytes = fig.to_image(format="png", width=800, height=500, scale=2)
+    writer.sheets[hoja_datos].insert_image(celda, 'grafico.png', {'image_data': io.BytesIO(img_bytes)})
 
 @reportes_bp.route("/reportes/descargar-grafico")
 def descargar_grafico_excel():
-    df = get_data_for_chart()
+    import pandas as pd
+
+    vista = vista_reporte(request.args)
+    df, _ = datos_grafico(filtros_reporte(request.args), marca_actual(), request.args.get("refrescar") == "1")
 
     if df is None or df.empty:
         flash("No hay datos suficientes para generar el reporte con gráfico.", "warning")
         return redirect(url_for("asistencia.listar_asistencias"))
 
-    fig = px.line(df, x='mes_nombre', y='dias_asistidos', color='nombre_trabajador', markers=True, 
-                  title="Evolución de la Asistencia por Mes")
-
     output = io.BytesIO()
     writer = pd.ExcelWriter(output, engine='xlsxwriter')
 
@@ -109,9 +514,12 @@ def descargar_grafico_excel():
     
     df_reporte.to_excel(writer, sheet_name='Datos de Asistencia', index=False)
     
-    img_bytes = fig.to_image(format="png", width=800, height=500, scale=2)
-    worksheet = writer.sheets['Datos de Asistencia']
-    worksheet.insert_image('E2', 'grafico.png', {'image_data': io.BytesIO(img_bytes)})
+    if request.args.get("formato_grafico") == "png":
+        insertar_grafico_png(writer, df, 'Datos de Asistencia', 'E2')
+    else:
+        nombre_vista, aviso = vista_efectiva(df, vista["vista"])
+        largo, titulo_y = agregar_vista(df, nombre_vista, vista["n"])
+        insertar_grafico_nativo(writer, largo, titulo_y, 'Datos de Asistencia', 'E2', aviso)
     
     writer.close()
     output.seek(0)
@@ -121,4 +529,4 @@ def descargar_grafico_excel():
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         as_attachment=True,
         download_name=f'reporte_asistencia_con_grafico_{date.today()}.xlsx'
-    )
\ No newline at end of file
+    )
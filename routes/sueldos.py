@@ -1,6 +1,10 @@
-from flask import Blueprint, request, render_template, redirect, url_for, flash
-from db import get_connection
+from flask import Blueprint, request, render_template, redirect, url_for, flash, jsonify
+from db import get_connection, independent_connection
+import jobs
+import resumen_mensual
 from psycopg2.extras import DictCursor
+from datetime import date, timedelta
+import os
 
 sueldos_bp = Blueprint("sueldos", __name__, template_folder="../templates")
 
@@ -17,76 +21,169 @@ def to_float_or_none(s):
         return None
 
 
+def _parse_int(valor):
+    try:
+        return int(valor) if valor not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _parse_fecha(valor):
+    try:
+        return date.fromisoformat(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def _sumar_meses(mes, n):
+    total = mes.year * 12 + mes.month - 1 + n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+# ==========================================
+# Período de liquidación
+# ==========================================
+#   ?periodo=mes&mes=2025-09                  mes completo (por defecto el actual)
+#   ?periodo=quincena&mes=2025-09&quincena=2  días 1-15 o 16-fin de mes
+#   ?periodo=rango&desde=2025-09-01&hasta=2025-09-30   (ambos inclusive)
+# Siempre se traduce a un rango semiabierto [desde, fin).
+PERIODOS = {"mes": "Mes", "quincena": "Quincena", "rango": "Rango de fechas"}
+
+
+def periodo_sueldos(args):
+    tipo = args.get("periodo") if args.get("periodo") in PERIODOS else "mes"
+    hoy = date.today()
+    mes = _parse_fecha(f"{args.get('mes')}-01") if args.get("mes") else None
+    mes = mes or hoy.replace(day=1)
+    quincena = 2 if args.get("quincena") == "2" else 1
+
+    if tipo == "quincena":
+        desde = mes if quincena == 1 else mes.replace(day=16)
+        fin = mes.replace(day=16) if quincena == 1 else _sumar_meses(mes, 1)
+        etiqueta = f"{'1ª' if quincena == 1 else '2ª'} quincena de {mes.strftime('%m/%Y')}"
+    elif tipo == "rango":
+        desde = _parse_fecha(args.get("desde")) or mes
+        hasta = _parse_fecha(args.get("hasta")) or (_sumar_meses(mes, 1) - timedelta(days=1))
+        if hasta < desde:
+            desde, hasta = hasta, desde
+        fin = hasta + timedelta(days=1)
+        etiqueta = f"{desde.strftime('%d/%m/%Y')} al {hasta.strftime('%d/%m/%Y')}"
+    else:
+        desde, fin = mes, _sumar_meses(mes, 1)
+        etiqueta = mes.strftime("%m/%Y")
+
+    return {
+        "tipo": tipo, "mes": mes, "quincena": quincena,
+        "desde": desde, "fin": fin, "hasta": fin - timedelta(days=1),
+        "etiqueta": etiqueta,
+        # Meses completos: se puede leer del resumen mensual
+        "meses_completos": desde.day == 1 and fin.day == 1,
+    }
+
+
+# Horas, ausencias, ausencias justificadas y atrasos del período por
+# trabajador. Desde asistencia es UNA pasada con agregación condicional sobre
+# las filas del rango (índice en asistencia.fecha; ver esquema.py). Si el
+# período son meses completos y el resumen mensual está activo
+# (resumen_mensual.py) se suman las filas de asistencia_mensual.
+_SQL_SUELDOS = """
+    WITH periodo AS ({periodo})
+    SELECT
+        r.trabajador_id,
+        r.trabajador,
+
+        -- horas, ausencias y atrasos del período calculados desde asistencia
+        COALESCE(p.horas, 0)                  AS horas,
+        COALESCE(p.ausencias, 0)              AS ausencias,
+        COALESCE(p.ausencias_justificadas, 0) AS ausencias_justificadas,
+        COALESCE(p.atrasos, 0)                AS atrasos,
+
+        -- valor_hora como número (1er elemento del array)
+        CASE
+          WHEN r.valor_hora IS NOT NULL 
+               AND array_length(r.valor_hora,1) >= 1
+            THEN (r.valor_hora)[1]::numeric
+          ELSE NULL
+        END AS valor_hora,
+
+        -- Sueldo calculado usando horas del período * valor_hora
+        CASE
+          WHEN r.valor_hora IS NOT NULL 
+               AND array_length(r.valor_hora,1) >= 1
+            THEN ROUND(
+                    COALESCE(p.horas,0) * (r.valor_hora)[1]::numeric
+                 , 2)
+          ELSE NULL
+        END AS sueldo_calculado,
+
+        -- Sueldo guardado como número (1er elemento del array "Sueldo")
+        CASE
+          WHEN r."Sueldo" IS NOT NULL 
+               AND array_length(r."Sueldo",1) >= 1
+            THEN (r."Sueldo")[1]::numeric
+          ELSE NULL
+        END AS sueldo_guardado
+
+    FROM public.rendimiento r
+    LEFT JOIN periodo p ON p.trabajador_id = r.trabajador_id
+    ORDER BY r.trabajador_id;
+"""
+
+SQL_SUELDOS = _SQL_SUELDOS.format(periodo="""
+        SELECT
+            a.trabajador_id,
+            SUM(EXTRACT(EPOCH FROM a.horas_trabajadas) / 3600.0)               AS horas,
+            COUNT(*) FILTER (WHERE a.is_asistencia = FALSE)                   AS ausencias,
+            COUNT(*) FILTER (WHERE a.is_asistencia = FALSE AND a.justificado) AS ausencias_justificadas,
+            COUNT(*) FILTER (WHERE a.hora_entrada > it.inicio)                AS atrasos
+        FROM public.asistencia a
+        -- inicio de turno del trabajador (el más temprano si tiene varios)
+        LEFT JOIN (
+            SELECT tt.trabajador_id, MIN(tu.horario_inicio) AS inicio
+            FROM public.turno_trabajador tt
+            JOIN public.turno tu ON tu.id = tt.turno_id
+            GROUP BY tt.trabajador_id
+        ) it ON it.trabajador_id = a.trabajador_id
+        WHERE a.fecha >= %(desde)s
+          AND a.fecha <  %(fin)s
+        GROUP BY a.trabajador_id
+    """)
+
+SQL_SUELDOS_RESUMEN = _SQL_SUELDOS.format(periodo="""
+        SELECT
+            trabajador_id,
+            SUM(horas_trabajadas)       AS horas,
+            SUM(ausencias)              AS ausencias,
+            SUM(ausencias_justificadas) AS ausencias_justificadas,
+            SUM(atrasos)                AS atrasos
+        FROM public.asistencia_mensual
+        WHERE mes >= %(desde)s
+          AND mes <  %(fin)s
+        GROUP BY trabajador_id
+    """)
+
+
 @sueldos_bp.route("/sueldos")
 def listar_sueldos():
+    periodo = periodo_sueldos(request.args)
+
     conn = get_connection()
     cur = conn.cursor(cursor_factory=DictCursor)
 
-    cur.execute("""
-        WITH horas_mes AS (
-            SELECT 
-                trabajador_id,
-                SUM(EXTRACT(EPOCH FROM horas_trabajadas) / 3600.0) AS horas_mes
-            FROM public.asistencia
-            WHERE fecha >= date_trunc('month', CURRENT_DATE)
-              AND fecha <  date_trunc('month', CURRENT_DATE) + INTERVAL '1 month'
-              AND horas_trabajadas IS NOT NULL
-            GROUP BY trabajador_id
-        ),
-        ausencias_mes AS (
-            SELECT 
-                trabajador_id,
-                COUNT(*) AS ausencias_mes
-            FROM public.asistencia
-            WHERE is_asistencia = FALSE
-              AND fecha >= date_trunc('month', CURRENT_DATE)
-              AND fecha <  date_trunc('month', CURRENT_DATE) + INTERVAL '1 month'
-            GROUP BY trabajador_id
-        )
-        SELECT
-            r.trabajador_id,
-            r.trabajador,
-
-            -- horas y ausencias del mes actual calculadas desde asistencia
-            COALESCE(h.horas_mes, 0)      AS horas,
-            COALESCE(a.ausencias_mes, 0)  AS ausencias,
-
-            -- valor_hora como número (1er elemento del array)
-            CASE
-              WHEN r.valor_hora IS NOT NULL 
-                   AND array_length(r.valor_hora,1) >= 1
-                THEN (r.valor_hora)[1]::numeric
-              ELSE NULL
-            END AS valor_hora,
-
-            -- Sueldo calculado usando horas del mes actual * valor_hora
-            CASE
-              WHEN r.valor_hora IS NOT NULL 
-                   AND array_length(r.valor_hora,1) >= 1
-                THEN ROUND(
-                        COALESCE(h.horas_mes,0) * (r.valor_hora)[1]::numeric
-                     , 2)
-              ELSE NULL
-            END AS sueldo_calculado,
-
-            -- Sueldo guardado como número (1er elemento del array "Sueldo")
-            CASE
-              WHEN r."Sueldo" IS NOT NULL 
-                   AND array_length(r."Sueldo",1) >= 1
-                THEN (r."Sueldo")[1]::numeric
-              ELSE NULL
-            END AS sueldo_guardado
-
-        FROM public.rendimiento r
-        LEFT JOIN horas_mes     h ON h.trabajador_id = r.trabajador_id
-        LEFT JOIN ausencias_mes a ON a.trabajador_id = r.trabajador_id
-        ORDER BY r.trabajador_id;
-    """)
+    if periodo["meses_completos"]:
+        resumen_mensual.ejecutar(cur, SQL_SUELDOS_RESUMEN, SQL_SUELDOS, periodo)
+    else:
+        cur.execute(SQL_SUELDOS, periodo)
 
     rows = cur.fetchall()
+    cur.execute("SELECT id, nombre FROM public.empresa ORDER BY nombre")
+    empresas = cur.fetchall()
+    cur.execute("SELECT id, nombre FROM public.sucursal ORDER BY nombre")
+    sucursales = cur.fetchall()
     cur.close()
     conn.close()
-    return render_template("sueldos/lista.html", data=rows)
+    return render_template("sueldos/lista.html", data=rows, periodo=periodo, periodos=PERIODOS,
+                           empresas=empresas, sucursales=sucursales)
 
 
 
@@ -141,33 +238,278 @@ def actualizar_sueldo():
     return redirect(url_for("sueldos.listar_sueldos"))
 
 
-@sueldos_bp.route("/sueldos/recalcular", methods=["POST"])
-def recalcular_sueldos():
+# ==========================================
+# Edición masiva
+# ==========================================
+# Misma semántica que actualizar_sueldo, fila por fila:
+#   • solo valor_hora  → guarda el valor y recalcula (horas × valor)
+#   • solo sueldo      → guarda ese monto sin recalcular
+#   • ambos            → guarda ambos
+# pero todas las filas van en un único UPDATE ... FROM unnest(...) y una sola
+# transacción. Las filas cuyo valor no cambia no se escriben.
+SUELDOS_LOTE_MAX = int(os.getenv("SUELDOS_LOTE_MAX", "5000"))
+
+# Cada fila de rendimiento se calcula con sus propias horas (un trabajador
+# puede tener varias) y cada fila de la entrada da exactamente un resultado.
+# "sueldo" es el que queda en sus filas; NULL si quedan con montos distintos.
+SQL_ACTUALIZAR_LOTE = """
+    WITH entrada AS (
+        SELECT *
+        FROM unnest(%(ids)s::int[], %(valores)s::numeric[], %(manuales)s::numeric[])
+             WITH ORDINALITY AS e(trabajador_id, valor_hora, sueldo_manual, orden)
+        WHERE valor_hora IS NOT NULL OR sueldo_manual IS NOT NULL
+    ),
+    nuevos AS (
+        SELECT e.trabajador_id,
+               CASE WHEN MIN(s.sueldo) = MAX(s.sueldo) THEN MIN(s.sueldo) END AS sueldo
+        FROM entrada e
+        JOIN public.rendimiento r ON r.trabajador_id = e.trabajador_id
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(e.sueldo_manual,
+                            ROUND(COALESCE(r.total_horas_trabajadas,0) * e.valor_hora, 2)) AS sueldo
+        ) s
+        GROUP BY e.trabajador_id
+    ),
+    actualizados AS (
+        UPDATE public.rendimiento r
+        SET valor_hora = CASE WHEN e.valor_hora IS NOT NULL THEN ARRAY[e.valor_hora]::numeric[]
+                              ELSE r.valor_hora END,
+            "Sueldo"   = ARRAY[COALESCE(e.sueldo_manual,
+                                        ROUND(COALESCE(r.total_horas_trabajadas,0) * e.valor_hora, 2))
+                              ]::numeric[]
+        FROM entrada e
+        WHERE r.trabajador_id = e.trabajador_id
+          AND (r.valor_hora, r."Sueldo") IS DISTINCT FROM (
+                CASE WHEN e.valor_hora IS NOT NULL THEN ARRAY[e.valor_hora]::numeric[]
+                     ELSE r.valor_hora END,
+                ARRAY[COALESCE(e.sueldo_manual,
+                               ROUND(COALESCE(r.total_horas_trabajadas,0) * e.valor_hora, 2))
+                     ]::numeric[])
+        RETURNING r.trabajador_id
+    )
+    SELECT e.trabajador_id,
+           CASE
+             WHEN EXISTS (SELECT 1 FROM actualizados a WHERE a.trabajador_id = e.trabajador_id)
+               THEN 'actualizado'
+             WHEN n.trabajador_id IS NOT NULL THEN 'sin_cambios'
+             ELSE 'no_encontrado'
+           END AS estado,
+           n.sueldo
+    FROM entrada e
+    LEFT JOIN nuevos n ON n.trabajador_id = e.trabajador_id
+    ORDER BY e.orden
+"""
+
+
+def _normalizar_cambios(filas):
+    """
+    Valida las tuplas (trabajador_id, valor_hora, sueldo_manual). Devuelve
+    ({trabajador_id: (valor_hora, sueldo_manual)}, resultados de las filas
+    que no llegan a la base). Si un trabajador se repite, vale la última fila.
+    """
+    cambios, descartados = {}, []
+    for fila in filas:
+        try:
+            trabajador_id = int(fila.get("trabajador_id"))
+        except (TypeError, ValueError):
+            descartados.append({"trabajador_id": fila.get("trabajador_id"), "estado": "invalido"})
+            continue
+        # En JSON los montos pueden llegar como número o como texto
+        valor_hora, sueldo_manual = (
+            to_float_or_none(None if fila.get(campo) is None else str(fila.get(campo)))
+            for campo in ("valor_hora", "sueldo_manual")
+        )
+        if valor_hora is None and sueldo_manual is None:
+            descartados.append({"trabajador_id": trabajador_id, "estado": "sin_datos"})
+            continue
+        if trabajador_id in cambios:
+            descartados.append({"trabajador_id": trabajador_id, "estado": "duplicado"})
+        cambios[trabajador_id] = (valor_hora, sueldo_manual)
+    return cambios, descartados
+
+
+def actualizar_sueldos_lote(cambios):
+    """Aplica los cambios en una sentencia y una transacción; devuelve el estado por fila."""
+    ids = list(cambios)
     conn = get_connection()
     cur = conn.cursor(cursor_factory=DictCursor)
     try:
-        cur.execute("""
-            UPDATE public.rendimiento r
-            SET "Sueldo" = ARRAY[
-                              ROUND(
-                                COALESCE(r.total_horas_trabajadas,0) *
-                                CASE
-                                  WHEN r.valor_hora IS NOT NULL 
-                                       AND array_length(r.valor_hora,1) >= 1
-                                    THEN (r.valor_hora)[1]::numeric
-                                  ELSE 0
-                                END
-                              , 2)
-                            ]::numeric[]
-            WHERE r.valor_hora IS NOT NULL
-              AND array_length(r.valor_hora,1) >= 1;
-        """)
+        cur.execute(SQL_ACTUALIZAR_LOTE, {
+            "ids": ids,
+            "valores": [cambios[i][0] for i in ids],
+            "manuales": [cambios[i][1] for i in ids],
+        })
+        resultados = [
+            {"trabajador_id": r["trabajador_id"], "estado": r["estado"],
+             "sueldo": float(r["sueldo"]) if r["sueldo"] is not None else None}
+            for r in cur.fetchall()
+        ]
         conn.commit()
-        flash("Sueldos recalculados para todos los trabajadores con valor_hora.", "success")
-    except Exception as e:
+        return resultados
+    except Exception:
         conn.rollback()
-        flash(f"Error: {e}", "danger")
+        raise
     finally:
         cur.close()
         conn.close()
+
+
+@sueldos_bp.route("/sueldos/actualizar-lote", methods=["POST"])
+def actualizar_sueldos_masivo():
+    """
+    Formulario de edición masiva (listas trabajador_id / valor_hora /
+    sueldo_manual) o JSON: {"cambios": [{"trabajador_id", "valor_hora", "sueldo_manual"}, ...]}.
+    """
+    es_json = request.is_json
+    if es_json:
+        cuerpo = request.get_json(silent=True) or {}
+        filas = cuerpo.get("cambios") if isinstance(cuerpo, dict) else None
+        if not isinstance(filas, list) or not all(isinstance(f, dict) for f in filas):
+            return jsonify({"error": "Se esperaba {\"cambios\": [{...}, ...]}."}), 400
+    else:
+        filas = [
+            {"trabajador_id": t, "valor_hora": v, "sueldo_manual": m}
+            for t, v, m in zip(request.form.getlist("trabajador_id"),
+                               request.form.getlist("valor_hora"),
+                               request.form.getlist("sueldo_manual"))
+        ]
+
+    if len(filas) > SUELDOS_LOTE_MAX:
+        mensaje = f"Máximo {SUELDOS_LOTE_MAX} filas por envío."
+        if es_json:
+            return jsonify({"error": mensaje}), 413
+        flash(mensaje, "danger")
+        return redirect(url_for("sueldos.listar_sueldos"))
+
+    cambios, resultados = _normalizar_cambios(filas)
+    try:
+        if cambios:
+            resultados = actualizar_sueldos_lote(cambios) + resultados
+    except Exception as e:
+        print(f"Error en edición masiva de sueldos: {e}")
+        if es_json:
+            return jsonify({"error": str(e)}), 500
+        flash(f"Error al actualizar: {e}", "danger")
+        return redirect(url_for("sueldos.listar_sueldos"))
+
+    resumen = {}
+    for r in resultados:
+        resumen[r["estado"]] = resumen.get(r["estado"], 0) + 1
+    if es_json:
+        return jsonify({"resumen": resumen, "resultados": resultados})
+
+    if not cambios:
+        flash("No hay cambios que guardar.", "warning")
+    else:
+        detalle = ", ".join(f"{n} {estado.replace('_', ' ')}" for estado, n in sorted(resumen.items()))
+        flash(f"Edición masiva: {detalle}.", "success" if resumen.get("actualizado") else "info")
     return redirect(url_for("sueldos.listar_sueldos"))
+
+
+# ==========================================
+# Recalcular sueldos (trabajo en segundo plano)
+# ==========================================
+# Sueldo = total_horas_trabajadas × valor_hora. Se recorre rendimiento por
+# trabajador_id en bloques de SUELDOS_BLOQUE trabajadores (keyset, sin OFFSET), con
+# un commit por bloque: los bloqueos de fila duran solo lo que tarda el bloque
+# y el request responde de inmediato. Solo se escriben las filas cuyo sueldo
+# cambia (IS DISTINCT FROM). Se puede acotar por empresa o sucursal; cada
+# alcance es un trabajo distinto, con su propio estado.
+SUELDOS_BLOQUE = int(os.getenv("SUELDOS_BLOQUE", "500"))
+TRABAJO_RECALCULAR = "recalcular_sueldos"
+
+
+def _trabajo_recalcular(empresa, sucursal):
+    return f"{TRABAJO_RECALCULAR}:{empresa or 'todas'}:{sucursal or 'todas'}"
+
+
+_ALCANCE_RENDIMIENTO = """
+    FROM public.rendimiento r
+    LEFT JOIN public.trabajador t ON t.id = r.trabajador_id
+    LEFT JOIN public.sucursal   s ON s.id = t.sucursal_id
+    WHERE r.valor_hora IS NOT NULL
+      AND array_length(r.valor_hora,1) >= 1
+      AND (%(empresa)s::int  IS NULL OR s.empresa_id  = %(empresa)s)
+      AND (%(sucursal)s::int IS NULL OR t.sucursal_id = %(sucursal)s)
+"""
+
+# El bloque son trabajadores (DISTINCT: el keyset avanza por trabajador_id y
+# no debe cortar a uno a medias). El UPDATE repite el filtro de valor_hora:
+# otras filas de rendimiento del mismo trabajador sin valor/hora quedarían
+# con ARRAY[NULL].
+SQL_RECALCULAR_BLOQUE = """
+    WITH bloque AS (
+        SELECT DISTINCT r.trabajador_id
+        """ + _ALCANCE_RENDIMIENTO + """
+          AND r.trabajador_id > %(ultimo)s
+        ORDER BY r.trabajador_id
+        LIMIT %(bloque)s
+    ),
+    cambiados AS (
+        UPDATE public.rendimiento r
+        SET "Sueldo" = ARRAY[
+                          ROUND(COALESCE(r.total_horas_trabajadas,0) * (r.valor_hora)[1]::numeric, 2)
+                        ]::numeric[]
+        FROM bloque b
+        WHERE r.trabajador_id = b.trabajador_id
+          AND r.valor_hora IS NOT NULL
+          AND array_length(r.valor_hora,1) >= 1
+          AND r."Sueldo" IS DISTINCT FROM ARRAY[
+                          ROUND(COALESCE(r.total_horas_trabajadas,0) * (r.valor_hora)[1]::numeric, 2)
+                        ]::numeric[]
+        RETURNING r.trabajador_id
+    )
+    SELECT (SELECT COUNT(*) FROM bloque),
+           (SELECT MAX(trabajador_id) FROM bloque),
+           (SELECT COUNT(*) FROM cambiados)
+"""
+
+
+def recalcular_sueldos_lote(trabajo, empresa=None, sucursal=None):
+    alcance = {"empresa": empresa, "sucursal": sucursal}
+    with independent_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(DISTINCT r.trabajador_id) " + _ALCANCE_RENDIMIENTO, alcance)
+        trabajo.total = cur.fetchone()[0]
+        cur.close()
+
+    ultimo = 0
+    while True:
+        with independent_connection() as conn:  # un commit por bloque
+            cur = conn.cursor()
+            cur.execute(SQL_RECALCULAR_BLOQUE, dict(alcance, ultimo=ultimo, bloque=SUELDOS_BLOQUE))
+            procesados, max_id, cambiados = cur.fetchone()
+            cur.close()
+        if not procesados:
+            break
+        trabajo.avanzar(procesados=procesados, cambiados=cambiados)
+        ultimo = max_id
+
+    trabajo.mensaje = f"Cambiaron {trabajo.cambiados} sueldos de {trabajo.procesados} trabajadores."
+
+
+@sueldos_bp.route("/sueldos/recalcular", methods=["POST"])
+def recalcular_sueldos():
+    empresa = _parse_int(request.form.get("empresa"))
+    sucursal = _parse_int(request.form.get("sucursal"))
+    trabajo, nuevo = jobs.lanzar(_trabajo_recalcular(empresa, sucursal), recalcular_sueldos_lote,
+                                 empresa=empresa, sucursal=sucursal)
+    if nuevo:
+        flash("Recalculando sueldos en segundo plano.", "info")
+    else:
+        flash("Ya hay un recálculo de sueldos en curso para esa empresa y sucursal.", "warning")
+    return redirect(url_for("sueldos.listar_sueldos"))
+
+
+@sueldos_bp.route("/sueldos/recalcular/estado")
+def estado_recalcular_sueldos():
+    """
+    Con ?empresa= y/o ?sucursal=, el último recálculo de ese alcance; sin
+    filtros, el último de cada alcance en {"trabajos": [...]}.
+    """
+    empresa = _parse_int(request.args.get("empresa"))
+    sucursal = _parse_int(request.args.get("sucursal"))
+    if empresa is None and sucursal is None:
+        return jsonify({"trabajos": [t.como_dict() for t in jobs.ultimos(TRABAJO_RECALCULAR)]})
+    trabajo = jobs.ultimo(_trabajo_recalcular(empresa, sucursal))
+    return jsonify(trabajo.como_dict() if trabajo else {"estado": "sin_trabajos"})
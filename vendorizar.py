@@ -0,0 +1,56 @@
+"""
+Copia a MiApiLogin los módulos que comparte con la app principal.
+
+MiApiLogin se despliega sola (solo su carpeta llega a Azure), así que no
+puede importar desde la raíz del repo. La fuente es la de la raíz; la copia
+en MiApiLogin no se versiona y se genera con este script antes de levantar
+o desplegar las funciones (lo hacen las tareas de .vscode). Uso:
+    python vendorizar.py               # copia los módulos compartidos
+    python vendorizar.py --verificar   # sale con código 1 si alguna copia falta o difiere
+"""
+import filecmp
+import os
+import shutil
+import sys
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+DESTINO = os.path.join(RAIZ, "MiApiLogin")
+
+COMPARTIDOS = [
+    "instrumentacion.py",
+]
+
+
+def diferentes():
+    """Módulos compartidos cuya copia en MiApiLogin falta o no es igual a la fuente."""
+    return [
+        nombre for nombre in COMPARTIDOS
+        if not os.path.exists(os.path.join(DESTINO, nombre))
+        or not filecmp.cmp(os.path.join(RAIZ, nombre), os.path.join(DESTINO, nombre), shallow=False)
+    ]
+
+
+def vendorizar():
+    """Copia los módulos que cambiaron; devuelve sus nombres."""
+    copiados = diferentes()
+    for nombre in copiados:
+        shutil.copyfile(os.path.join(RAIZ, nombre), os.path.join(DESTINO, nombre))
+    return copiados
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verificar", action="store_true",
+                        help="no copiar; salir con error si alguna copia falta o difiere")
+    args = parser.parse_args()
+
+    if args.verificar:
+        faltan = diferentes()
+        for nombre in faltan:
+            print(f"MiApiLogin/{nombre} no coincide con {nombre} (ejecuta `python vendorizar.py`).")
+        sys.exit(1 if faltan else 0)
+
+    copiados = vendorizar()
+    print(f"Copiados a MiApiLogin: {', '.join(copiados)}." if copiados else "MiApiLogin al día.")